@@ -1,7 +1,55 @@
-from src.core.environment.orderbook import OrderBook
+import calendar
+from datetime import datetime
+from numbers import Integral
+import numpy as np
+from src.core.environment.orderbook import OrderBook, TickOrderBook
 from decimal import Decimal
 
 
+def to_epoch_ms(t):
+    """ Converts a datetime, a '%Y-%m-%d %H:%M:%S(.%f)' string or epoch milliseconds into integer epoch ms (UTC) """
+
+    if isinstance(t, Integral):
+        return int(t)
+    if isinstance(t, str):
+        try:
+            t = datetime.strptime(t, '%Y-%m-%d %H:%M:%S.%f')
+        except ValueError:
+            t = datetime.strptime(t, '%Y-%m-%d %H:%M:%S')
+    if isinstance(t, datetime):
+        return calendar.timegm(t.utctimetuple()) * 1000 + t.microsecond // 1000
+    raise TypeError("Can't convert {} to epoch milliseconds".format(type(t).__name__))
+
+
+def infer_tick_size(values):
+    """ Infers the tick (or lot) size of prices (or quantities) from their maximal number of decimal places """
+
+    exponent = min(Decimal(str(v)).normalize().as_tuple().exponent for v in np.asarray(values).ravel().tolist())
+    return Decimal(1).scaleb(min(exponent, 0))
+
+
+def level_depletion(levels):
+    """ Quantity taken out of the book between consecutive snapshots of the (n, 4, depth) 'levels' (ask prices, ask
+        quantities, bid prices, bid quantities), as an array of n - 1.
+
+        A level counts as depleted by its whole quantity once the best price of its side moved through it, and by the
+        decrease of its quantity if it is still the best level. This is a proxy for the traded volume, which isn't
+        part of the LOB data.
+    """
+
+    previous, current = levels[:-1], levels[1:]
+    ask_prices, ask_quantities = previous[:, 0], previous[:, 1]
+    bid_prices, bid_quantities = previous[:, 2], previous[:, 3]
+    best_ask, best_ask_quantity = current[:, 0, :1], current[:, 1, :1]
+    best_bid, best_bid_quantity = current[:, 2, :1], current[:, 3, :1]
+
+    depleted = np.where(ask_prices < best_ask, ask_quantities, 0) + \
+               np.where(ask_prices == best_ask, np.maximum(ask_quantities - best_ask_quantity, 0), 0) + \
+               np.where(bid_prices > best_bid, bid_quantities, 0) + \
+               np.where(bid_prices == best_bid, np.maximum(bid_quantities - best_bid_quantity, 0), 0)
+    return depleted.sum(axis=1)
+
+
 def split_book_to_orders(current_book, time, depth):
     """ Splits existing order book data into individual bid and ask orders """
 
@@ -38,31 +86,20 @@ def split_book_to_orders(current_book, time, depth):
     return bid_orders, ask_orders, all_orders
 
 
-def raw_to_order_book(current_book, time, depth):
-    """ Convert the raw LOB data into an OrderBook object """
+def raw_to_order_book(current_book, time, depth, tick_size=None, lot_size=None):
+    """ Convert the raw LOB data into an OrderBook object, or a TickOrderBook if 'tick_size' and 'lot_size' are given """
 
-    # transfer numerical data to orders
-    _, _, all_orders = split_book_to_orders(current_book, time, depth)
-    order_book = OrderBook()
-    for orders in all_orders:
-        _, _ = order_book.process_order(orders, False, False)
+    current_book = np.asarray(current_book)
+    depth = min(depth, current_book.shape[1])
+    # snapshots are sorted and uncrossed, so the levels are bulk loaded rather than matched one by one
+    if tick_size is not None and lot_size is not None:
+        order_book = TickOrderBook.from_arrays(current_book[0, :depth], current_book[1, :depth],
+                                               current_book[2, :depth], current_book[3, :depth],
+                                               timestamp=time, tick_size=tick_size, lot_size=lot_size)
+    else:
+        order_book = OrderBook.from_arrays(current_book[0, :depth], current_book[1, :depth],
+                                           current_book[2, :depth], current_book[3, :depth],
+                                           timestamp=time)
 
-    # place orders in OrderBook class
-    """
-    counter = 1
-    order_book = OrderBook()
-    for bids in bid_orders:
-        _, _ = order_book.process_order(bids, False, False)
-        counter += 1
-        if counter > depth:
-            break
-
-    counter = 1
-    for asks in ask_orders:
-        _, _ = order_book.process_order(asks, False, False)
-        counter += 1
-        if counter > depth:
-            break
-    """
     # check that the order book has been generated correctly and nothing has been cancelled...
     return order_book
\ No newline at end of file
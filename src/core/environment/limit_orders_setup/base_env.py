@@ -8,11 +8,14 @@ from gym.utils import seeding
 from decimal import Decimal
 from abc import ABC
 
-from src.core.environment.limit_orders_setup.execution_algo import TWAPAlgo, RLAlgo
+from src.core.environment.limit_orders_setup.execution_algo import TWAPAlgo, VWAPAlgo, POVAlgo, RLAlgo, \
+    from_lots, scale_lots
+from src.core.environment.limit_orders_setup.benchmark_cache import BenchmarkCache
 
 DEFAULT_ENV_CONFIG = {'obs_config': {"lob_depth": 5,
                                      "nr_of_lobs": 5,
-                                     "norm": True},
+                                     "norm": True,
+                                     "obs_buffers": 2},
                       "train_config": {
                           "train": True,
                           "symbol": 'btcusdt',
@@ -35,10 +38,20 @@ DEFAULT_ENV_CONFIG = {'obs_config': {"lob_depth": 5,
                                        'second_low': 0,
                                        'second_high': 59},
                       'exec_config': {'exec_times': [5, 10, 15, 30, 60, 120, 240],
-                                      'delete_vol': False},
+                                      'delete_vol': False,
+                                      'precompute_benchmark': False,
+                                      'benchmark_cache_size': 0,
+                                      'benchmark_cache_dir': None,
+                                      'benchmark_algo': 'twap',
+                                      'participation_rate': 0.1},
                       'reset_config': {'reset_num_episodes': 1,},
                       'seed_config': {'seed': 0,},}
 
+# benchmark algos selectable by the 'benchmark_algo' of the exec_config
+BENCHMARK_ALGOS = {'twap': TWAPAlgo,
+                   'vwap': VWAPAlgo,
+                   'pov': POVAlgo}
+
 
 def lob_to_numpy(lob, depth, norm_price=None, norm_vol_bid=None, norm_vol_ask=None):
     bid_prices = lob.bids.prices[-depth:]
@@ -62,6 +75,72 @@ def lob_to_numpy(lob, depth, norm_price=None, norm_vol_bid=None, norm_vol_ask=No
                                   np.array(ask_volumes)), axis=0)
     return prices, volumes
 
+def lob_window_to_numpy(levels, depth):
+    # vectorised lob_to_numpy for a (n, 4, lob_depth) window of raw LOB levels, rows are ordered like lob_to_numpy
+    # i.e. bid levels from the worst to the best price followed by ask levels from the best to the worst price
+    prices = np.concatenate((levels[..., 2, depth-1::-1], levels[..., 0, :depth]), axis=-1)
+    volumes = np.concatenate((levels[..., 3, depth-1::-1], levels[..., 1, :depth]), axis=-1)
+    return prices, volumes
+
+class LobWindowBuffer(object):
+    """ Ring buffer of the price and volume rows (as returned by lob_window_to_numpy) and the mid prices of the
+        last 'size' snapshots of a data feed, keyed by row index. Moving the window forward only converts the rows
+        which weren't in the previous window, jumping back or too far ahead refills it. """
+
+    def __init__(self, size, depth):
+        self.size = size
+        self.depth = depth
+        self.prices = np.zeros((size, 2 * depth))
+        self.volumes = np.zeros((size, 2 * depth))
+        self.mids = np.zeros(size)
+        self.end_row = None # the rows [end_row - size, end_row) are buffered
+        self._data = None # data the rows refer to
+
+    def window(self, data_feed, end_row, prices_out=None, volumes_out=None, rescale=False):
+        """ Prices, volumes and mid prices of the rows [end_row - size, end_row) of 'data_feed', the prices and
+            volumes are written to 'prices_out' and 'volumes_out' if given and min-max rescaled if 'rescale' """
+
+        start_row = end_row - self.size
+        if start_row < 0:
+            # shorter window at the start of the data, not buffered
+            _, levels = data_feed.lob_window(start_row, end_row)
+            prices, volumes = lob_window_to_numpy(levels, self.depth)
+            return (rotated_rows(prices, 0, prices_out, rescale), rotated_rows(volumes, 0, volumes_out, rescale),
+                    (levels[:, 0, 0] + levels[:, 2, 0]) / 2)
+
+        first_new_row = start_row
+        if self._data is data_feed.data and self.end_row is not None and start_row <= self.end_row <= end_row:
+            first_new_row = self.end_row
+        if first_new_row < end_row:
+            _, levels = data_feed.lob_window(first_new_row, end_row)
+            positions = np.arange(first_new_row, end_row) % self.size
+            self.prices[positions], self.volumes[positions] = lob_window_to_numpy(levels, self.depth)
+            self.mids[positions] = (levels[:, 0, 0] + levels[:, 2, 0]) / 2
+        self.end_row = end_row
+        self._data = data_feed.data
+
+        # the buffer holds exactly the rows of the window, the oldest one at the position of 'start_row'
+        first = start_row % self.size
+        return (rotated_rows(self.prices, first, prices_out, rescale),
+                rotated_rows(self.volumes, first, volumes_out, rescale),
+                np.roll(self.mids, -first))
+
+
+def rotated_rows(rows, first, out=None, rescale=False):
+    """ The rows of 'rows' from row 'first' onwards followed by the rows before it, written to 'out' if given.
+        If 'rescale', they are min-max rescaled, computing the differences in the dtype of 'rows' before they are
+        cast to the dtype of 'out', so that e.g. float32 outputs keep the precision of the float64 prices """
+
+    if out is None:
+        out = np.empty_like(rows)
+    low, high = (np.min(rows), np.max(rows)) if rescale else (0, None)
+    np.subtract(rows[first:], low, out=out[:len(rows) - first])
+    np.subtract(rows[:first], low, out=out[len(rows) - first:])
+    if rescale:
+        np.divide(out, high - low, out=out)
+    return out
+
+
 def min_max_rescaling(array):
     min = np.min(array)
     max = np.max(array)
@@ -81,10 +160,20 @@ class BaseEnv(gym.Env, ABC):
         self.broker = broker
         self.config = self.add_default_dict(config)
         self._validate_config()
+        self.benchmark_cache = None
+        cache_size = self.config['exec_config'].get('benchmark_cache_size', 0)
+        cache_dir = self.config['exec_config'].get('benchmark_cache_dir', None)
+        if cache_size or cache_dir is not None:
+            self.benchmark_cache = BenchmarkCache(maxsize=cache_size, cache_dir=cache_dir)
         self.reset_counter = 0
         self.next_data_counter = 0
+        self.lob_window_buffer = LobWindowBuffer(self.config['obs_config']['nr_of_lobs'],
+                                                 self.config['obs_config']['lob_depth'])
         # self.reset()
         self.build_observation_space()
+        self.obs_buffers = [np.empty(self.observation_space.shape[0], dtype=np.float32)
+                            for _ in range(self.config['obs_config'].get('obs_buffers', 2))]
+        self.obs_buffer_idx = 0
         self.action_space = action_space
         try:
             self.seed(config['env_config']['seed_config']['seed'])
@@ -103,15 +192,22 @@ class BaseEnv(gym.Env, ABC):
         self.reset_counter += 1
 
         # instantiate benchmark algo
-        self.broker.benchmark_algo = TWAPAlgo(trade_direction=self.trade_dir,
-                                              volume=self.volume,
-                                              no_of_slices=self.no_of_slices,
-                                              bucket_placement_func=self.bucket_func,
-                                              start_time=self.start_time,
-                                              end_time=str(datetime.strptime(self.start_time, '%Y-%m-%d %H:%M:%S') +
-                                                            timedelta(minutes=self.exec_time)),
-                                              rand_bucket_bounds_width=self.rand_bucket_bounds_width,
-                                              broker_data_feed=self.broker.data_feed)
+        benchmark_algo = self.config['exec_config'].get('benchmark_algo', 'twap')
+        benchmark_kwargs = {}
+        if benchmark_algo == 'pov':
+            benchmark_kwargs['participation_rate'] = self.config['exec_config'].get('participation_rate', 0.1)
+        benchmark_algo_cls = BENCHMARK_ALGOS[benchmark_algo]
+        self.broker.benchmark_algo = benchmark_algo_cls(trade_direction=self.trade_dir,
+                                                        volume=self.volume,
+                                                        no_of_slices=self.no_of_slices,
+                                                        bucket_placement_func=self.bucket_func,
+                                                        start_time=self.start_time,
+                                                        end_time=str(datetime.strptime(self.start_time,
+                                                                                       '%Y-%m-%d %H:%M:%S') +
+                                                                     timedelta(minutes=self.exec_time)),
+                                                        rand_bucket_bounds_width=self.rand_bucket_bounds_width,
+                                                        broker_data_feed=self.broker.data_feed,
+                                                        **benchmark_kwargs)
 
         # reset the broker with the new benchmark_algo
         self.broker.reset(self.broker.benchmark_algo)
@@ -133,7 +229,14 @@ class BaseEnv(gym.Env, ABC):
         self.bucket_time = self.event_rl["time"]
         self.bucket_time_bmk, self.bucket_time_rl = None, None
 
+        # the benchmark does not depend on the actions, so it can be simulated once for the whole episode
+        self.bmk_trajectory = None
+        if self.config['exec_config'].get('precompute_benchmark', False) or self.benchmark_cache is not None:
+            self._precompute_benchmark()
+
         self.mid_pxs = []
+        self.broker.set_vwap_checkpoint('step')
+        self.broker.set_vwap_checkpoint('bucket')
 
         # To build the first observation we need to reset the datafeed to the timestamp of the first algo_event
         self.state_idx = 0
@@ -210,18 +313,23 @@ class BaseEnv(gym.Env, ABC):
         action = self._convert_action(action)
         vol_to_trade = self.infer_volume_from_action(action)
         # Update the volumes_per_trade
-        self.broker.rl_algo.volumes_per_trade[self.broker.rl_algo.bucket_idx][self.broker.rl_algo.order_idx] = vol_to_trade
+        self.broker.rl_algo.volumes_per_trade_lots[self.broker.rl_algo.bucket_idx, self.broker.rl_algo.order_idx] = vol_to_trade
 
         # simulate both benchmark and rl algo until before the next action is placed...
         self.event_time_prev = self.event_bmk['time']
         self.bucket_time_prev = self.bucket_time
+        self.broker.set_vwap_checkpoint('step')
 
-        self.event_bmk, self.done_bmk, self.lob_bmk = self._step_algo(algo_type='benchmark')
+        if self.bmk_trajectory is None:
+            self.event_bmk, self.done_bmk, self.lob_bmk = self._step_algo(algo_type='benchmark')
+        else:
+            self._replay_benchmark_step()
         self.event_rl, self.done_rl, self.lob_rl = self._step_algo(algo_type='rl', volume=vol_to_trade)
 
         if self.done_bmk != self.done_rl:
             raise ValueError("Benchmark and RL algo have finished at different times !!!")
-        if self.event_rl['time'] != self.event_bmk['time']:
+        # a precomputed benchmark steps through the events of the same schedule by construction
+        if self.bmk_trajectory is None and self.event_rl['time'] != self.event_bmk['time']:
             raise ValueError("Benchmark and RL algo have events at different timestamps !!!")
 
         if len(self.broker.trade_logs["rl_algo"]) == 0:
@@ -236,6 +344,8 @@ class BaseEnv(gym.Env, ABC):
         self.done = self.done_rl
         self.reward = self.reward_func()
         self.info = {}
+        if self.bucket_time != self.bucket_time_prev:
+            self.broker.set_vwap_checkpoint('bucket')
 
         self.state_idx += 1
         if not self.done:
@@ -281,17 +391,76 @@ class BaseEnv(gym.Env, ABC):
 
         return event, done, lob
 
+    def _precompute_benchmark(self):
+        """ Simulates the benchmark algo until it is done and stores the state after each step, so that step()
+            only has to simulate the RL algo. The benchmark trade logs seen by the broker are views on the full
+            logs, which are moved forward by _replay_benchmark_step(). With a benchmark_cache the simulation is
+            skipped if the same execution was simulated before.
+        """
+
+        algo = self.broker.benchmark_algo
+        key, entry = None, None
+        if self.benchmark_cache is not None:
+            key = BenchmarkCache.key(self.broker.data_feed, algo, self.broker.delete_vol)
+            entry = self.benchmark_cache.get(key)
+
+        if entry is None:
+            entry = self._simulate_benchmark()
+            if key is not None:
+                self.benchmark_cache.put(key, entry)
+        else:
+            BenchmarkCache.restore_algo_state(algo, entry['algo_state'])
+
+        self.bmk_trajectory = entry['trajectory']
+        self.bmk_logs = entry['trade_log']
+        self.bmk_step = 0
+        self.broker.trade_logs['benchmark_algo'] = self.bmk_logs.head(0)
+
+    def _simulate_benchmark(self):
+        """ Runs the benchmark part of step() until the benchmark is done, returns the entry stored by the cache """
+
+        start = (self.event_bmk, self.done_bmk, self.lob_bmk)
+        trajectory = []
+        while not self.done_bmk:
+            self.state_idx = 0
+            self.event_bmk, self.done_bmk, self.lob_bmk = self._step_algo(algo_type='benchmark')
+            bucket_bound = self.state_idx > 0
+            trajectory.append({'event': self.event_bmk,
+                               'done': self.done_bmk,
+                               'bucket_time': self.bucket_time_bmk,
+                               'bucket_event': self.event_bmk_bucket if bucket_bound else None,
+                               'state_idx_step': self.state_idx,
+                               'n_logs': len(self.broker.trade_logs['benchmark_algo'])})
+
+        # rewind to the state after reset, the state_idx is reset by the caller
+        self.event_bmk, self.done_bmk, self.lob_bmk = start
+        self.bucket_time_bmk = None
+        return {'trajectory': trajectory,
+                'trade_log': self.broker.trade_logs['benchmark_algo'],
+                'algo_state': BenchmarkCache.algo_state(self.broker.benchmark_algo)}
+
+    def _replay_benchmark_step(self):
+        """ Counterpart of _step_algo(algo_type='benchmark') for a precomputed benchmark """
+
+        step = self.bmk_trajectory[self.bmk_step]
+        self.bmk_step += 1
+        self.event_bmk, self.done_bmk = step['event'], step['done']
+        self.bucket_time_bmk = step['bucket_time']
+        if step['state_idx_step']:
+            self.event_bmk_bucket = step['bucket_event']
+            self.state_idx += step['state_idx_step']
+        self.broker.trade_logs['benchmark_algo'] = self.bmk_logs.head(step['n_logs'])
+
     def infer_volume_from_action(self, action):
-        """ Logic for inferring the volume from the action placed in the env """
-        current_executing_volume = self.broker.rl_algo.volumes_per_trade[self.broker.rl_algo.bucket_idx][self.broker.rl_algo.order_idx]
-        vol_to_add = Decimal(str(action)) * \
-                       self.broker.benchmark_algo.volumes_per_trade_default[self.broker.rl_algo.bucket_idx][self.broker.rl_algo.order_idx]# We add {0.8,1,1.2}*TWAP's volume
-        vol_to_trade = current_executing_volume + vol_to_add
-        factor = 10 ** (- self.broker.benchmark_algo.tick_size.as_tuple().exponent)
-        vol_to_trade = Decimal(str(math.floor(vol_to_trade * factor) / factor))
-        if vol_to_trade > self.broker.rl_algo.bucket_vol_remaining[self.broker.rl_algo.bucket_idx]:
-            vol_to_trade = self.broker.rl_algo.bucket_vol_remaining[self.broker.rl_algo.bucket_idx]
-        return vol_to_trade
+        """ Logic for inferring the volume (in lots) from the action placed in the env """
+        rl_algo = self.broker.rl_algo
+        current_executing_volume = int(rl_algo.volumes_per_trade_lots[rl_algo.bucket_idx, rl_algo.order_idx])
+        vol_to_add = scale_lots(self.broker.benchmark_algo.volumes_per_trade_default_lots[rl_algo.bucket_idx,
+                                                                                        rl_algo.order_idx],
+                                action) # We add {0.8,1,1.2}*TWAP's volume
+        # round down to the tick size
+        vol_to_trade = (current_executing_volume + vol_to_add) // rl_algo.tick_lots * rl_algo.tick_lots
+        return min(vol_to_trade, int(rl_algo.bucket_vol_remaining_lots[rl_algo.bucket_idx]))
 
     def build_observation_space(self):
 
@@ -339,70 +508,51 @@ class BaseEnv(gym.Env, ABC):
     def build_observation(self, event_time, data_feed):
         # Build observation using the history of order book data / data generated by the RL algo
 
-        data_feed.reset(time=event_time.strftime("%Y-%m-%d %H:%M:%S.%f"))
-        past_dts, past_lobs = data_feed.past_lob_snapshots(no_of_past_lobs=self.config['obs_config']['nr_of_lobs'])
+        # window of the snapshots up to 'event_time', read at a cursor without changing the state of the feed
+        # the rows converted for the previous observation are taken from the rolling window
+        row = data_feed.row_after(event_time)
+        n_rows = min(row, self.config['obs_config']['nr_of_lobs']) # fewer rows at the start of the data
+        n_lob_features = n_rows * 2 * self.config['obs_config']['lob_depth']
+        # the features are written to and normalised in place in the next float32 observation buffer
+        obs = self._next_obs_buffer(2 * n_lob_features + 2)
+        prices, volumes = obs[:n_lob_features], obs[n_lob_features:2 * n_lob_features]
+        _, _, mids = self.lob_window_buffer.window(data_feed, row,
+                                                   prices_out=prices.reshape(n_rows, -1),
+                                                   volumes_out=volumes.reshape(n_rows, -1),
+                                                   rescale=self.config['obs_config']['norm'])
 
-        # check if we already have enough data collected in our hist
-        """
-        lob_bools = [True if dt in self.broker.hist_dict['rl']['timestamp'] else False for dt in past_dts]
-        lob_hist = []
-        for idx in range(len(past_dts)):
-            lob_hist.append(
-                self.broker.hist_dict['rl']['lob'][self.broker.hist_dict['rl']['timestamp'].index(past_dts[idx])]
-                if lob_bools[idx] else past_lobs[idx])
-        """
-
-        obs = np.array([])
         if self.config['obs_config']['norm']:
-            mid = (past_lobs[-1].get_best_ask() + past_lobs[-1].get_best_bid()) / 2
-            self.mid_pxs.append(float(mid))
-            # for lob in lob_hist:
-            prices = []
-            volumes = []
-            for lob in past_lobs:
-                lob_prices, lob_volumes = lob_to_numpy(lob,
-                                   depth=self.config['obs_config']['lob_depth'],
-                                    norm_price=None,
-                                    norm_vol_bid=None,
-                                    norm_vol_ask=None)
-                prices.append(lob_prices)
-                volumes.append(lob_volumes)
-            prices = np.array(prices).reshape(-1)
-            prices = min_max_rescaling(prices)
-            volumes = np.array(volumes).reshape(-1)
-            volumes = min_max_rescaling(volumes)
-            obs = np.concatenate((prices, volumes))
-
-            obs = np.concatenate((obs,
-                                  np.array([self.broker.rl_algo.bucket_vol_remaining[self.bucket_idx]/self.broker.rl_algo.bucket_volumes[self.bucket_idx]]),
-                                  # % of vol left to trade in the bucket
-                                  np.array([self.broker.rl_algo.no_of_slices - self.broker.rl_algo.order_idx - 1])),
-                                 axis=0)  # orders left to place in the bucket
-        else:
-            # for lob in lob_hist:
-            prices = []
-            volumes = []
-            for lob in past_lobs:
-                lob_prices, lob_volumes  = np.concatenate(obs, (lob_to_numpy(lob,
-                                                        depth=self.config['obs_config']['lob_depth'])), axis=0)
-                prices.append(lob_prices)
-                volumes.append(lob_volumes)
-
-            prices = np.array(prices).reshape(-1)
-            volumes = np.array(volumes).reshape(-1)
-            obs = np.concatenate((prices, volumes))
-
-            obs = np.concatenate((obs,
-                                  np.array([self.broker.rl_algo.bucket_vol_remaining[self.bucket_idx]]),
-                                  # vol left to trade in the bucket
-                                  np.array([self.broker.rl_algo.no_of_slices - self.broker.rl_algo.order_idx - 1])),
-                                 axis=0)  # orders left to place in the bucket
+            self.mid_pxs.append(float(mids[-1]))
+        obs[2 * n_lob_features:] = self._execution_state()
 
         # need to make sure that obs fits to the observation space...
         # 0 padding whenever this gets smaller...
         # NaN in the beginning if I don't have history yet...
 
-        return np.array(obs, dtype=np.float32)
+        return obs
+
+    def _next_obs_buffer(self, size):
+        """ Next of the preallocated float32 observation buffers, with 2 buffers (the default) the previous
+            observation stays valid for one more step. A new array is returned if 'obs_buffers' is 0 """
+
+        if len(self.obs_buffers) == 0 or len(self.obs_buffers[0]) != size:
+            return np.empty(size, dtype=np.float32)
+        self.obs_buffer_idx = (self.obs_buffer_idx + 1) % len(self.obs_buffers)
+        return self.obs_buffers[self.obs_buffer_idx]
+
+    def _execution_state(self):
+        """ Features of the execution appended to the LOB features of the observation """
+
+        if self.config['obs_config']['norm']:
+            # % of vol left to trade in the bucket
+            vol_left = int(self.broker.rl_algo.bucket_vol_remaining_lots[self.bucket_idx]) / \
+                       int(self.broker.rl_algo.bucket_volumes_lots[self.bucket_idx])
+        else:
+            # vol left to trade in the bucket
+            vol_left = float(from_lots(self.broker.rl_algo.bucket_vol_remaining_lots[self.bucket_idx]))
+        # orders left to place in the bucket
+        orders_left = self.broker.rl_algo.no_of_slices - self.broker.rl_algo.order_idx - 1
+        return np.array([vol_left, orders_left])
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
@@ -448,6 +598,9 @@ class BaseEnv(gym.Env, ABC):
         if type(self.config['exec_config']['delete_vol']) != bool:
             raise ValueError('Deleting volume flag must be a Boolean!')
 
+        if self.config['exec_config'].get('benchmark_algo', 'twap') not in BENCHMARK_ALGOS:
+            raise ValueError("'benchmark_algo' must be one of {}".format(sorted(BENCHMARK_ALGOS)))
+
     @staticmethod
     def add_default_dict(config):
         return {**DEFAULT_ENV_CONFIG, **config}
@@ -457,8 +610,7 @@ class ExampleEnvRewardAtStep(BaseEnv):
     def reward_func(self):
         """ Env with reward after each step """
 
-        vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.event_time_prev,
-                                                            end_date=self.event_time)
+        vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('step')
         reward = 0
         if self.trade_dir == 1:
             if vwap_bmk > vwap_rl:
@@ -474,8 +626,7 @@ class RewardAtStepEnv(BaseEnv):
         """ Env with reward after each step as % improvement of VWAP """
 
         try:
-            vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.event_time_prev,
-                                                                end_date=self.event_time)
+            vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('step')
             if self.trade_dir == 1:
                 reward = vwap_bmk / vwap_rl - 1 # This reward can lead to the agent executing low volumes, it doesn't take into account volume executed
             else:
@@ -493,8 +644,7 @@ class RewardAtBucketEnv(BaseEnv):
         reward = 0
         try:
             if self.bucket_time != self.bucket_time_prev:
-                vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.bucket_time_prev,
-                                                                    end_date=self.bucket_time)
+                vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('bucket')
                 if self.trade_dir == 1:
                     reward = vwap_bmk / vwap_rl - 1
                 else:
@@ -543,8 +693,7 @@ class NarrowTradeLimitEnvContinuous(BaseEnv):
         reward = 0
         try:
             if self.bucket_time != self.bucket_time_prev:
-                vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.bucket_time_prev,
-                                                                    end_date=self.bucket_time)
+                vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('bucket')
                 if self.trade_dir == 1:
                     reward = vwap_bmk - vwap_rl
                 else:
@@ -591,11 +740,10 @@ class NarrowTradeLimitEnvDiscrete(BaseEnv):
     def reward_func(self):
         """ Reward at end of each bucket as total $ improvement (VWAP improvement times the volume executed)"""
         reward = 0
-        vol = float(np.sum(self.broker.benchmark_algo.volumes_per_trade[self.bucket_idx]))
+        vol = float(from_lots(self.broker.benchmark_algo.volumes_per_trade_lots[self.bucket_idx].sum()))
         try:
             if self.bucket_time != self.bucket_time_prev:
-                vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.bucket_time_prev,
-                                                                    end_date=self.bucket_time)
+                vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('bucket')
                 if self.trade_dir == 1:
                     # reward = np.sign(vwap_bmk - vwap_rl)
                     reward = vol * (vwap_bmk - vwap_rl)
@@ -621,8 +769,7 @@ class DollarRewardAtStepEnv(BaseEnv):
         """ Env with reward after each step as dollar improvement of VWAPs """
 
         try:
-            vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.event_time_prev,
-                                                                end_date=self.event_time)
+            vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('step')
             if self.trade_dir == 1:
                 reward = vwap_bmk - vwap_rl
             else:
@@ -0,0 +1,92 @@
+import os
+import copy
+import pickle
+import hashlib
+from collections import OrderedDict
+
+# attributes of the benchmark algo which change while it is simulated
+ALGO_STATE = ('volumes_per_trade_lots', 'vol_remaining_lots', 'bucket_vol_remaining_lots', 'unexecuted_vol_lots',
+              'event_idx', 'order_idx', 'bucket_idx')
+# part of the keys, bumped whenever the stored entries change so that old entries on disk aren't loaded
+ENTRY_FORMAT = 3
+
+
+class BenchmarkCache(object):
+    """ Cache of precomputed benchmark executions, see BaseEnv._precompute_benchmark().
+
+        The benchmark does not depend on the actions of the agent, so an execution with the same parameters on the
+        same data always has the same fills. Entries are kept in an in-memory LRU of 'maxsize' entries and, if
+        'cache_dir' is given, also pickled to '<cache_dir>/<key>.pkl' so that they survive across evaluation runs.
+    """
+
+    def __init__(self, maxsize=128, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(data_feed, algo, delete_vol=False):
+        """ Key of the execution of 'algo' on the data of 'data_feed' """
+
+        params = (ENTRY_FORMAT, data_feed.data_version(algo.start_time, algo.end_time),
+                  str(data_feed.tick_size), str(data_feed.lot_size),
+                  str(algo.start_time), str(algo.end_time), str(algo.volume), algo.no_of_slices,
+                  algo.trade_direction, delete_vol, algo.volumes_per_trade_default_lots.tolist(),
+                  [str(t) for t in algo.buckets.bucket_bounds],
+                  [str(t) for t in algo.algo_events])
+        return hashlib.sha1(repr(params).encode()).hexdigest()
+
+    def get(self, key):
+        """ Returns the entry stored under 'key' or None """
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        if self.cache_dir is not None and os.path.isfile(self._entry_file(key)):
+            with open(self._entry_file(key), 'rb') as f:
+                entry = pickle.load(f)
+            self._store(key, entry)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        self._store(key, entry)
+        if self.cache_dir is not None:
+            with open(self._entry_file(key), 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def clear(self):
+        """ Empties the in-memory LRU, entries on disk are kept """
+        self._entries.clear()
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _entry_file(self, key):
+        return os.path.join(self.cache_dir, '{}.pkl'.format(key))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (self.cache_dir is not None and os.path.isfile(self._entry_file(key)))
+
+    @staticmethod
+    def algo_state(algo):
+        """ Copy of the state of 'algo' which is changed by simulating it """
+        return {k: copy.deepcopy(getattr(algo, k)) for k in ALGO_STATE if hasattr(algo, k)}
+
+    @staticmethod
+    def restore_algo_state(algo, state):
+        for k, v in state.items():
+            setattr(algo, k, copy.deepcopy(v))
@@ -1,8 +1,11 @@
-import copy
+import os
 import numpy as np
 from abc import ABC
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 from decimal import Decimal
+from src.core.environment.env_utils import to_epoch_ms
+from src.core.environment.limit_orders_setup.execution_algo import to_lots, from_lots
 
 
 def calc_volume_weighted_price_from_trades(trades):
@@ -22,14 +25,22 @@ def place_order(lob, dt, order):
     ord = order.copy()
     trade_message = None
     if ord['quantity'] > 0:
-        if ord['type'] == 'limit':
-            # lob_temp = copy.deepcopy(lob)
-            trades, _ = lob.process_order(ord, False, False)
+        if ord['type'] == 'market' and getattr(lob, 'sweepable', False):
+            # fill against the level arrays of the snapshot without building the book
+            vol, vol_wgt_price, n_levels = lob.sweep(ord['side'], ord['quantity'])
+            traded = n_levels > 0
         else:
-            # lob_temp = copy.deepcopy(lob)
-            trades, _ = lob.process_order(ord, True, False)
-        if trades:
-            vol_wgt_price, vol = calc_volume_weighted_price_from_trades(trades)
+            if ord['type'] == 'limit':
+                # lob_temp = copy.deepcopy(lob)
+                trades, _ = lob.process_order(ord, False, False)
+            else:
+                # lob_temp = copy.deepcopy(lob)
+                trades, _ = lob.process_order(ord, True, False)
+            traded = len(trades) > 0
+            if traded:
+                vol = sum(trade['quantity'] for trade in trades)
+                vol_wgt_price = sum(trade['price'] * trade['quantity'] for trade in trades) / vol
+        if traded:
             msg = 'trade'
         else:
             vol_wgt_price, vol, msg = order['price'], 0, 'no_trade'
@@ -37,406 +48,600 @@ def place_order(lob, dt, order):
                          'message': msg,
                          'type': order['type'],
                          'side': order['side'],
-                         'price': Decimal(str(vol_wgt_price)),
-                         'quantity': Decimal(str(vol)),
+                         'price': from_price_units(to_price_units(vol_wgt_price)),
+                         'quantity': Decimal(vol),
                          'target_quantity': order['quantity']}
     return trade_message
 
 
+# the prices of the trade logs are held as int64 numbers of 10 ** -PRICE_DECIMALS, the volume weighted price of a
+# fill over several levels is rounded to it
+PRICE_DECIMALS = 8
+
+
+def to_price_units(price):
+    """ Number of price units of the Decimal (or float) 'price' """
+    return int(Decimal(str(price)).scaleb(PRICE_DECIMALS).to_integral_value())
+
+
+def from_price_units(units):
+    """ Decimal price of 'units' """
+    return Decimal(int(units)).scaleb(-PRICE_DECIMALS)
+
+
+class TradeLog(object):
+    """ Growable columnar log of the trade messages of one algo.
+
+        The messages are stored in a structured array with int64 epoch ms timestamps, so that time filtering uses
+        np.searchsorted, and prices and quantities in int64 price units and lots, so that the log is exact. Running
+        sums of the traded notional (python ints, as it can overflow int64) and volume (int64 lots) are appended
+        with each row, the VWAP of any window is their difference between its bounds, in constant time. Indexing and
+        iterating still returns the trade messages as dicts, in the same format as returned by place_order().
+    """
+
+    dtype = np.dtype([('ts_ms', np.int64),
+                      ('price', np.int64),
+                      ('quantity', np.int64),
+                      ('target_quantity', np.int64),
+                      ('type', 'U6'),
+                      ('side', 'U3'),
+                      ('traded', np.bool_)])
+
+    def __init__(self, capacity=256):
+        self._data = np.zeros(capacity, dtype=self.dtype)
+        self._len = 0
+        # traded notional and volume of the first i rows at index i
+        self._cum_notional = np.zeros(capacity + 1, dtype=object)
+        self._cum_volume = np.zeros(capacity + 1, dtype=np.int64)
+
+    @property
+    def data(self):
+        """ View on the logged rows """
+        return self._data[:self._len]
+
+    def append(self, log, ts_ms=None):
+        """ Appends the trade message 'log', its timestamp is only parsed if the epoch 'ts_ms' isn't given """
+        self._reserve(1)
+        traded = log['message'] == 'trade'
+        price = to_price_units(log['price'])
+        quantity = to_lots(Decimal(log['quantity'])) if traded else 0
+        self._data[self._len] = (to_epoch_ms(log['timestamp']) if ts_ms is None else ts_ms,
+                                 price,
+                                 quantity,
+                                 to_lots(Decimal(log['target_quantity'])),
+                                 log['type'],
+                                 log['side'],
+                                 traded)
+        self._cum_notional[self._len + 1] = self._cum_notional[self._len] + price * quantity
+        self._cum_volume[self._len + 1] = self._cum_volume[self._len] + quantity
+        self._len += 1
+
+    def _reserve(self, n):
+        """ Grows the storage, by doubling it, until 'n' more rows fit """
+        while self._len + n > len(self._data):
+            capacity = len(self._data)
+            self._data = np.concatenate((self._data, np.zeros(capacity, dtype=self.dtype)))
+            self._cum_notional = np.concatenate((self._cum_notional, np.zeros(capacity, dtype=object)))
+            self._cum_volume = np.concatenate((self._cum_volume, np.zeros(capacity, dtype=np.int64)))
+
+    def index_after(self, t):
+        """ Index of the first log with a timestamp after 't' """
+        return int(np.searchsorted(self.data['ts_ms'], to_epoch_ms(t), side='right'))
+
+    def index_at_or_after(self, t):
+        """ Index of the first log with a timestamp at or after 't' """
+        ms = to_epoch_ms(t)
+        if isinstance(t, datetime) and t.microsecond % 1000:
+            ms += 1 # logs are in whole ms, so they are at or after 't' from the next ms onwards
+        return int(np.searchsorted(self.data['ts_ms'], ms, side='left'))
+
+    def vwap(self, start_idx=0, end_idx=None):
+        """ Volume weighted price of the traded logs in [start_idx, end_idx), 0 if nothing was traded """
+        start_idx, end_idx, _ = slice(start_idx, end_idx).indices(self._len)
+        if end_idx <= start_idx:
+            return 0
+        volume = int(self._cum_volume[end_idx] - self._cum_volume[start_idx])
+        if volume == 0:
+            return 0
+        notional = self._cum_notional[end_idx] - self._cum_notional[start_idx]
+        return notional / (volume * 10 ** PRICE_DECIMALS)
+
+    def extend_no_trades(self, ts_ms, prices, order):
+        """ Appends a 'no_trade' log of the resting 'order' for each of the epoch ms timestamps 'ts_ms' in one go,
+            'prices' are the prices of the order at each of them """
+        n = len(ts_ms)
+        self._reserve(n)
+        rows = self._data[self._len:self._len + n]
+        rows['ts_ms'] = ts_ms
+        rows['price'] = np.rint(np.asarray(prices, dtype=np.float64) * 10 ** PRICE_DECIMALS)
+        rows['quantity'] = 0
+        rows['target_quantity'] = to_lots(Decimal(order['quantity']))
+        rows['type'] = order['type']
+        rows['side'] = order['side']
+        rows['traded'] = False
+        # nothing traded, the running sums stay the same
+        self._cum_notional[self._len + 1:self._len + n + 1] = self._cum_notional[self._len]
+        self._cum_volume[self._len + 1:self._len + n + 1] = self._cum_volume[self._len]
+        self._len += n
+
+    def head(self, n):
+        """ Read-only view on the first 'n' logs, sharing the storage with this log """
+        logs = TradeLog.__new__(TradeLog)
+        logs._data = self._data
+        logs._cum_notional = self._cum_notional
+        logs._cum_volume = self._cum_volume
+        logs._len = min(n, self._len)
+        return logs
+
+    def _to_message(self, row):
+        return {'timestamp': datetime.strftime(datetime(1970, 1, 1) + timedelta(milliseconds=int(row['ts_ms'])),
+                                               '%Y-%m-%d %H:%M:%S.%f'),
+                'message': 'trade' if row['traded'] else 'no_trade',
+                'type': str(row['type']),
+                'side': str(row['side']),
+                'price': from_price_units(row['price']),
+                'quantity': from_lots(row['quantity']),
+                'target_quantity': from_lots(row['target_quantity'])}
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._to_message(row) for row in self.data[idx]]
+        return self._to_message(self.data[idx])
+
+    def __iter__(self):
+        return (self._to_message(row) for row in self.data)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
 class Broker(ABC):
-    """ Currently only for placing trades and getting volume weighted execution prices """
+    """ Currently only for placing trades and getting volume weighted execution prices
+
+        Besides the benchmark and RL algo, any number of algos can be added with register_algo() and simulated
+        side by side with simulate_algos(), their logs and histories are kept under the name they are registered with.
+
+        'record_policy' sets which LOB snapshots are kept in hist_dict for each algo:
+            'last': only the latest snapshot (default, orders are only matched against the latest one)
+            'ring': the latest 'record_len' snapshots
+            'full': every snapshot of the episode
+            'disk': the latest snapshot in memory, every snapshot of the episode is appended to
+                    '<record_path>/<benchmark|rl>.dat' in the flat binary format of the HistoricalDataFeed, through
+                    one open file per algo which is flushed at the end of each episode (see flush_records()).
+                    Levels emptied by market orders swept against a snapshot are written with quantity 0
+    """
 
-    def __init__(self, data_feed,):
+    record_policies = ('last', 'ring', 'full', 'disk')
+    hist_keys = {'benchmark_algo': 'benchmark', 'rl_algo': 'rl'} # hist_dict keys of the benchmark and RL algo logs
+
+    def __init__(self, data_feed, record_policy='last', record_len=None, record_path=None):
+
+        if record_policy not in self.record_policies:
+            raise ValueError("'record_policy' has to be one of {}".format(self.record_policies))
+        if record_policy == 'ring' and not record_len:
+            raise ValueError("'record_len' has to be defined for the 'ring' record policy")
+        if record_policy == 'disk' and record_path is None:
+            raise ValueError("'record_path' has to be defined for the 'disk' record policy")
 
         self.data_feed = data_feed
         self.benchmark_algo = None
         self.rl_algo = None
-        self.hist_dict = {'benchmark': {'timestamp': [], 'lob': []},
-                          'rl': {'timestamp': [], 'lob': []}}
+        self.delete_vol = False # delete the volume of unexecuted market orders instead of carrying it over
+        self.record_policy = record_policy
+        self.record_len = record_len
+        self.record_path = record_path
+        self._record_files = {} # open files of the 'disk' record policy by history key
+        self.hist_dict = {'benchmark': self._new_history(),
+                          'rl': self._new_history()}
         self.remaining_order = {'benchmark_algo': [],
                                 'rl_algo': []}
-        self.trade_logs = {'benchmark_algo': [],
-                           'rl_algo': []}
+        self.trade_logs = {'benchmark_algo': TradeLog(),
+                           'rl_algo': TradeLog()}
+        self.vwap_checkpoints = {}
+        self.algos = {} # algos registered for simulate_algos() by name
+        self._runs = {} # state of the simulation of the benchmark and RL algo, see _start_run()
+        # row of the next snapshot in the data feed for each algo, the algos don't share any feed state
+        self.cursors = {'benchmark_algo': None,
+                        'rl_algo': None}
 
     def reset(self, algo):
         """ Resetting the Broker class """
 
-        self.data_feed.reset(time=algo.start_time)
-        dt, lob = self.data_feed.next_lob_snapshot()
+        # reset the Broker logs and the algo, the algo is simulated from its first event onwards
+        name = self._algo_key(algo)
+        self._runs[name] = self._start_run(name, algo)
+        self.vwap_checkpoints = {}
 
-        # reset the Broker logs
-        if type(algo).__name__ != 'RLAlgo':
-            self.hist_dict['benchmark']['timestamp'] = []
-            self.hist_dict['benchmark']['lob'] = []
-            self.remaining_order['benchmark_algo'] = []
-            self.trade_logs['benchmark_algo']= []
-            self.current_dt_bmk = dt
-        else:
-            self.hist_dict['rl']['timestamp'] = []
-            self.hist_dict['rl']['lob'] = []
-            self.remaining_order['rl_algo'] = []
-            self.trade_logs['rl_algo'] = []
-            self.current_dt_rl = dt
+    def _algo_key(self, algo):
+        """ Name of the logs of 'algo', the RL algo if it is set as such and otherwise the benchmark algo """
 
-        # update to the first instance of the datafeed & record this
+        if algo is self.rl_algo:
+            return 'rl_algo'
+        self.benchmark_algo = algo
+        return 'benchmark_algo'
+
+    def _start_run(self, name, algo):
+        """ Resets the logs and history kept under 'name' and 'algo', returns the state of its simulation """
+
+        hist_key = self.hist_keys.get(name, name)
+        self._reset_history(hist_key)
+        self.remaining_order[name] = []
+        self.trade_logs[name] = TradeLog()
         algo.reset()
-        # self._record_lob(dt, lob, algo)
+        event, done = algo.get_next_event()
+        self.cursors[name] = event['row']
+        return {'name': name, 'hist': hist_key, 'algo': algo, 'event': event, 'done': done, 'finished': False,
+                'next_row': event['row']}
 
     def simulate_algo(self, algo):
         """ Simulates the execution of an algorithm """
 
-        self.reset(algo)
-        # simulate to first event...
-        event, done, lob = self.simulate_to_next_event(algo)
-        while not done:
-
-            # place order at event...
-            _ = self.place_next_order(algo, event, done, lob)
-
-            # simulate to next event...
-            event, done, lob = self.simulate_to_next_event(algo)
-
-            # if event is a bucket bound, we place another trade (if necessary)...
-            if event['type'] == 'bucket_bound':
-                done = self.place_next_order(algo, event, done, lob)
-            if not done:
-                # if still not done, then simulate again to next event...
-                event, done, lob = self.simulate_to_next_event(algo)
-
-    def simulate_to_next_event(self, algo):
-        """ Gets the next event from the benchmark algorithm and simulates the LOB up to this point if there are
-         remaining orders. This does not actively place trades, but simulates trades that remain in the market.
-
-         """
-
-        # get info from the algo about the type and time of next event
-        event, done = algo.get_next_event()
-
-        if type(algo).__name__ != 'RLAlgo':
-            remaining_order = self.remaining_order['benchmark_algo']
-            self.data_feed.reset(time=self.current_dt_bmk.strftime('%Y-%m-%d %H:%M:%S.%f'))
-        else:
-            remaining_order = self.remaining_order['rl_algo']
-            self.data_feed.reset(time=self.current_dt_rl.strftime('%Y-%m-%d %H:%M:%S.%f'))
-
-        if len(remaining_order) != 0 and remaining_order[0]['type']== 'limit':
-            # If we have remaining limit orders, we go through the LOBs until they are executed
-            while len(remaining_order) != 0:
-                # Loop through the LOBs
-                dt, lob = self.data_feed.next_lob_snapshot()
-                if dt <= event['time']:
-                    self._record_lob(dt, lob, algo)
-                    order_temp_bmk, order_temp_rl = self._update_remaining_orders()
-
-                    # place the orders and update the remaining quantities to trade in the algo
-                    if type(algo).__name__ != 'RLAlgo':
-                        log = self.place_orders(order_temp_bmk, type(algo).__name__)
-                        algo.update_remaining_volume(log)
-                        remaining_order = self.remaining_order['benchmark_algo']
-                    else:
-                        log = self.place_orders(order_temp_rl, type(algo).__name__)
-                        algo.update_remaining_volume(log)
-                        remaining_order = self.remaining_order['rl_algo']
+        name = self._algo_key(algo)
+        self._runs[name] = self._start_run(name, algo)
+        self._simulate_runs([self._runs[name]])
+
+    def register_algo(self, algo, name=None):
+        """ Registers 'algo' for simulate_algos() under 'name' (default 'algo_<i>'), returns the name """
+
+        name = 'algo_{}'.format(len(self.algos)) if name is None else name
+        if name in self.algos or name in ('benchmark', 'rl', 'benchmark_algo', 'rl_algo'):
+            raise ValueError("An algo is already registered as '{}'".format(name))
+        self.algos[name] = algo
+        return name
+
+    def simulate_algos(self):
+        """ Simulates all registered algos in a single pass over the data feed and returns their VWAPs by name.
+
+            The algos share one market clock: the snapshot of each row is built once and the orders of every algo
+            needing the row are matched against it, rows none of the algos needs are skipped. Each algo is simulated
+            as in simulate_algo().
+        """
+
+        self._simulate_runs([self._start_run(name, algo) for name, algo in self.algos.items()])
+        return {name: self.trade_logs[name].vwap() for name in self.algos}
+
+    def _simulate_runs(self, runs):
+        """ Simulates the algos of 'runs' until all of them are finished, see _advance_algo() """
+
+        while True:
+            active = [run for run in runs if not run['finished']]
+            if len(active) == 0:
+                break
+            row = min(run['next_row'] for run in active)
+            dt, lob = self.data_feed.snapshot_at(row)
+            for run in active:
+                # an algo can need the same row again, if its next event falls on it
+                while not run['finished'] and run['next_row'] == row:
+                    self._advance_algo(run, row, dt, lob)
+                self.cursors[run['name']] = run['next_row']
+        self.flush_records()
+
+    def _advance_algo(self, run, row, dt, lob):
+        """ Processes the snapshot 'row' for an algo and sets the next row it needs.
+
+            An order is placed at each event of the algo, unfilled limit orders rest and are repriced on the
+            following rows until the next event, unfilled market orders are placed again until the next order time.
+        """
+
+        if self._advance_remaining_order(run, row, dt, lob):
+            return
+        if row < run['event']['row']:
+            run['next_row'] = run['event']['row']
+            return
+
+        # place the order of the event
+        self._record_lob(dt, lob, run['hist'])
+        self._place_event_order(run, run['algo'].get_order_at_event(run['event'], lob))
+
+    def _advance_remaining_order(self, run, row, dt, lob):
+        """ Processes the snapshot 'row' for the order of an algo that is still in the market. Returns False if the
+            row is left to the event of the algo, as there is no remaining order (any more) """
+
+        name, algo, event = run['name'], run['algo'], run['event']
+        remaining_order = self.remaining_order[name]
+        if len(remaining_order) != 0 and remaining_order[0]['type'] == 'limit':
+            if row < event['row']:
+                # the limit order rests in the market until the next event, skip the rows at which it can't trade
+                next_row = self._skip_unmarketable_rows(run, row, event['row'])
+                if next_row > row:
+                    run['next_row'] = next_row
+                    return True
+                self._replace_order(run, dt, lob)
+                algo.update_remaining_volume(self._place_run_order(run))
+                run['next_row'] = row + 1 if len(self.remaining_order[name]) != 0 else event['row']
+                return True
+            if event['type'] == 'order_placement':
+                # add the unexecuted volume to the next order
+                algo.volumes_per_trade_lots[algo.bucket_idx, algo.order_idx] += to_lots(remaining_order[0]['quantity'])
+            # if the event is a bucket end, the market order is placed according to the bucket_vol_remaining,
+            # either way the remaining order is removed
+            self.remaining_order[name] = []
+        elif len(remaining_order) != 0:
+            if algo.bucket_idx < algo.buckets.n_buckets and \
+                    dt >= algo.execution_times[algo.bucket_idx][algo.order_idx]:
+                # the next order placement is reached without having fully executed the market order
+                unexecuted_lots = to_lots(remaining_order[0]['quantity'])
+                if self.delete_vol:
+                    algo.unexecuted_vol_lots += unexecuted_lots
+                    algo.vol_remaining_lots -= unexecuted_lots
                 else:
-                    # We have reached the next event with unexecuted volume, if we are not at the end of a bucket
-                    # we add it to the volume of next order
-                    if event['type'] == 'order_placement':
-                        if type(algo).__name__ != 'RLAlgo':
-                            unexecuted_vol = self.remaining_order['benchmark_algo'][0]['quantity']
-                        else:
-                            unexecuted_vol = self.remaining_order['rl_algo'][0]['quantity']
-
-                        algo.volumes_per_trade[algo.bucket_idx][algo.order_idx] += unexecuted_vol
-
-                    # If the event is a bucket end, the market order will be placed according to the bucket_vol_remaining.
-                    # Either way, we remove the remaining orders.
-                    if type(algo).__name__ != 'RLAlgo':
-                        self.remaining_order['benchmark_algo'] = []
-                    else:
-                        self.remaining_order['rl_algo'] = []
-                    remaining_order = []
-
-        # If we have no remaining orders (for example after executing an entire limit order or after a bucket end),
-        # we reset the datafeed to jump to the LOB corresponding to the next event.
-        self.data_feed.reset(time=event['time'].strftime('%Y-%m-%d %H:%M:%S.%f'))
-        dt, lob = self.data_feed.next_lob_snapshot()
-        self._record_lob(dt, lob, algo)
-        if type(algo).__name__ != 'RLAlgo':
-            self.current_dt_bmk = dt
+                    # add the volume to the next order and move it between the buckets
+                    algo.volumes_per_trade_lots[algo.bucket_idx, algo.order_idx] += unexecuted_lots
+                    algo.bucket_vol_remaining_lots[algo.bucket_idx - 1] -= unexecuted_lots
+                    algo.bucket_vol_remaining_lots[algo.bucket_idx] += unexecuted_lots
+                self.remaining_order[name] = []
+            else:
+                # place the market order again on the next snapshot
+                self._replace_order(run, dt, lob)
+                algo.book_traded_volume(self._place_run_order(run)['quantity'], algo.bucket_idx - 1)
+                run['next_row'] = row + 1 if len(self.remaining_order[name]) != 0 or run['done'] else event['row']
+                run['finished'] = run['done'] and len(self.remaining_order[name]) == 0
+                return True
+        return False
+
+    def _place_event_order(self, run, order):
+        """ Places the order of the current event of an algo against its latest snapshot and moves on to the next
+            event """
+
+        name, algo, event = run['name'], run['algo'], run['event']
+        log = self._place_run_order(run, order)
+        algo.update_remaining_volume(log, event['type'])
+        if len(self.remaining_order[name]) != 0 and self.remaining_order[name][0]['type'] == 'market' and \
+                algo.bucket_idx >= algo.buckets.n_buckets and self.delete_vol:
+            # the volume left at the end of the last bucket is deleted
+            unexecuted_lots = to_lots(self.remaining_order[name][0]['quantity'])
+            algo.unexecuted_vol_lots += unexecuted_lots
+            algo.vol_remaining_lots -= unexecuted_lots
+            self.remaining_order[name] = []
+
+        if run['done']:
+            run['finished'] = len(self.remaining_order[name]) == 0
+            run['next_row'] = event['row'] + 1
+            return
+        run['event'], run['done'] = algo.get_next_event()
+        if len(self.remaining_order[name]) != 0:
+            # the remaining order is handled up to the row of the next event, which may be this one
+            run['next_row'] = min(event['row'] + 1, run['event']['row'])
         else:
-            self.current_dt_rl = dt
-        return event, done, lob
+            run['next_row'] = run['event']['row']
+
+    def _replace_order(self, run, dt, lob):
+        """ Records the snapshot and updates the remaining order of an algo to it, the price of a limit order
+            follows the best price """
+
+        name, algo = run['name'], run['algo']
+        self._record_lob(dt, lob, run['hist'])
+        lob = self.hist_dict[run['hist']]['lob'][-1]
+        order = self.remaining_order[name][0]
+        order['timestamp'] = datetime.strftime(dt, '%Y-%m-%d %H:%M:%S.%f')
+        if order['type'] == 'limit':
+            if order['side'] == 'bid' and order['price'] < lob.get_best_bid():
+                order['price'] = lob.get_best_bid() - algo.tick_size
+            if order['side'] == 'ask' and order['price'] > lob.get_best_ask():
+                order['price'] = lob.get_best_ask() + algo.tick_size
+
+    def _place_run_order(self, run, order=None):
+        """ Places 'order' (default the remaining order) of an algo against its latest snapshot, logs the trade and
+            keeps the unfilled quantity as the remaining order """
+
+        name, hist = run['name'], self.hist_dict[run['hist']]
+        order = self.remaining_order[name][0] if order is None else order
+        lob, levels = hist['lob'][-1], hist['lob'][-1].levels
+        log = place_order(lob, hist['timestamp'][-1], order)
+        if self.record_policy == 'disk' and lob.levels is not levels:
+            # a market order swept the levels of the snapshot, which is the last one written to disk
+            self._write_record(run['hist'], hist['timestamp'][-1], lob, replace_last=True)
+        self.remaining_order[name] = []
+        if log is not None:
+            self.trade_logs[name].append(log, to_epoch_ms(hist['timestamp'][-1]))
+            remaining = order.copy()
+            remaining['quantity'] -= log['quantity']
+            if remaining['quantity'] > 0:
+                self.remaining_order[name] = [remaining]
+        return log
 
-    def place_next_order(self, algo, event, done, lob, vol=None):
+    def simulate_to_next_event(self, algo):
+        """ Simulates the LOB up to the next event of the benchmark or RL algo 'algo' and records the LOB at it.
+            This does not actively place trades, but simulates trades that remain in the market.
+        """
+
+        run = self._runs[self._algo_key(algo)]
+        while True:
+            row = run['next_row']
+            dt, lob = self.data_feed.snapshot_at(row)
+            if not self._advance_remaining_order(run, row, dt, lob):
+                if row >= run['event']['row']:
+                    break
+                # if there is no remaining order (any more), jump to the LOB of the next event
+                run['next_row'] = run['event']['row']
+
+        self._record_lob(dt, lob, run['hist'])
+        self.cursors[run['name']] = row + 1
+        if run['done']:
+            self.flush_records()
+        return run['event'], run['done'], lob
 
-        if type(algo).__name__ != 'RLAlgo':
-            self.data_feed.reset(time=self.current_dt_bmk.strftime('%Y-%m-%d %H:%M:%S.%f'))
-        else:
-            self.data_feed.reset(time=self.current_dt_rl.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    def place_next_order(self, algo, event, done, lob, vol=None):
+        """ Places the order of the benchmark or RL algo 'algo' at 'event' against the LOB recorded by
+            simulate_to_next_event(), optionally for 'vol' lots. An unfilled market order is placed again on the
+            following LOBs until it is filled or the next order placement is reached.
+        """
 
+        run = self._runs[self._algo_key(algo)]
         algo_order = algo.get_order_at_event(event, lob)
         if vol is not None:
-            algo_order['quantity'] = Decimal(str(vol))
-        log = self.place_orders(algo_order, type(algo).__name__)
-
-        # update the remaining quantities to trade
-        algo.update_remaining_volume(log, event['type'])
-
-        if len(self.remaining_order['benchmark_algo']) != 0:
-            if self.remaining_order['benchmark_algo'][0]['type'] == 'market':
-                # We have a market order that didn't fully execute, so we place it again on subsequent LOBs until it is fully executed.
-                if self.benchmark_algo.bucket_idx < self.benchmark_algo.buckets.n_buckets:
-                    while len(self.remaining_order['benchmark_algo'])!= 0:
-                        dt, lob = self.data_feed.next_lob_snapshot()
-                        if dt < self.benchmark_algo.execution_times[self.benchmark_algo.bucket_idx][self.benchmark_algo.order_idx]:
-                            self._record_lob(dt, lob, algo)
-                            order_temp_bmk, order_temp_rl = self._update_remaining_orders()
-                            # place the orders and update the remaining quantities to trade in the algo
-                            log = self.place_orders(order_temp_bmk,type(algo).__name__)
-                            algo.vol_remaining -= Decimal(str(log['quantity']))
-                            algo.bucket_vol_remaining[algo.bucket_idx-1] -= Decimal(str(log['quantity']))
-                            if algo.vol_remaining < -algo.tick_size * len(algo.bucket_volumes) or algo.bucket_vol_remaining[algo.bucket_idx-1] < -algo.tick_size:
-                                raise ValueError("More volume than available placed!")
-                            self.current_dt_bmk = dt
-                        else:
-                            # We have reached the next order placement without having fully executed our market order
-                            if self.delete_vol:
-                                # We delete the unexecuted volume from the algo
-                                try:
-                                    self.benchmark_algo.unexecuted_vol += self.remaining_order['benchmark_algo'][0]['quantity']
-                                except:
-                                    self.benchmark_algo.unexecuted_vol = self.remaining_order['benchmark_algo'][0]['quantity']
-                                self.benchmark_algo.vol_remaining -= self.remaining_order['benchmark_algo'][0]['quantity']
-                                self.remaining_order['benchmark_algo'] = []
-                            else:
-                                # We add the volume to the next event
-                                self.benchmark_algo.volumes_per_trade[self.benchmark_algo.bucket_idx][self.benchmark_algo.order_idx] += self.remaining_order['benchmark_algo'][0]['quantity']
-                                # Move the volume between buckets
-                                self.benchmark_algo.bucket_vol_remaining[self.benchmark_algo.bucket_idx-1] -= self.remaining_order['benchmark_algo'][0]['quantity']
-                                self.benchmark_algo.bucket_vol_remaining[self.benchmark_algo.bucket_idx] += self.remaining_order['benchmark_algo'][0]['quantity']
-                                self.remaining_order['benchmark_algo'] = []
-                else:
-                    # We are at the last bucket of the episode
-                    if self.delete_vol:
-                        # We delete the unexecuted volume from the algo
-                        try:
-                            self.benchmark_algo.unexecuted_vol += self.remaining_order['benchmark_algo'][0]['quantity']
-                        except:
-                            self.benchmark_algo.unexecuted_vol = self.remaining_order['benchmark_algo'][0]['quantity']
-                        self.benchmark_algo.vol_remaining -= self.remaining_order['benchmark_algo'][0]['quantity']
-                        self.remaining_order['benchmark_algo'] = []
-
-                    else:
-                        while len(self.remaining_order['benchmark_algo'])!= 0:
-                            dt, lob = self.data_feed.next_lob_snapshot()
-                            self._record_lob(dt, lob, algo)
-                            order_temp_bmk, order_temp_rl = self._update_remaining_orders()
-                            # place the orders and update the remaining quantities to trade in the algo
-                            log = self.place_orders(order_temp_bmk,type(algo).__name__)
-                            algo.vol_remaining -= Decimal(str(log['quantity']))
-                            algo.bucket_vol_remaining[algo.bucket_idx-1] -= Decimal(str(log['quantity']))
-                            if algo.vol_remaining < -algo.tick_size * len(algo.bucket_volumes) or algo.bucket_vol_remaining[algo.bucket_idx-1] < -algo.tick_size:
-                                raise ValueError("More volume than available placed!")
-                            self.current_dt_bmk = dt
-
-
-
-        if len(self.remaining_order['rl_algo'])!= 0:
-            if self.remaining_order['rl_algo'][0]['type'] == 'market':
-                # We have a market order that didn't fully execute, so we place it again on subsequent LOBs until it is fully executed.
-                if self.rl_algo.bucket_idx < self.rl_algo.buckets.n_buckets:
-                    while len(self.remaining_order['rl_algo'])!= 0:
-                        dt, lob = self.data_feed.next_lob_snapshot()
-                        if dt < self.rl_algo.execution_times[self.rl_algo.bucket_idx][self.rl_algo.order_idx]:
-                            self._record_lob(dt, lob, algo)
-                            order_temp_bmk, order_temp_rl = self._update_remaining_orders()
-                            # place the orders and update the remaining quantities to trade in the algo
-                            log = self.place_orders(order_temp_rl,type(algo).__name__)
-                            algo.vol_remaining -= Decimal(str(log['quantity']))
-                            algo.bucket_vol_remaining[algo.bucket_idx-1] -= Decimal(str(log['quantity']))
-                            if algo.vol_remaining < -algo.tick_size * len(algo.bucket_volumes) or algo.bucket_vol_remaining[algo.bucket_idx-1] < -algo.tick_size:
-                                raise ValueError("More volume than available placed!")
-
-                            self.current_dt_rl = dt
-                        else:
-                            # We have reached the next order placement without having fully executed our market order
-                            if self.delete_vol:
-                                # We delete the unexecuted volume from the algo
-                                try:
-                                    self.rl_algo.unexecuted_vol += self.remaining_order['rl_algo'][0]['quantity']
-                                except:
-                                    self.rl_algo.unexecuted_vol = self.remaining_order['rl_algo'][0]['quantity']
-                                self.rl_algo.vol_remaining -= self.remaining_order['rl_algo'][0]['quantity']
-                                self.remaining_order['rl_algo'] = []
-                            else:
-                                # We add the volume to the next event
-                                self.rl_algo.volumes_per_trade[self.rl_algo.bucket_idx][self.rl_algo.order_idx] += self.remaining_order['rl_algo'][0]['quantity']
-                                # Move the volume between buckets
-                                self.rl_algo.bucket_vol_remaining[self.rl_algo.bucket_idx-1] -= self.remaining_order['rl_algo'][0]['quantity']
-                                self.rl_algo.bucket_vol_remaining[self.rl_algo.bucket_idx] += self.remaining_order['rl_algo'][0]['quantity']
-                                self.remaining_order['rl_algo'] = []
-                else:
-                    # We are at the last bucket of the episode
-                    if self.delete_vol:
-                        # We delete the unexecuted volume from the algo
-                        try:
-                            self.rl_algo.unexecuted_vol += self.remaining_order['rl_algo'][0]['quantity']
-                        except:
-                            self.rl_algo.unexecuted_vol = self.remaining_order['rl_algo'][0]['quantity']
-                        self.rl_algo.vol_remaining -= self.remaining_order['rl_algo'][0]['quantity']
-                        self.remaining_order['rl_algo'] = []
-                    else:
-                        while len(self.remaining_order['rl_algo'])!= 0:
-                            dt, lob = self.data_feed.next_lob_snapshot()
-                            self._record_lob(dt, lob, algo)
-                            order_temp_bmk, order_temp_rl = self._update_remaining_orders()
-                            # place the orders and update the remaining quantities to trade in the algo
-                            log = self.place_orders(order_temp_rl,type(algo).__name__)
-                            algo.vol_remaining -= Decimal(str(log['quantity']))
-                            algo.bucket_vol_remaining[algo.bucket_idx-1] -= Decimal(str(log['quantity']))
-                            if algo.vol_remaining < -algo.tick_size * len(algo.bucket_volumes) or algo.bucket_vol_remaining[algo.bucket_idx-1] < -algo.tick_size:
-                                raise ValueError("More volume than available placed!")
-
-                            self.current_dt_rl = dt
-
-        if type(algo).__name__ != 'RLAlgo':
-            self.benchmark_algo = algo
-        else:
-            self.rl_algo = algo
+            algo_order['quantity'] = from_lots(vol)
+        self._place_event_order(run, algo_order)
+
+        remaining_order = self.remaining_order[run['name']]
+        while len(remaining_order) != 0 and remaining_order[0]['type'] == 'market':
+            row = run['next_row']
+            dt, lob = self.data_feed.snapshot_at(row)
+            if not self._advance_remaining_order(run, row, dt, lob):
+                break
+            self.cursors[run['name']] = run['next_row']
+            remaining_order = self.remaining_order[run['name']]
+        if run['done']:
+            self.flush_records()
         return done
 
-    def _record_lob(self, dt, lob, algo):
-        """ Records lob steps in a dict """
-
-        if type(algo).__name__ != 'RLAlgo':
-            self.hist_dict['benchmark']['timestamp'].append(dt)
-            self.hist_dict['benchmark']['lob'].append(copy.deepcopy(lob))
-        else:
-            self.hist_dict['rl']['timestamp'].append(dt)
-            self.hist_dict['rl']['lob'].append(copy.deepcopy(lob))
-
-    def _update_remaining_orders(self):
-        """ Updates the orders not previously executed with new LOB data """
-
-        order_temp_bmk = None
-        order_temp_rl = None
-
-        if len(self.remaining_order['benchmark_algo']) != 0:
-            # update the order and place it
-            dt = self.hist_dict['benchmark']['timestamp'][-1]
-            lob_bmk = self.hist_dict['benchmark']['lob'][-1]
-            order_temp_bmk = self.remaining_order['benchmark_algo'][0]
-            order_temp_bmk['timestamp'] = datetime.strftime(dt, '%Y-%m-%d %H:%M:%S.%f')
-            if order_temp_bmk['type'] == 'limit':
-                # update the price also
-                if order_temp_bmk['side'] == 'bid' and order_temp_bmk['price'] < lob_bmk.get_best_bid():
-                    order_temp_bmk['price'] = lob_bmk.get_best_bid() - self.benchmark_algo.tick_size
-                    # order_temp_bmk['price'] = lob_bmk.get_best_bid() + 10 * self.benchmark_algo.tick_size # Allows for execution up to an adverse price movement of 10 ticks in the next LOB
-
-                if order_temp_bmk['side'] == 'ask' and order_temp_bmk['price'] > lob_bmk.get_best_ask():
-                    order_temp_bmk['price'] = lob_bmk.get_best_ask() + self.benchmark_algo.tick_size
-                    # order_temp_bmk['price'] = lob_bmk.get_best_ask() - 10 * self.benchmark_algo.tick_size # Allows for execution up to an adverse price movement of 10 ticks in the next LOB
-
-            self.remaining_order['benchmark_algo'] = []
-
-        if len(self.remaining_order['rl_algo']) != 0:
-            # update the order and place it
-            dt = self.hist_dict['rl']['timestamp'][-1]
-            lob_rl = self.hist_dict['rl']['lob'][-1]
-            order_temp_rl = self.remaining_order['rl_algo'][0]
-            order_temp_rl['timestamp'] = datetime.strftime(dt, '%Y-%m-%d %H:%M:%S.%f')
-            if order_temp_rl['type'] == 'limit':
-                # update the price also
-                if order_temp_rl['side'] == 'bid' and order_temp_rl['price'] < lob_rl.get_best_bid():
-                    order_temp_rl['price'] = lob_rl.get_best_bid() - self.benchmark_algo.tick_size
-                    # order_temp_rl['price'] = lob_rl.get_best_bid() + 10 * self.benchmark_algo.tick_size # Allows for execution up to an adverse price movement of 10 ticks in the next LOB
-
-                if order_temp_rl['side'] == 'ask' and order_temp_rl['price'] > lob_rl.get_best_ask():
-                    order_temp_rl['price'] = lob_rl.get_best_ask() + self.benchmark_algo.tick_size
-                    # order_temp_rl['price'] = lob_rl.get_best_ask() - 10 * self.benchmark_algo.tick_size # Allows for execution up to an adverse price movement of 10 ticks in the next LOB
-
-            self.remaining_order['rl_algo'] = []
-        return order_temp_bmk, order_temp_rl
-
-    def place_orders(self, order, algo_type):
-        """ Places orders of both benchmark and RL algos and store logs in the broker.trade_logs """
-
-        # update the remaining orders
-        if algo_type != 'RLAlgo':
-            log = place_order(self.hist_dict['benchmark']['lob'][-1],
-                              self.hist_dict['benchmark']['timestamp'][-1],
-                              order)
-            if log is not None:
-                self.trade_logs['benchmark_algo'].append(log)
-                bmk_order_temp = order.copy()
-                bmk_order_temp['quantity'] -= log['quantity']
-                if bmk_order_temp['quantity'] > 0:
-                    self.remaining_order['benchmark_algo'].append(bmk_order_temp)
-                else:
-                    self.remaining_order['benchmark_algo'] = []
-
-        if algo_type == 'RLAlgo':
-            log = place_order(self.hist_dict['rl']['lob'][-1],
-                              self.hist_dict['rl']['timestamp'][-1],
-                              order)
-            if log is not None:
-                self.trade_logs['rl_algo'].append(log)
-                rl_order_temp = order.copy()
-                rl_order_temp['quantity'] -= log['quantity']
-                if rl_order_temp['quantity'] > 0:
-                    self.remaining_order['rl_algo'].append(rl_order_temp)
-                else:
-                    self.remaining_order['rl_algo'] = []
-        return log
+    def _skip_unmarketable_rows(self, run, row, end_row):
+        """ Vectorised search for the resting limit order of an algo, instead of processing the LOBs one by one.
+
+            Searches the best prices of the rows [row, end_row) for the first row at which the order, repriced as
+            in _replace_order(), is marketable. The rows before it are recorded and logged as 'no_trade' in one go,
+            the order is left with its price at the last of them. Returns the row from which the LOBs have to be
+            processed one by one, 'end_row' if the order isn't executed before the next event.
+        """
+
+        key, hist_key, algo = run['name'], run['hist'], run['algo']
+        order = self.remaining_order[key][0]
+        if row >= end_row or order['quantity'] <= 0:
+            return row
+
+        timestamps, levels = self.data_feed.lob_window(row, end_row)
+        best_asks, best_bids = levels[:, 0, 0], levels[:, 2, 0]
+        bid = order['side'] == 'bid'
+        price = order['price']
+        prices = np.empty(len(levels))
+        n_rows = len(levels)
+        idx = 0
+        while idx < n_rows:
+            # rows at which the order is repriced and at which it is marketable at its current price
+            if bid:
+                reprice = best_bids[idx:] > float(price)
+                marketable = best_asks[idx:] <= float(price)
+            else:
+                reprice = best_asks[idx:] < float(price)
+                marketable = best_bids[idx:] >= float(price)
+            n_same = int(np.argmax(reprice)) if reprice.any() else n_rows - idx
+            n_unmarketable = int(np.argmax(marketable[:n_same])) if marketable[:n_same].any() else n_same
+            prices[idx:idx + n_unmarketable] = float(price)
+            idx += n_unmarketable
+            if n_unmarketable < n_same or idx == n_rows:
+                break
+
+            if bid:
+                new_price = Decimal(str(best_bids[idx])) - algo.tick_size
+                if best_asks[idx] <= float(new_price):
+                    break
+            else:
+                new_price = Decimal(str(best_asks[idx])) + algo.tick_size
+                if best_bids[idx] >= float(new_price):
+                    break
+            price = new_price
+            prices[idx] = float(price)
+            idx += 1
+
+        if idx > 0:
+            self._record_rows(row, row + idx, hist_key)
+            ts_ms = timestamps[:idx].astype(np.int64)
+            self.trade_logs[key].extend_no_trades(ts_ms, prices[:idx], order)
+            order['price'] = price
+            order['timestamp'] = datetime.strftime(self.hist_dict[hist_key]['timestamp'][-1], '%Y-%m-%d %H:%M:%S.%f')
+        return row + idx
+
+    def _record_rows(self, start_row, end_row, key):
+        """ Records the LOBs of the rows [start_row, end_row) like _record_lob(), the snapshots are only built
+            for the rows kept by the record policy """
+
+        if self.record_policy in ('last', 'disk') and end_row - start_row > 1:
+            if self.record_policy == 'disk':
+                timestamps, levels = self.data_feed.lob_window(start_row, end_row - 1)
+                np.column_stack((timestamps.astype(np.int64),
+                                 levels.reshape(len(levels), -1))).astype(np.float64).tofile(self._record_files[key])
+            start_row = end_row - 1
+        for row in range(start_row, end_row):
+            dt, lob = self.data_feed.snapshot_at(row)
+            self._record_lob(dt, lob, key)
+
+    def _record_lob(self, dt, lob, key):
+        """ Records lob steps in the history 'key' of hist_dict, as copy-on-write snapshots since orders are matched
+            against them """
+
+        self.hist_dict[key]['timestamp'].append(dt)
+        self.hist_dict[key]['lob'].append(lob.snapshot())
+        if self.record_policy == 'disk':
+            self._write_record(key, dt, lob)
+
+    def _write_record(self, key, dt, lob, replace_last=False):
+        """ Appends the LOB to the file of the 'disk' record policy, or overwrites the last LOB written to it """
+
+        record = np.concatenate(([to_epoch_ms(dt)], np.ravel(lob.levels))).astype(np.float64)
+        if replace_last:
+            self._record_files[key].seek(-record.nbytes, os.SEEK_CUR)
+        record.tofile(self._record_files[key])
+
+    def _new_history(self):
+        """ Empty LOB history of an algo, bounded according to the record policy """
+
+        maxlen = {'last': 1, 'ring': self.record_len, 'full': None, 'disk': 1}[self.record_policy]
+        return {'timestamp': deque(maxlen=maxlen), 'lob': deque(maxlen=maxlen)}
+
+    def _reset_history(self, key):
+        self.hist_dict[key] = self._new_history()
+        if self.record_policy == 'disk':
+            os.makedirs(self.record_path, exist_ok=True)
+            if key in self._record_files:
+                self._record_files[key].close()
+            self._record_files[key] = open(self._record_file(key), 'wb')
+
+    def flush_records(self):
+        """ Writes the buffered snapshots of the 'disk' record policy to the files """
+        for f in self._record_files.values():
+            f.flush()
+
+    def close(self):
+        """ Closes the files of the 'disk' record policy """
+        for f in self._record_files.values():
+            f.close()
+        self._record_files = {}
+
+    def _record_file(self, key):
+        return os.path.join(self.record_path, '{}.dat'.format(key))
 
     def calc_vwap_from_logs(self, start_date=None, end_date=None):
+        """ VWAPs of the benchmark and RL algo from their trade logs, optionally only of the logs after 'start_date'
+            up to and including the first log at or after 'end_date' """
+
+        vwaps = []
+        for logs in (self.trade_logs['benchmark_algo'], self.trade_logs['rl_algo']):
+            # filter by start idx
+            # it seems possible that one algo has data in there and the other doesnt???
+            start_idx = 0
+            if start_date is not None:
+                start_idx = logs.index_after(start_date)
+                if start_idx == len(logs):
+                    raise ValueError('No trade logs after {}'.format(start_date))
+
+            # filter by end idx
+            end_idx = len(logs)
+            if end_date is not None:
+                end_idx = min(logs.index_at_or_after(end_date) + 1, len(logs))
+
+            # get trade logs between the two dates
+            vwaps.append(logs.vwap(start_idx, end_idx) if len(logs) != 0 else 0)
+
+        bmk_vwap, rl_vwap = vwaps
+        return bmk_vwap, rl_vwap
 
-        f = lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M:%S.%f')
-        # filter by start idx
-        # it seems possible that one algo has data in there and the other doesnt???
-        if start_date is None:
-            start_idx_bmk = 0
-            start_idx_rl = 0
-        else:
-            start_idx_bmk = next(x[0] for x in enumerate([f(log["timestamp"]) for log in self.trade_logs['benchmark_algo']])
-                                 if x[1] > start_date)
-            start_idx_rl = next(x[0] for x in enumerate([f(log["timestamp"]) for log in self.trade_logs['rl_algo']])
-                                if x[1] > start_date)
-
-        # filter by end idx
-        if end_date is None:
-            end_idx_bmk = len(self.trade_logs['benchmark_algo'])
-            end_idx_rl = len(self.trade_logs['rl_algo'])
-        else:
-            try:
-                end_idx_bmk = next(x[0] for x in enumerate([f(log["timestamp"]) for log in self.trade_logs['benchmark_algo']])
-                                   if x[1] >= end_date) + 1
-            except:
-                end_idx_bmk = len(self.trade_logs['benchmark_algo'])
-            try:
-                end_idx_rl = next(x[0] for x in enumerate([f(log["timestamp"]) for log in self.trade_logs['rl_algo']])
-                                  if x[1] >= end_date) + 1
-            except:
-                end_idx_rl = len(self.trade_logs['rl_algo'])
-
-        # get trade logs between the two dates
-        if len(self.trade_logs['benchmark_algo']) != 0:
-            bmk_vwap = self._calc_vwap(self.trade_logs['benchmark_algo'][start_idx_bmk:end_idx_bmk])
-        else:
-            bmk_vwap = 0
+    def set_vwap_checkpoint(self, name):
+        """ Marks the current end of the trade logs of both algos, see calc_vwap_since_checkpoint() """
 
-        if len(self.trade_logs['rl_algo']) != 0:
-            rl_vwap = self._calc_vwap(self.trade_logs['rl_algo'][start_idx_rl:end_idx_rl])
-        else:
-            rl_vwap = 0
+        self.vwap_checkpoints[name] = (len(self.trade_logs['benchmark_algo']), len(self.trade_logs['rl_algo']))
 
-        return bmk_vwap, rl_vwap
+    def calc_vwap_since_checkpoint(self, name):
+        """ VWAPs of the benchmark and RL algo of the logs since the checkpoint 'name', in constant time """
 
-    @staticmethod
-    def _calc_vwap(logs):
-        p = [Decimal(trade['price']) for trade in logs if trade['message'] == 'trade']
-        v = [trade['quantity'] for trade in logs if trade['message'] == 'trade']
-        if len(p) == 0 or len(v) == 0:
-            return 0
-        vwap = float(np.dot(p, v)/sum(v))
-        return vwap
+        vwaps = []
+        for logs, start_idx in zip((self.trade_logs['benchmark_algo'], self.trade_logs['rl_algo']),
+                                   self.vwap_checkpoints[name]):
+            if start_idx == len(logs):
+                raise ValueError("No trade logs since checkpoint '{}'".format(name))
+            vwaps.append(logs.vwap(start_idx))
+
+        bmk_vwap, rl_vwap = vwaps
+        return bmk_vwap, rl_vwap
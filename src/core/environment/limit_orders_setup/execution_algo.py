@@ -1,10 +1,11 @@
 import math
-import copy
 import numpy as np
 from datetime import datetime, timedelta
 from decimal import Decimal
+from fractions import Fraction
 from random import randint
 import random
+from src.core.environment.env_utils import to_epoch_ms, level_depletion
 
 
 BUCKET_SIZES_IN_SECS = {"1m": 7,
@@ -19,23 +20,60 @@ BUCKET_SIZES_IN_SECS = {"1m": 7,
                         "3h": 900,
                         "4h": 1200}
 
+# event types of the event plan, the codes index EVENT_TYPES
+EVENT_TYPES = ('order_placement', 'bucket_bound')
+ORDER_PLACEMENT, BUCKET_BOUND = range(len(EVENT_TYPES))
+EVENT_PLAN_DTYPE = np.dtype([('time_ms', np.int64),
+                             ('type', np.int8),
+                             ('bucket_idx', np.int32),
+                             ('order_idx', np.int32),
+                             ('row', np.int64)])
 
-def split_across_buckets(quantity, n_splits, ticks):
-    base_vol, extra_vol = divmod(quantity * int(1/ticks), n_splits)
-    base_vol = Decimal(str(base_vol/int(1/ticks)))
-    extra_vol = Decimal(str(extra_vol/int(1/ticks)))
-    ticks_dec = Decimal(str(ticks))
-    split = [base_vol + ((Decimal(str(i)) * ticks_dec < extra_vol) * ticks_dec) for i in range(n_splits)]
-    return split
 
+MS_PER_DAY = 24 * 60 * 60 * 1000
 
-def _get_execution_times(algo, idx):
+# the volumes of the algos are held as int64 numbers of lots of 10 ** -LOT_DECIMALS, which is fine enough for every
+# quantity traded on the LOB data
+LOT_DECIMALS = 8
+
+
+def to_lots(quantity):
+    """ Number of lots of the Decimal 'quantity' """
+    return int(quantity.scaleb(LOT_DECIMALS).to_integral_value())
+
+
+def from_lots(lots):
+    """ Decimal quantity of 'lots' """
+    return Decimal(int(lots)).scaleb(-LOT_DECIMALS)
+
+
+def scale_lots(lots, multiplier):
+    """ 'lots' times 'multiplier' rounded down, in integer arithmetic. The 'multiplier' (a number or Fraction) is taken
+        as the rational it prints as, e.g. the float 1.2 as 6/5 """
+    multiplier = Fraction(str(multiplier))
+    return int(lots) * multiplier.numerator // multiplier.denominator
+
+
+def split_across_buckets(lots, n_splits, tick_lots):
+    """ Splits 'lots' (an int or an array of them) into 'n_splits' multiples of 'tick_lots' as equal as possible, the
+        remaining ticks go to the first splits """
+    if n_splits == 0:
+        return np.zeros(np.shape(lots) + (0,), dtype=np.int64)
+    ticks = np.asarray(lots, dtype=np.int64) // tick_lots
+    base_ticks, extra_ticks = np.divmod(ticks, n_splits)
+    return (base_ticks[..., None] + (np.arange(n_splits) < extra_ticks[..., None])) * tick_lots
+
+
+def _get_placements(algo):
+    """ Placements of the orders within a bucket as fractions of the bucket width """
     sample_placements = algo.bucket_placement_func(algo.no_of_slices)
     if not isinstance(sample_placements, list):
         sample_placements = [sample_placements]
-    t_diff = algo.buckets.bucket_bounds[idx + 1] - algo.buckets.bucket_bounds[idx]
-    bucket_trades = [algo.buckets.bucket_bounds[idx] + t_diff * plcmt for plcmt in sample_placements]
-    return bucket_trades
+    return sample_placements
+
+
+def _offsets_to_datetimes(start_time, offsets_ms):
+    return [start_time + timedelta(milliseconds=int(offset)) for offset in offsets_ms]
 
 
 class Bucket:
@@ -83,25 +121,27 @@ class Bucket:
 
         self.rand_width = rand_width
 
-        # derive bucket bounds
-        b_bounds = [self.start_time]
-        while b_bounds[-1] < self.end_time:
-            if rand_width:
-                rand_add = randint(-rand_width, rand_width) # rand_width should be a % of the bucket_width, otherwise the bounds could be non-increasing.
-            else:
-                rand_add = 0
-            b_bounds.append(b_bounds[-1] + timedelta(days= 0, seconds= self.bucket_width * ( 1 + rand_add/100)))
-
-        # delete if one was added too much
-        if b_bounds[-1] >= self.end_time:
-            del b_bounds[-1]
+        # bucket widths in ms, each randomised by up to +/- rand_width % of the bucket width
+        duration_ms = int(self.duration.total_seconds() * 1000)
+        if rand_width:
+            # rand_width should be a % of the bucket_width, otherwise the bounds could be non-increasing.
+            min_width = self.bucket_width * 10 * (100 - rand_width)
+            if min_width <= 0:
+                raise ValueError("rand_width has to be smaller than 100 % of the bucket width")
+            n_widths = int(duration_ms // min_width) + 1
+            rand_add = np.array([randint(-rand_width, rand_width) for _ in range(n_widths)])
+        else:
+            n_widths = int(duration_ms // (self.bucket_width * 1000)) + 1
+            rand_add = np.zeros(n_widths)
+        widths = np.rint(self.bucket_width * 10 * (100 + rand_add)).astype(np.int64)
 
-        # finally add the end time of the last bucket & set length
-        b_bounds.append(self.end_time)
-        n_buckets = len(b_bounds) - 1
+        # all bounds before the end time, then the end time as the end of the last bucket
+        offsets = np.concatenate(([0], np.cumsum(widths)))
+        offsets = np.append(offsets[offsets < duration_ms], duration_ms)
 
-        self.bucket_bounds = b_bounds
-        self.n_buckets = n_buckets
+        self.bucket_bounds_ms = to_epoch_ms(self.start_time) + offsets
+        self.bucket_bounds = _offsets_to_datetimes(self.start_time, offsets)
+        self.n_buckets = len(offsets) - 1
         return self.bucket_bounds, self.n_buckets
 
 
@@ -143,40 +183,74 @@ class ExecutionAlgo:
 
     def reset(self):
         if type(self).__name__ != 'RLAlgo':
-            self.volumes_per_trade = copy.deepcopy(self.volumes_per_trade_default)
+            self.volumes_per_trade_lots = self.volumes_per_trade_default_lots.copy()
         else:
-            volumes_per_trade = []
-            for bucket in range(len(self.volumes_per_trade)):
-                volumes_per_trade.append(list([Decimal(0) for order_event in self.volumes_per_trade_default[bucket]]))
-            self.volumes_per_trade = volumes_per_trade
-        self.vol_remaining = Decimal(str(self.volume))
-        self.bucket_vol_remaining = self.bucket_volumes.copy()
+            self.volumes_per_trade_lots = np.zeros_like(self.volumes_per_trade_default_lots)
+        self.vol_remaining_lots = self.volume_lots
+        self.bucket_vol_remaining_lots = self.bucket_volumes_lots.copy()
+        self.unexecuted_vol_lots = 0
         self.event_idx = 0
         self.order_idx = 0
         self.bucket_idx = 0
 
     def _sample_execution_times(self):
-        exec_times = []
-
-        for i in range(0, self.buckets.n_buckets):
-            bucket_trades = _get_execution_times(self, i)
-            # make sure trade times are different from each other and from bucket bounds
-            while len(set(bucket_trades)) < self.no_of_slices or \
-                    any(trade in self.buckets.bucket_bounds for trade in bucket_trades):
-                bucket_trades = _get_execution_times(self, i)
-            exec_times.append(bucket_trades)
-        self.execution_times = exec_times
-        flat_exec_times = [item for sublist in exec_times for item in sublist]
-        self.algo_events = sorted(list(set(flat_exec_times + self.buckets.bucket_bounds[1:])))
+        """ Samples the order times of all buckets at once, on the ms grid of the bucket bounds """
+
+        bounds_ms = self.buckets.bucket_bounds_ms
+        widths = np.diff(bounds_ms)
+        placements = np.array([_get_placements(self) for _ in range(self.buckets.n_buckets)], dtype=np.float64)
+        offsets = np.rint(widths[:, None] * placements).astype(np.int64).reshape(self.buckets.n_buckets, -1)
+
+        # orders have to be at different times and strictly within their bucket, colliding or edge placements are
+        # nudged to the nearest free ms: in the order of the placements, every order is moved to at least 1 ms after
+        # the previous one and at most as late as leaves 1 ms for each of the following ones
+        n_orders = offsets.shape[1]
+        if np.any(widths - 1 < n_orders):
+            raise ValueError("Bucket is too short for {} orders".format(n_orders))
+        order = np.argsort(offsets, axis=1, kind='stable')
+        steps = np.arange(n_orders)
+        shifted = np.maximum.accumulate(np.maximum(np.take_along_axis(offsets, order, axis=1) - steps, 1), axis=1)
+        nudged = np.minimum(shifted, (widths - n_orders)[:, None]) + steps
+        np.put_along_axis(offsets, order, nudged, axis=1)
+
+        self.execution_times_ms = bounds_ms[:-1, None] + offsets
+        self.execution_times = [_offsets_to_datetimes(self.buckets.start_time, times - bounds_ms[0])
+                                for times in self.execution_times_ms]
+        events_ms = np.union1d(self.execution_times_ms.ravel(), bounds_ms[1:])
+        self.algo_events = _offsets_to_datetimes(self.buckets.start_time, events_ms - bounds_ms[0])
+        self._build_event_plan()
+
+    def _build_event_plan(self):
+        """ Precomputes the type, bucket, order and data row of each of the algo_events, so that stepping
+            through the events only advances event_idx """
+
+        n_buckets, no_of_slices = self.execution_times_ms.shape
+        order_plan = np.zeros(self.execution_times_ms.size, dtype=EVENT_PLAN_DTYPE)
+        order_plan['time_ms'] = self.execution_times_ms.ravel()
+        order_plan['type'] = ORDER_PLACEMENT
+        order_plan['bucket_idx'] = np.repeat(np.arange(n_buckets), no_of_slices)
+        # orders are numbered in the order of their times within the bucket
+        order_plan['order_idx'] = np.argsort(np.argsort(self.execution_times_ms, axis=1), axis=1).ravel()
+        bound_plan = np.zeros(n_buckets, dtype=EVENT_PLAN_DTYPE)
+        bound_plan['time_ms'] = self.buckets.bucket_bounds_ms[1:]
+        bound_plan['type'] = BUCKET_BOUND
+        bound_plan['bucket_idx'] = np.arange(n_buckets)
+
+        plan = np.concatenate((order_plan, bound_plan))
+        plan = plan[np.argsort(plan['time_ms'], kind='stable')]
+        plan['row'] = self.broker_data_feed.rows_after(plan['time_ms'])
+
+        self.event_plan = plan
+        self.event_timestamps = [datetime.strftime(t, '%Y-%m-%d %H:%M:%S.%f') for t in self.algo_events]
 
     def get_next_event(self):
         """ gets the time stamp for the next event which might trigger an order """
 
         event_time = self.algo_events[self.event_idx]
-        event_type = 'order_placement'
-        if not any(event_time in sublist for sublist in self.execution_times):
-            event_type = 'bucket_bound'
-        event = {'type': event_type, 'time': event_time}
+        event = {'type': EVENT_TYPES[self.event_plan['type'][self.event_idx]],
+                 'time': event_time,
+                 'timestamp': self.event_timestamps[self.event_idx],
+                 'row': int(self.event_plan['row'][self.event_idx])}
 
         # update the event_idx
         if not self.event_idx == len(self.algo_events)-1:
@@ -206,18 +280,18 @@ class ExecutionAlgo:
                 p = lob.get_best_ask() + self.tick_size
                 # p = lob.get_best_ask() - 10 * self.tick_size # This allows for (partial) execution at the current LOB
             order = {'type': 'limit',
-                     'timestamp': datetime.strftime(event['time'], '%Y-%m-%d %H:%M:%S.%f'),
+                     'timestamp': event['timestamp'],
                      'side': side,
-                     'quantity': self.volumes_per_trade[self.bucket_idx][self.order_idx],
+                     'quantity': from_lots(self.volumes_per_trade_lots[self.bucket_idx, self.order_idx]),
                      'price': p,
                      'trade_id': trade_id}
             self.order_idx += 1
         elif event['type'] == 'bucket_bound':
             # place a market order with remaining volume left in bucket
             order = {'type': 'market',
-                     'timestamp': datetime.strftime(event['time'], '%Y-%m-%d %H:%M:%S.%f'),
+                     'timestamp': event['timestamp'],
                      'side': side,
-                     'quantity': self.bucket_vol_remaining[self.bucket_idx],
+                     'quantity': from_lots(self.bucket_vol_remaining_lots[self.bucket_idx]),
                      'trade_id': trade_id}
         else:
             raise ValueError('No such event type allowed !!!')
@@ -229,15 +303,51 @@ class ExecutionAlgo:
 
     def update_remaining_volume(self, trade_log, event_type=None):
         if trade_log is not None and trade_log['quantity'] > 0:
-            self.vol_remaining -= Decimal(str(trade_log['quantity']))
-            self.bucket_vol_remaining[self.bucket_idx] -= Decimal(str(trade_log['quantity']))
-
-        if self.vol_remaining < -self.tick_size * len(self.bucket_volumes) or self.bucket_vol_remaining[self.bucket_idx] < -self.tick_size:
-            raise ValueError("More volume than available placed!")
+            self.book_traded_volume(trade_log['quantity'], self.bucket_idx)
+        else:
+            self._check_remaining_volume(self.bucket_idx)
 
         if event_type is not None and event_type == 'bucket_bound':
             self.bucket_idx += 1
 
+    def book_traded_volume(self, quantity, bucket_idx):
+        """ Deducts the traded Decimal 'quantity' from the remaining volume and from the one of bucket 'bucket_idx' """
+
+        lots = to_lots(quantity)
+        self.vol_remaining_lots -= lots
+        self.bucket_vol_remaining_lots[bucket_idx] -= lots
+        self._check_remaining_volume(bucket_idx)
+
+    def _check_remaining_volume(self, bucket_idx):
+        if self.vol_remaining_lots < -self.tick_lots * len(self.bucket_volumes_lots) or \
+                self.bucket_vol_remaining_lots[bucket_idx] < -self.tick_lots:
+            raise ValueError("More volume than available placed!")
+
+    # Decimal views of the volumes held in lots
+    @property
+    def vol_remaining(self):
+        return from_lots(self.vol_remaining_lots)
+
+    @property
+    def unexecuted_vol(self):
+        return from_lots(self.unexecuted_vol_lots)
+
+    @property
+    def bucket_volumes(self):
+        return [from_lots(lots) for lots in self.bucket_volumes_lots]
+
+    @property
+    def bucket_vol_remaining(self):
+        return [from_lots(lots) for lots in self.bucket_vol_remaining_lots]
+
+    @property
+    def volumes_per_trade(self):
+        return [[from_lots(lots) for lots in bucket] for bucket in self.volumes_per_trade_lots]
+
+    @property
+    def volumes_per_trade_default(self):
+        return [[from_lots(lots) for lots in bucket] for bucket in self.volumes_per_trade_default_lots]
+
     def plot_schedule(self, trade_logs=None):
         """ Plots the expected execution schedule determined ahead of trading """
 
@@ -304,54 +414,142 @@ class TWAPAlgo(ExecutionAlgo):
     def __init__(self, *args, **kwargs):
         super(TWAPAlgo, self).__init__(*args, **kwargs)
         # get the tick size implied by LOB data_feed
-        self.broker_data_feed.reset(time=self.start_time)
-        dt, lob = self.broker_data_feed.next_lob_snapshot()
+        dt, lob = self.broker_data_feed.snapshot_at(self.broker_data_feed.row_after(self.start_time))
         v = lob.bids.get_price_list(lob.get_best_bid()).volume
         tick = Decimal(str(1 / (10 ** abs(v.as_tuple().exponent))))
         self.tick_size = tick
+        self.tick_lots = to_lots(tick)
+        self.volume_lots = to_lots(self.volume)
         # Derive trading schedules
         start_time = datetime.strptime(self.start_time, '%Y-%m-%d %H:%M:%S')
         end_time = datetime.strptime(self.end_time, '%Y-%m-%d %H:%M:%S')
         self.buckets = Bucket(start_time, end_time, self.rand_bucket_bounds_width)
 
-        # split volume across buckets and check if this worked
+        # get execution times, split volume across buckets and check if this worked
+        self._sample_execution_times()
         self._split_volume_across_buckets()
-        if abs(np.sum(self.bucket_volumes) - self.volume) > self.tick_size:
+        if abs(self.bucket_volumes_lots.sum() - self.volume_lots) > self.tick_lots:
             raise ValueError("Volumes split across buckets didn't work out!")
 
-        # get execution times and split volume across orders/check
-        self._sample_execution_times()
+        # split volume across orders/check
         self._split_volume_within_buckets()
-        if abs(np.sum(self.volumes_per_trade) - self.volume) > self.tick_size:
+        if abs(self.volumes_per_trade_default_lots.sum() - self.volume_lots) > self.tick_lots:
             raise ValueError("Volumes split across orders didn't work out!")
         self.bmk_vwap = np.NaN
 
     def _split_volume_across_buckets(self):
         """ Aims to split volume across buckets as equal as possible """
 
-        perc_last_bucket = (self.buckets.bucket_bounds[-1] - self.buckets.bucket_bounds[-2]) / \
-                           (self.buckets.bucket_bounds[-1] - self.buckets.bucket_bounds[0])
-        vol_last_bucket = math.floor(float(self.volume) * perc_last_bucket
-                                     * int(1/self.tick_size))/int(1/self.tick_size)
+        # share of the last bucket in the duration, in python ints as the product can exceed int64
+        bounds_ms = self.buckets.bucket_bounds_ms
+        last_width_ms, total_width_ms = int(bounds_ms[-1] - bounds_ms[-2]), int(bounds_ms[-1] - bounds_ms[0])
+        lots_last_bucket = self.volume_lots * last_width_ms // total_width_ms // self.tick_lots * self.tick_lots
 
         # distribute volume across all buckets and add remaining to last
-        bucket_vol = split_across_buckets(float(self.volume) - vol_last_bucket,
-                                          self.buckets.n_buckets - 1, float(self.tick_size))
-        bucket_vol.append(Decimal(str(vol_last_bucket)))
+        bucket_lots = split_across_buckets(self.volume_lots - lots_last_bucket,
+                                           self.buckets.n_buckets - 1, self.tick_lots)
 
-        self.bucket_volumes = bucket_vol
+        self.bucket_volumes_lots = np.append(bucket_lots, lots_last_bucket)
 
     def _split_volume_within_buckets(self):
         """ Aims to split bucket volumes across trades as equal as possible """
 
-        split_vols = []
-        for i in range(self.buckets.n_buckets):
-            vols_per_trade = split_across_buckets(float(self.bucket_volumes[i]),
-                                                  self.no_of_slices, float(self.tick_size))
-            split_vols.append(vols_per_trade)
+        split_lots = split_across_buckets(self.bucket_volumes_lots, self.no_of_slices, self.tick_lots)
+        self.volumes_per_trade_lots = split_lots
+        self.volumes_per_trade_default_lots = split_lots.copy()
+
+
+class VWAPAlgo(TWAPAlgo):
+    """ Implementation of a VWAP Execution Algo, which splits the volume across the buckets in proportion to the
+        intraday volume profile (see HistoricalDataFeed.volume_profile) over each bucket. Within the buckets the
+        volume is split as in the TWAPAlgo.
+
+        Args:
+            volume_profile (np.array): shares of the volume in equal time-of-day bins, if None the profile of
+                                       the data feed with bins of 'profile_bin_secs' is used
+    """
+
+    def __init__(self, *args, volume_profile=None, profile_bin_secs=60, **kwargs):
+        self.volume_profile = volume_profile
+        self.profile_bin_secs = profile_bin_secs
+        super(VWAPAlgo, self).__init__(*args, **kwargs)
+
+    def _bucket_weights(self):
+        """ Share of the volume profile within each bucket, the profile is linearly interpolated within its bins """
+
+        if self.volume_profile is None:
+            self.volume_profile = self.broker_data_feed.volume_profile(self.profile_bin_secs)
+        profile = np.asarray(self.volume_profile, dtype=np.float64)
+        bin_edges_ms = np.arange(len(profile) + 1) * (MS_PER_DAY // len(profile))
+        cum_profile = np.concatenate(([0.], np.cumsum(profile)))
+
+        # the profile repeats every day, so executions can run past midnight
+        days, time_of_day_ms = np.divmod(self.buckets.bucket_bounds_ms, MS_PER_DAY)
+        cum_at_bounds = days * cum_profile[-1] + np.interp(time_of_day_ms, bin_edges_ms, cum_profile)
+        return np.diff(cum_at_bounds)
+
+    def _split_volume_across_buckets(self):
+        """ Splits the volume across buckets in proportion to the volume profile, the ticks left over by rounding
+            down go to the buckets with the largest remainders """
+
+        weights = self._bucket_weights()
+        if weights.sum() <= 0:
+            # no volume expected during the execution
+            return super(VWAPAlgo, self)._split_volume_across_buckets()
+
+        ticks = self.volume_lots // self.tick_lots
+        shares = ticks * weights / weights.sum()
+        bucket_ticks = np.floor(shares).astype(np.int64)
+        remaining_ticks = ticks - bucket_ticks.sum()
+        bucket_ticks[np.argsort(bucket_ticks - shares, kind='stable')[:remaining_ticks]] += 1
+        self.bucket_volumes_lots = bucket_ticks * self.tick_lots
+
+
+class POVAlgo(TWAPAlgo):
+    """ Implementation of a percentage-of-volume Execution Algo, whose orders are sized to 'participation_rate' of
+        the market activity since the previous order (see env_utils.level_depletion). Once the volume is reached the
+        remaining orders are empty, the volume the market activity didn't allow for is added to the last order.
+
+        The market activity between the events only depends on the data, so the sizes of all orders are computed
+        when the algo is created, in one pass over the rows of the execution.
+
+        Args:
+            participation_rate (float): share of the market activity to trade, in (0, 1]
+    """
+
+    def __init__(self, *args, participation_rate=0.1, **kwargs):
+        if not 0 < participation_rate <= 1:
+            raise ValueError("'participation_rate' must be in (0, 1], got {}".format(participation_rate))
+        self.participation_rate = participation_rate
+        super(POVAlgo, self).__init__(*args, **kwargs)
+
+    def market_activity(self):
+        """ Lots depleted from the book before each order placement of the event plan, since the previous order
+            (or the start of the execution for the first one) """
+
+        order_rows = self.event_plan['row'][self.event_plan['type'] == ORDER_PLACEMENT]
+        start_row = self.broker_data_feed.row_after(self.start_time)
+        _, levels = self.broker_data_feed.lob_window(start_row, int(order_rows.max()) + 1)
+        depleted_lots = np.rint(level_depletion(levels) * 10 ** LOT_DECIMALS).astype(np.int64)
+        cum_depleted_lots = np.concatenate(([0], np.cumsum(depleted_lots)))
+        return np.diff(cum_depleted_lots[np.clip(order_rows - start_row, 0, len(depleted_lots))], prepend=0)
+
+    def _split_volume_across_buckets(self):
+        """ Sizes the orders to the participation rate, the buckets get the volume of their orders """
+
+        order_events = self.event_plan[self.event_plan['type'] == ORDER_PLACEMENT]
+        target_ticks = np.floor(self.participation_rate * self.market_activity() / self.tick_lots).astype(np.int64)
+        order_lots = np.diff(np.minimum(np.cumsum(target_ticks * self.tick_lots), self.volume_lots), prepend=0)
+        order_lots[-1] += self.volume_lots - order_lots.sum()
+
+        self.volumes_per_trade_default_lots = np.zeros_like(self.execution_times_ms)
+        self.volumes_per_trade_default_lots[order_events['bucket_idx'], order_events['order_idx']] = order_lots
+        self.bucket_volumes_lots = self.volumes_per_trade_default_lots.sum(axis=1)
+
+    def _split_volume_within_buckets(self):
+        """ The orders are already sized by _split_volume_across_buckets() """
 
-        self.volumes_per_trade = split_vols
-        self.volumes_per_trade_default = copy.deepcopy(split_vols)
+        self.volumes_per_trade_lots = self.volumes_per_trade_default_lots.copy()
 
 
 class RLAlgo(ExecutionAlgo):
@@ -363,17 +561,20 @@ class RLAlgo(ExecutionAlgo):
         self.start_time = benchmark_algo.start_time
         self.end_time = benchmark_algo.end_time
         self.execution_times = benchmark_algo.execution_times
+        self.execution_times_ms = benchmark_algo.execution_times_ms
+        self.event_plan = benchmark_algo.event_plan
+        self.event_timestamps = benchmark_algo.event_timestamps
         self.tick_size = benchmark_algo.tick_size
+        self.tick_lots = benchmark_algo.tick_lots
         self.buckets = benchmark_algo.buckets
-        self.bucket_volumes = benchmark_algo.bucket_volumes.copy()
-        self.bucket_vol_remaining = benchmark_algo.bucket_volumes.copy()
-        self.volumes_per_trade = []
-        for bucket in range(len(benchmark_algo.volumes_per_trade)):
-            self.volumes_per_trade.append(list([Decimal(0) for order_event in benchmark_algo.volumes_per_trade_default[bucket]]))
-        self.volumes_per_trade_default = copy.deepcopy(benchmark_algo.volumes_per_trade_default)
-
-        self.vol_remaining = Decimal(str(self.volume))
-        self.bucket_vol_remaining = self.bucket_volumes.copy()
+        self.volume_lots = to_lots(self.volume)
+        self.bucket_volumes_lots = benchmark_algo.bucket_volumes_lots.copy()
+        self.volumes_per_trade_default_lots = benchmark_algo.volumes_per_trade_default_lots.copy()
+        self.volumes_per_trade_lots = np.zeros_like(self.volumes_per_trade_default_lots)
+
+        self.vol_remaining_lots = self.volume_lots
+        self.bucket_vol_remaining_lots = self.bucket_volumes_lots.copy()
+        self.unexecuted_vol_lots = 0
         self.event_idx = 0
         self.order_idx = 0
         self.bucket_idx = 0
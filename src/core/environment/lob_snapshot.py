@@ -0,0 +1,231 @@
+import copy
+import numpy as np
+from collections import deque
+from decimal import Decimal
+from src.core.environment.orderbook import OrderBook, PriceLevel
+from src.core.environment.env_utils import raw_to_order_book
+
+# decimal places of the prices and quantities of the LOB data, sweep() trades in int units of 10 ** -SWEEP_DECIMALS
+SWEEP_DECIMALS = 8
+
+
+class SnapshotSide(object):
+    '''
+    Read-only view on one side of a LOB snapshot. Mirrors the query methods of OrderTree,
+    prices and volumes are only converted to Decimal when they are queried.
+    '''
+
+    def __init__(self, prices, volumes, descending):
+        self._prices = prices # level prices as stored in the raw data, best price first
+        self._volumes = volumes
+        self._descending = descending # True for bids, i.e. the best price is the highest
+        self._price_list = None
+        self._volume_map = None
+
+    def __len__(self):
+        return len(self._prices)
+
+    @property
+    def depth(self):
+        return len(self._prices)
+
+    @property
+    def volume(self):
+        return sum(Decimal(str(v)) for v in self._volumes.tolist())
+
+    @property
+    def prices(self):
+        '''Level prices in ascending order, like OrderTree.prices'''
+        if self._price_list is None:
+            prices = [Decimal(str(p)) for p in self._prices.tolist()]
+            self._price_list = prices[::-1] if self._descending else prices
+        return self._price_list
+
+    def _best_price(self):
+        return Decimal(str(self._prices[0])) if len(self._prices) > 0 else None
+
+    def _worst_price(self):
+        return Decimal(str(self._prices[-1])) if len(self._prices) > 0 else None
+
+    def max_price(self):
+        return self._best_price() if self._descending else self._worst_price()
+
+    def min_price(self):
+        return self._worst_price() if self._descending else self._best_price()
+
+    def price_exists(self, price):
+        return Decimal(price) in self._get_volume_map()
+
+    def get_price_list(self, price):
+        price = Decimal(price)
+        if len(self._prices) > 0 and price == self._best_price():
+            # fast path for the best level, which is queried most often
+            return PriceLevel(price, Decimal(str(self._volumes[0])))
+        return PriceLevel(price, self._get_volume_map()[price])
+
+    def _get_volume_map(self):
+        if self._volume_map is None:
+            self._volume_map = {Decimal(str(p)): Decimal(str(v))
+                                for p, v in zip(self._prices.tolist(), self._volumes.tolist())}
+        return self._volume_map
+
+
+class LobSnapshot(object):
+    '''
+    Read-only snapshot of the limit order book backed directly by a raw (4, depth) array of
+    ask prices, ask quantities, bid prices and bid quantities. Supports the queries of OrderBook
+    used by the broker and the env. A full OrderBook is only built lazily once an order is
+    processed against the snapshot, afterwards all queries are delegated to that book.
+    If 'tick_size' and 'lot_size' are given, the book is a TickOrderBook matching in int ticks and lots.
+    A 'book_source' callable returning the OrderBook of the snapshot can replace building it from the levels,
+    e.g. to take a copy of a book which is maintained incrementally by the data feed.
+    Market orders can be filled directly against the level arrays with sweep() as long as no book is needed.
+    '''
+
+    def __init__(self, levels, timestamp, depth=None, tick_size=None, lot_size=None, book_source=None):
+        self.levels = levels
+        self.timestamp = timestamp # datetime of the snapshot
+        self.depth = depth if depth is not None else levels.shape[1]
+        self.tick_size = tick_size
+        self.lot_size = lot_size
+        self._book_source = book_source
+        self._book = None
+        self._asks = SnapshotSide(levels[0, :self.depth], levels[1, :self.depth], descending=False)
+        self._bids = SnapshotSide(levels[2, :self.depth], levels[3, :self.depth], descending=True)
+        self._swept = False # True once sweep() has taken volume from the levels
+
+    def _build_book(self):
+        if self._swept:
+            return OrderBook.from_arrays(self._asks._prices, self._asks._volumes,
+                                         self._bids._prices, self._bids._volumes,
+                                         timestamp=self.timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        if self._book_source is not None:
+            return self._book_source()
+        return raw_to_order_book(current_book=self.levels,
+                                 time=self.timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                                 depth=self.depth,
+                                 tick_size=self.tick_size,
+                                 lot_size=self.lot_size)
+
+    @property
+    def book(self):
+        if self._book is None:
+            self._book = self._build_book()
+        return self._book
+
+    @property
+    def is_materialised(self):
+        return self._book is not None
+
+    @property
+    def bids(self):
+        return self._book.price_levels('bid') if self._book is not None else self._bids
+
+    @property
+    def asks(self):
+        return self._book.price_levels('ask') if self._book is not None else self._asks
+
+    @property
+    def tape(self):
+        return self._book.tape if self._book is not None else deque(maxlen=None)
+
+    @property
+    def sweepable(self):
+        '''True if market orders can be filled with sweep(), i.e. the snapshot is matched in Decimal prices
+        and no book has been built for it'''
+        return self._book is None and self._book_source is None and self.lot_size is None
+
+    def sweep(self, side, quantity):
+        '''
+        Fills a market order of 'quantity' on 'side' against the opposite levels, like OrderBook.process_market_order,
+        and removes the traded volume from the snapshot and its levels. Returns the filled quantity, the volume
+        weighted price of the fill (None if there was nothing to trade against) and the number of levels traded against.
+        '''
+        if not self.sweepable:
+            raise ValueError('Only snapshots without a book can be swept')
+        levels = self._asks if side == 'bid' else self._bids
+        prices, volumes = levels._prices, levels._volumes
+        # the fill is computed in int units of 10 ** -SWEEP_DECIMALS, which is exact for the data
+        unit = 10 ** SWEEP_DECIMALS
+        volume_units = np.rint(volumes * unit).astype(np.int64)
+        quantity_units = int(Decimal(quantity).scaleb(SWEEP_DECIMALS).to_integral_value())
+        units_before = np.cumsum(volume_units) - volume_units
+
+        # every level with volume left to trade when it is reached is traded against
+        n_traded = int(np.count_nonzero(units_before < quantity_units))
+        if n_traded == 0:
+            return Decimal(0), None, 0
+        traded_units = np.minimum(volume_units[:n_traded], quantity_units - units_before[:n_traded])
+        price_units = np.rint(prices[:n_traded] * unit).astype(np.int64)
+        # the notional can exceed int64, so the dot product is taken in python ints
+        notional_units = int(np.dot(price_units.astype(object), traded_units.astype(object)))
+        filled = Decimal(int(traded_units.sum())).scaleb(-SWEEP_DECIMALS)
+        notional = Decimal(notional_units).scaleb(-2 * SWEEP_DECIMALS)
+        n_emptied = int(np.count_nonzero(traded_units == volume_units[:n_traded]))
+        left_volume = None
+        if n_emptied < n_traded:
+            left_volume = Decimal(int(volume_units[n_traded - 1] - traded_units[-1])).scaleb(-SWEEP_DECIMALS)
+
+        # the traded volume is also taken from a copy of the raw levels, which can be read-only views on the data,
+        # so that records of the snapshot see the swept book. Emptied levels keep their price with quantity 0
+        volume_row = 1 if side == 'bid' else 3
+        first = self.depth - len(prices) + n_emptied # first level left after the sweep
+        raw_levels = np.array(self.levels, dtype=np.float64)
+        raw_levels[volume_row, first - n_emptied:first] = 0
+        if left_volume is not None:
+            raw_levels[volume_row, first] = float(left_volume)
+        self.levels = raw_levels
+        swept = SnapshotSide(raw_levels[volume_row - 1, first:self.depth], raw_levels[volume_row, first:self.depth],
+                             levels._descending)
+        if side == 'bid':
+            self._asks = swept
+        else:
+            self._bids = swept
+        self._swept = True
+        return filled, notional / filled, n_traded
+
+    def process_order(self, quote, from_data, verbose):
+        return self.book.process_order(quote, from_data, verbose)
+
+    def cancel_order(self, side, order_id, time=None):
+        self.book.cancel_order(side, order_id, time)
+
+    def modify_order(self, order_id, order_update, time=None):
+        self.book.modify_order(order_id, order_update, time)
+
+    def get_volume_at_price(self, side, price):
+        if self._book is not None:
+            return self._book.get_volume_at_price(side, price)
+        tree = self._bids if side == 'bid' else self._asks
+        return tree.get_price_list(price).volume if tree.price_exists(price) else 0
+
+    def get_best_bid(self):
+        return self.bids.max_price()
+
+    def get_worst_bid(self):
+        return self.bids.min_price()
+
+    def get_best_ask(self):
+        return self.asks.min_price()
+
+    def get_worst_ask(self):
+        return self.asks.max_price()
+
+    def snapshot(self):
+        '''Cheap copy of the snapshot, the levels are shared and a materialised book is copied on write'''
+        snapshot = self.__class__.__new__(self.__class__)
+        snapshot.__dict__.update(self.__dict__)
+        if self._book is not None:
+            snapshot._book = self._book.snapshot()
+        return snapshot
+
+    def __deepcopy__(self, memo):
+        # the book source is shared, deep copying it would copy e.g. the whole data feed
+        snapshot = self.__class__.__new__(self.__class__)
+        memo[id(self)] = snapshot
+        for k, v in self.__dict__.items():
+            setattr(snapshot, k, v if k == '_book_source' else copy.deepcopy(v, memo))
+        return snapshot
+
+    def __str__(self):
+        return str(self._book if self._book is not None else self._build_book())
@@ -9,10 +9,10 @@ class Order(object):
     to help the exchange fullfill orders with quantities larger than a single
     existing Order.
     '''
-    def __init__(self, quote, order_list):
+    def __init__(self, quote, order_list, number_type=Decimal):
         self.timestamp = int(quote['timestamp']) # integer representing the timestamp of order creation
-        self.quantity = Decimal(quote['quantity']) # decimal representing amount of thing - can be partial amounts
-        self.price = Decimal(quote['price']) # decimal representing price (currency)
+        self.quantity = number_type(quote['quantity']) # decimal representing amount of thing - can be partial amounts, or int lots
+        self.price = number_type(quote['price']) # decimal representing price (currency), or int ticks
         self.order_id = int(quote['order_id'])
         self.trade_id = quote['trade_id']
         # doubly linked list to make it easier to re-order Orders for a particular price point
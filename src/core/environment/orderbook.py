@@ -1,25 +1,114 @@
 import sys
+import numpy as np
 from collections import deque # a faster insert/pop queue
 from six.moves import cStringIO as StringIO
-from decimal import Decimal
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_FLOOR, ROUND_CEILING
 from src.core.environment.ordertree import OrderTree
 
 
+PriceLevel = namedtuple('PriceLevel', ['price', 'volume'])
+
+
 class OrderBook(object):
+    number_type = Decimal # type of prices and quantities stored in the trees
+
     def __init__(self, tick_size = 0.0001):
         self.tape = deque(maxlen=None) # Index[0] is most recent trade
-        self.bids = OrderTree()
-        self.asks = OrderTree()
+        self.bids = OrderTree(self.number_type)
+        self.asks = OrderTree(self.number_type)
         self.last_tick = None
         self.last_timestamp = 0
         self.tick_size = tick_size
         self.time = 0
         self.next_order_id = 0
+        self._shared = False # trees and tape are shared with snapshots and copied on the next change
+
+    @classmethod
+    def from_arrays(cls, ask_px, ask_qty, bid_px, bid_qty, timestamp=None, **kwargs):
+        '''
+        Bulk loads the levels of an uncrossed LOB snapshot (asks ascending, bids descending, best price first)
+        without any matching. Order ids, trade ids and the time counter are the same as if the bid and then the
+        ask levels were placed one by one through process_order, so the book behaves identically afterwards.
+        '''
+        book = cls(**kwargs)
+        bid_px, bid_qty = book._level_prices(bid_px), book._level_quantities(bid_qty)
+        ask_px, ask_qty = book._level_prices(ask_px), book._level_quantities(ask_qty)
+        n_bids, n_asks = len(bid_px), len(ask_px)
+
+        book.bids.load_orders([{'timestamp': idx + 1, 'price': bid_px[idx], 'quantity': bid_qty[idx],
+                                'order_id': idx + 1, 'trade_id': n_asks + idx} for idx in range(n_bids)])
+        book.asks.load_orders([{'timestamp': n_bids + idx + 1, 'price': ask_px[idx], 'quantity': ask_qty[idx],
+                                'order_id': n_bids + idx + 1, 'trade_id': idx} for idx in range(n_asks)])
+        book.time = n_bids + n_asks
+        book.next_order_id = n_bids + n_asks
+        if timestamp is not None:
+            book.last_timestamp = timestamp
+        return book
+
+    def _level_prices(self, prices):
+        return [Decimal(str(p)) for p in np.asarray(prices, dtype=np.float64).tolist()]
+
+    def _level_quantities(self, quantities):
+        return [Decimal(str(q)) for q in np.asarray(quantities, dtype=np.float64).tolist()]
+
+    def snapshot(self):
+        '''
+        Copy-on-write copy of the book. Trees and tape are shared with this book until either of them is changed
+        through process_order, cancel_order, modify_order or update_levels, which copies the tape and the price maps
+        first. The price levels stay shared after that, only the levels that are changed get copied.
+        '''
+        book = self.__class__.__new__(self.__class__)
+        book.__dict__.update(self.__dict__)
+        self._shared = book._shared = True
+        return book
+
+    def _unshare(self):
+        if self._shared:
+            self.tape = deque(self.tape, maxlen=self.tape.maxlen)
+            self.bids = self.bids.copy()
+            self.asks = self.asks.copy()
+            self._shared = False
+
+    def update_levels(self, previous_levels, levels):
+        '''
+        Moves a book holding the raw (4, depth) snapshot 'previous_levels' to the snapshot 'levels'. The changed
+        levels are found vectorised over the depth, only those are removed, inserted or updated in the trees.
+        '''
+        self._unshare()
+        for tree, px_row, qty_row in ((self.asks, 0, 1), (self.bids, 2, 3)):
+            previous_px, px = previous_levels[px_row], levels[px_row]
+            previous_qty, qty = previous_levels[qty_row], levels[qty_row]
+
+            # levels at a new price or with a new quantity at the same price
+            in_previous = np.isin(px, previous_px)
+            changed = ~in_previous
+            if in_previous.any():
+                order = np.argsort(previous_px)
+                previous_idx = order[np.searchsorted(previous_px, px[in_previous], sorter=order)]
+                changed[in_previous] = previous_qty[previous_idx] != qty[in_previous]
+
+            for price in self._level_prices(previous_px[~np.isin(previous_px, px)]):
+                if tree.price_exists(price):
+                    for order in list(tree.get_price_list(price)):
+                        tree.remove_order_by_id(order.order_id) # removes the price once the level is empty
+
+            for price, quantity in zip(self._level_prices(px[changed]), self._level_quantities(qty[changed])):
+                self.update_time()
+                if tree.price_exists(price):
+                    head_order = tree.get_price_list(price).get_head_order()
+                    tree.update_order({'order_id': head_order.order_id, 'price': price, 'quantity': quantity,
+                                       'timestamp': self.time})
+                else:
+                    self.next_order_id += 1
+                    tree.insert_order({'order_id': self.next_order_id, 'price': price, 'quantity': quantity,
+                                       'timestamp': self.time, 'trade_id': None})
 
     def update_time(self):
         self.time += 1
 
     def process_order(self, quote, from_data, verbose):
+        self._unshare()
         order_type = quote['type']
         order_in_book = None
         if from_data:
@@ -34,7 +123,7 @@ class OrderBook(object):
         if order_type == 'market':
             trades = self.process_market_order(quote, verbose)
         elif order_type == 'limit':
-            quote['price'] = Decimal(quote['price'])
+            quote['price'] = self.number_type(quote['price'])
             trades, order_in_book = self.process_limit_order(quote, from_data, verbose)
         else:
             sys.exit("order_type for process_order() is neither 'market' or 'limit'")
@@ -99,12 +188,12 @@ class OrderBook(object):
         side = quote['side']
         if side == 'bid':
             while quantity_to_trade > 0 and self.asks:
-                best_price_asks = self.asks.min_price_list()
+                best_price_asks = self.asks.own_price_list(self.asks.min_price())
                 quantity_to_trade, new_trades = self.process_order_list('ask', best_price_asks, quantity_to_trade, quote, verbose)
                 trades += new_trades
         elif side == 'ask':
             while quantity_to_trade > 0 and self.bids:
-                best_price_bids = self.bids.max_price_list()
+                best_price_bids = self.bids.own_price_list(self.bids.max_price())
                 quantity_to_trade, new_trades = self.process_order_list('bid', best_price_bids, quantity_to_trade, quote, verbose)
                 trades += new_trades
         else:
@@ -119,7 +208,7 @@ class OrderBook(object):
         price = quote['price']
         if side == 'bid':
             while (self.asks and price >= self.asks.min_price() and quantity_to_trade > 0):
-                best_price_asks = self.asks.min_price_list()
+                best_price_asks = self.asks.own_price_list(self.asks.min_price())
                 quantity_to_trade, new_trades = self.process_order_list('ask', best_price_asks, quantity_to_trade, quote, verbose)
                 trades += new_trades
             # If volume remains, need to update the book with new quantity
@@ -131,7 +220,7 @@ class OrderBook(object):
                 order_in_book = quote
         elif side == 'ask':
             while (self.bids and price <= self.bids.max_price() and quantity_to_trade > 0):
-                best_price_bids = self.bids.max_price_list()
+                best_price_bids = self.bids.own_price_list(self.bids.max_price())
                 quantity_to_trade, new_trades = self.process_order_list('bid', best_price_bids, quantity_to_trade, quote, verbose)
                 trades += new_trades
             # If volume remains, need to update the book with new quantity
@@ -146,6 +235,7 @@ class OrderBook(object):
         return trades, order_in_book
 
     def cancel_order(self, side, order_id, time=None):
+        self._unshare()
         if time:
             self.time = time
         else:
@@ -160,6 +250,7 @@ class OrderBook(object):
             sys.exit('cancel_order() given neither "bid" nor "ask"')
 
     def modify_order(self, order_id, order_update, time=None):
+        self._unshare()
         if time:
             self.time = time
         else:
@@ -181,16 +272,20 @@ class OrderBook(object):
         if side == 'bid':
             volume = 0
             if self.bids.price_exists(price):
-                volume = self.bids.get_price(price).volume
+                volume = self.bids.get_price_list(price).volume
             return volume
         elif side == 'ask':
             volume = 0
             if self.asks.price_exists(price):
-                volume = self.asks.get_price(price).volume
+                volume = self.asks.get_price_list(price).volume
             return volume
         else:
             sys.exit('get_volume_at_price() given neither "bid" nor "ask"')
 
+    def price_levels(self, side):
+        '''Price levels of one side of the book in Decimal prices and volumes'''
+        return self.bids if side == 'bid' else self.asks
+
     def get_best_bid(self):
         return self.bids.max_price()
 
@@ -233,4 +328,132 @@ class OrderBook(object):
                 else:
                     break
         tempfile.write("\n")
-        return tempfile.getvalue()
\ No newline at end of file
+        return tempfile.getvalue()
+
+
+class TickTreeView(object):
+    '''
+    Read-only view on an OrderTree of a TickOrderBook. Mirrors the query methods of OrderTree
+    but converts int ticks and lots back to Decimal prices and volumes.
+    '''
+
+    def __init__(self, tree, tick_size, lot_size):
+        self.tree = tree
+        self.tick_size = tick_size
+        self.lot_size = lot_size
+
+    def __len__(self):
+        return len(self.tree)
+
+    @property
+    def depth(self):
+        return self.tree.depth
+
+    @property
+    def volume(self):
+        return self.tree.volume * self.lot_size
+
+    @property
+    def prices(self):
+        return [p * self.tick_size for p in self.tree.prices]
+
+    def _to_ticks(self, price):
+        ticks = Decimal(price) / self.tick_size
+        return int(ticks) if ticks == ticks.to_integral_value() else None
+
+    def price_exists(self, price):
+        return self._to_ticks(price) in self.tree.price_map
+
+    def get_price_list(self, price):
+        return PriceLevel(Decimal(price), self.tree.get_price_list(self._to_ticks(price)).volume * self.lot_size)
+
+    def max_price(self):
+        price = self.tree.max_price()
+        return price * self.tick_size if price is not None else None
+
+    def min_price(self):
+        price = self.tree.min_price()
+        return price * self.tick_size if price is not None else None
+
+
+class TickOrderBook(OrderBook):
+    '''
+    OrderBook storing and matching prices as int ticks and quantities as int lots of the instrument.
+    Quotes are converted at the API boundary (process_order, cancel_order, modify_order and the queries),
+    so the inputs and outputs are Decimal as for OrderBook. Only the trees (bids, asks) hold ticks and lots,
+    use price_levels() for a Decimal view on them.
+
+    Limit prices which are not on the tick grid are rounded away from the market (bids down, asks up),
+    which keeps them matching exactly against the same price levels. Quantities are rounded to the
+    nearest lot, quotes of less than half a lot raise a ValueError.
+    '''
+    number_type = int
+
+    def __init__(self, tick_size, lot_size):
+        super(TickOrderBook, self).__init__(tick_size=Decimal(str(tick_size)))
+        self.lot_size = Decimal(str(lot_size))
+
+    def to_ticks(self, price, rounding=ROUND_HALF_EVEN):
+        price = Decimal(str(price)) if isinstance(price, float) else Decimal(price)
+        return int((price / self.tick_size).to_integral_value(rounding=rounding))
+
+    def to_lots(self, quantity):
+        quantity = Decimal(str(quantity)) if isinstance(quantity, float) else Decimal(quantity)
+        return int((quantity / self.lot_size).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+    def _level_prices(self, prices):
+        return np.rint(np.asarray(prices, dtype=np.float64) / float(self.tick_size)).astype(np.int64).tolist()
+
+    def _level_quantities(self, quantities):
+        return np.rint(np.asarray(quantities, dtype=np.float64) / float(self.lot_size)).astype(np.int64).tolist()
+
+    def _quote_to_ticks(self, quote):
+        tick_quote = dict(quote)
+        tick_quote['quantity'] = self.to_lots(quote['quantity'])
+        if tick_quote['quantity'] == 0 and quote['quantity'] > 0:
+            raise ValueError("Quantity {} is less than half a lot of {}".format(quote['quantity'], self.lot_size))
+        if quote.get('type') != 'market':
+            rounding = ROUND_FLOOR if quote['side'] == 'bid' else ROUND_CEILING
+            tick_quote['price'] = self.to_ticks(quote['price'], rounding)
+        return tick_quote
+
+    def _trade_to_decimal(self, trade):
+        trade['price'] = trade['price'] * self.tick_size
+        trade['quantity'] = trade['quantity'] * self.lot_size
+        if trade['party1'][3] is not None:
+            trade['party1'][3] = trade['party1'][3] * self.lot_size
+
+    def process_order(self, quote, from_data, verbose):
+        trades, order_in_book = self.process_tick_order(self._quote_to_ticks(quote), from_data, verbose)
+        # trades are the same records as appended to the tape, so the tape is converted as well
+        for trade in trades:
+            self._trade_to_decimal(trade)
+        if order_in_book is not None:
+            order_in_book['price'] = order_in_book['price'] * self.tick_size
+            order_in_book['quantity'] = order_in_book['quantity'] * self.lot_size
+        return trades, order_in_book
+
+    def process_tick_order(self, quote, from_data, verbose):
+        '''process_order for a quote already in ticks and lots, returns trades in ticks and lots'''
+        return super(TickOrderBook, self).process_order(quote, from_data, verbose)
+
+    def modify_order(self, order_id, order_update, time=None):
+        super(TickOrderBook, self).modify_order(order_id, self._quote_to_ticks(order_update), time)
+
+    def price_levels(self, side):
+        return TickTreeView(self.bids if side == 'bid' else self.asks, self.tick_size, self.lot_size)
+
+    def get_volume_at_price(self, side, price):
+        return self.price_levels(side).get_price_list(price).volume if self.price_levels(side).price_exists(price) else 0
+
+    def get_best_bid(self):
+        return self.price_levels('bid').max_price()
+
+    def get_worst_bid(self):
+        return self.price_levels('bid').min_price()
+
+    def get_best_ask(self):
+        return self.price_levels('ask').min_price()
+
+    def get_worst_ask(self):
+        return self.price_levels('ask').max_price()
@@ -1,3 +1,5 @@
+from copy import copy
+from decimal import Decimal
 from sortedcontainers import SortedDict
 from src.core.environment.orderlist import OrderList
 from src.core.environment.order import Order
@@ -8,13 +10,15 @@ class OrderTree(object):
     Keeping the information in a red black tree makes it easier/faster to detect a match.
     '''
 
-    def __init__(self):
+    def __init__(self, number_type=Decimal):
+        self.number_type = number_type # Decimal, or int for books in integer ticks and lots
         self.price_map = SortedDict() # Dictionary containing price : OrderList object
         self.prices = self.price_map.keys()
         self.order_map = {} # Dictionary containing order_id : Order object
         self.volume = 0 # Contains total quantity from all Orders in tree
         self.num_orders = 0 # Contains count of Orders in tree
         self.depth = 0 # Number of different prices in tree (http://en.wikipedia.org/wiki/Order_book_(trading)#Book_depth)
+        self._shared_prices = set() # prices whose OrderList is shared with a copy of the tree, copied before a change
 
     def __len__(self):
         return len(self.order_map)
@@ -22,6 +26,19 @@ class OrderTree(object):
     def get_price_list(self, price):
         return self.price_map[price]
 
+    def own_price_list(self, price):
+        '''OrderList at a price that can be changed in place, the level is copied first if it is shared'''
+        if price in self._shared_prices:
+            self._shared_prices.discard(price)
+            order_list = OrderList()
+            for shared_order in self.price_map[price]:
+                order = copy(shared_order)
+                order.order_list = order_list
+                order_list.append_order(order)
+                self.order_map[order.order_id] = order
+            self.price_map[price] = order_list
+        return self.price_map[price]
+
     def get_order(self, order_id):
         return self.order_map[order_id]
 
@@ -33,6 +50,7 @@ class OrderTree(object):
     def remove_price(self, price):
         self.depth -= 1 # Remove a price depth level
         del self.price_map[price]
+        self._shared_prices.discard(price)
 
     def price_exists(self, price):
         return price in self.price_map
@@ -46,17 +64,47 @@ class OrderTree(object):
         self.num_orders += 1
         if quote['price'] not in self.price_map:
             self.create_price(quote['price']) # If price not in Price Map, create a node in RBtree
-        order = Order(quote, self.price_map[quote['price']]) # Create an order
-        self.price_map[order.price].append_order(order) # Add the order to the OrderList in Price Map
+        order_list = self.own_price_list(quote['price'])
+        order = Order(quote, order_list, self.number_type) # Create an order
+        order_list.append_order(order) # Add the order to the OrderList in Price Map
         self.order_map[order.order_id] = order
         self.volume += order.quantity
 
+    def load_orders(self, quotes):
+        '''Bulk insert of resting orders into an empty tree, without checks for existing orders'''
+        price_lists = {}
+        for quote in quotes:
+            if quote['price'] not in price_lists:
+                price_lists[quote['price']] = OrderList()
+            order = Order(quote, price_lists[quote['price']], self.number_type)
+            price_lists[quote['price']].append_order(order)
+            self.order_map[order.order_id] = order
+            self.volume += order.quantity
+        self.num_orders += len(quotes)
+        self.depth += len(price_lists)
+        self.price_map = SortedDict(price_lists)
+        self.prices = self.price_map.keys()
+
+    def copy(self):
+        '''
+        Copy of the tree sharing its OrderLists and Orders with this tree. Only the price maps are copied, a price
+        level is copied by whichever tree changes it first (see own_price_list).
+        '''
+        tree = OrderTree(self.number_type)
+        tree.price_map = self.price_map.copy()
+        tree.prices = tree.price_map.keys()
+        tree.order_map = self.order_map.copy()
+        tree.volume, tree.num_orders, tree.depth = self.volume, self.num_orders, self.depth
+        self._shared_prices = set(self.price_map)
+        tree._shared_prices = set(self.price_map)
+        return tree
+
     def update_order(self, order_update):
+        order_list = self.own_price_list(self.order_map[order_update['order_id']].price)
         order = self.order_map[order_update['order_id']]
         original_quantity = order.quantity
         if order_update['price'] != order.price:
             # Price changed. Remove order and update tree.
-            order_list = self.price_map[order.price]
             order_list.remove_order(order)
             if len(order_list) == 0: # If there is nothing else in the OrderList, remove the price from RBtree
                 self.remove_price(order.price)
@@ -68,6 +116,7 @@ class OrderTree(object):
 
     def remove_order_by_id(self, order_id):
         self.num_orders -= 1
+        self.own_price_list(self.order_map[order_id].price)
         order = self.order_map[order_id]
         self.volume -= order.quantity
         order.order_list.remove_order(order)
@@ -39,8 +39,8 @@ def eval_agent_one_day(trainer, env, nr_episodes,session_dir,day, plot=False, ):
         reward_vec.append(episode_reward)
         vwap_bmk.append(env.broker.benchmark_algo.bmk_vwap)
         vwap_rl.append(env.broker.rl_algo.rl_vwap)
-        vol_percentages.append(np.mean(np.array(env.broker.rl_algo.volumes_per_trade)/
-                                     np.array(env.broker.rl_algo.bucket_volumes)[:,None],axis= 0,dtype=np.float32))
+        vol_percentages.append(np.mean(env.broker.rl_algo.volumes_per_trade_lots/
+                                     env.broker.rl_algo.bucket_volumes_lots[:,None],axis= 0,dtype=np.float32))
 
     outperf = [True if vwap > vwap_rl[idx] else False for idx, vwap in enumerate(vwap_bmk)]
     vwap_perc_diff = (np.array(vwap_bmk)-np.array(vwap_rl)) / np.array(vwap_bmk)
@@ -89,8 +89,8 @@ def eval_agent(trainer, env, nr_episodes,):
         reward_vec.append(episode_reward)
         vwap_bmk.append(env.broker.benchmark_algo.bmk_vwap)
         vwap_rl.append(env.broker.rl_algo.rl_vwap)
-        vol_percentages.append(np.mean(np.array(env.broker.rl_algo.volumes_per_trade)/
-                                       np.array(env.broker.rl_algo.bucket_volumes)[:,None],axis= 0,dtype=np.float32))
+        vol_percentages.append(np.mean(env.broker.rl_algo.volumes_per_trade_lots/
+                                       env.broker.rl_algo.bucket_volumes_lots[:,None],axis= 0,dtype=np.float32))
         # execution_time_bmk.append((datetime.strptime(env.broker.trade_logs['benchmark_algo'][-1]['timestamp'], '%Y-%m-%d %H:%M:%S.%f') -
         #                            datetime.strptime(env.broker.trade_logs['benchmark_algo'][0]['timestamp'], '%Y-%m-%d %H:%M:%S.%f')).seconds)
         # execution_time_rl.append((datetime.strptime(env.broker.trade_logs['rl_algo'][-1]['timestamp'], '%Y-%m-%d %H:%M:%S.%f') -
@@ -259,7 +259,14 @@ def evaluate_session(sessions_path,config,trainer, session_id):
 
     # Evaluate on the entire eval period
 
-    env = lob_env_creator(env_config= config["env_config"])
+    # caching the benchmark executions on disk is opt-in through 'benchmark_cache_dir' of the exec_config, a relative
+    # dir is kept with the session instead of the shared data. The config of the caller is left unchanged
+    env_config = config["env_config"]
+    exec_config = env_config.get("exec_config", {})
+    if exec_config.get("benchmark_cache_dir") is not None:
+        cache_dir = os.path.join(sessions_path, str(session_id), exec_config["benchmark_cache_dir"])
+        env_config = dict(env_config, exec_config=dict(exec_config, benchmark_cache_dir=cache_dir))
+    env = lob_env_creator(env_config= env_config)
     try:
         d_out, stats = eval_agent(trainer= agent,env= env ,nr_episodes= 1000,)
         eval_period_tag = '{}-{}-{} to {}-{}-{}'.format(config["env_config"]["train_config"]["eval_data_periods"][0],
@@ -1,3 +1,4 @@
+import numpy as np
 from abc import ABC, abstractmethod
 
 HISTORICAL_DATA_FEED    = "historical"
@@ -16,3 +17,27 @@ class DataFeed(ABC):
             time: datetime. Timestamp from which to start sampling.
         """
         raise NotImplementedError
+
+    def seek(self, time):
+        """ Set the datafeed to the first snapshot after 'time' """
+        self.reset(time=time)
+
+    def row_after(self, time):
+        """ Index of the first snapshot after 'time', used as a cursor with snapshot_at() """
+        raise NotImplementedError
+
+    def rows_after(self, times):
+        """ row_after() of each of the epoch ms 'times', as an int64 array """
+        return np.array([self.row_after(int(t)) for t in times], dtype=np.int64)
+
+    def snapshot_at(self, row_idx, lob_format=True):
+        """ Return the snapshot at the cursor 'row_idx' without changing the state of the datafeed """
+        raise NotImplementedError
+
+    def data_version(self, start_time, end_time):
+        """ Fingerprint of the data between 'start_time' and 'end_time', used to key cached simulation results """
+        raise NotImplementedError
+
+    def volume_profile(self, bin_secs=60):
+        """ Share of the traded volume in each 'bin_secs' time-of-day bin, used by VWAPAlgo """
+        raise NotImplementedError
@@ -1,28 +1,61 @@
 import warnings
-import copy
-import calendar
+import operator
+import hashlib
 import numpy as np
 from os import listdir, path
 import re
 from datetime import datetime, timedelta
 from src.data.data_feed import DataFeed
-from src.core.environment.env_utils import raw_to_order_book
+from functools import partial
+from src.core.environment.env_utils import to_epoch_ms, raw_to_order_book
+from src.core.environment.lob_snapshot import LobSnapshot
 
+SECS_PER_DAY = 24 * 60 * 60
 
-def get_time_idx_from_raw_data(data, t):
-    """ Returns the index of data right before a given time 't' """
 
-    try:
-        start_t = datetime.strptime(t, '%Y-%m-%d %H:%M:%S.%f')
-    except:
-        start_t = datetime.strptime(t, '%Y-%m-%d %H:%M:%S')
-    start_dt = datetime(start_t.year, start_t.month, start_t.day, start_t.hour, start_t.minute, start_t.second, start_t.microsecond)
-    unix_t = calendar.timegm(start_dt.utctimetuple()) * 1e3 + start_dt.microsecond / 1e3
-    idx = (np.abs(data - unix_t)).argmin()
-    # These two lines were giving the lob_snapshot previous to dt, when it should be the one after If we are placing trades (to account for computing time/latency etc)
-    while data[idx] <= unix_t:
-        idx = idx + 1
-    return idx
+class MemmapDays:
+    """ Read-only row-wise concatenation of per-day np.memmap arrays.
+
+        Rows are addressed with a global index as if all days were a single array. Row and slice access within a
+        day returns views of that day's memmap, only slices crossing a day boundary copy the requested rows.
+    """
+
+    def __init__(self, days):
+        self.days = days
+        self.row_offsets = np.cumsum([0] + [day.shape[0] for day in days])
+        self.shape = (int(self.row_offsets[-1]), days[0].shape[1])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key[0], key[1:]
+        else:
+            rows, cols = key, ()
+
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(self.shape[0])
+            if step != 1:
+                raise IndexError("Only contiguous row slices are supported")
+            pieces = []
+            for day, lo, hi in zip(self.days, self.row_offsets[:-1], self.row_offsets[1:]):
+                a, b = max(start, lo), min(stop, hi)
+                if a < b:
+                    pieces.append(day[(slice(a - lo, b - lo),) + cols])
+            if len(pieces) == 1:
+                return pieces[0]
+            if len(pieces) == 0:
+                return self.days[0][(slice(0, 0),) + cols]
+            return np.concatenate(pieces, axis=0)
+
+        row = operator.index(rows)
+        if row < 0:
+            row += self.shape[0]
+        if not 0 <= row < self.shape[0]:
+            raise IndexError("Row index {} out of range".format(rows))
+        day_idx = np.searchsorted(self.row_offsets, row, side='right') - 1
+        return self.days[day_idx][(row - self.row_offsets[day_idx],) + cols]
 
 
 class HistoricalDataFeed(DataFeed):
@@ -33,6 +66,16 @@ class HistoricalDataFeed(DataFeed):
             **float64 is used to accommodate the millisecond timestamp
 
         After reading file from disk, do: .reshape(-1, 81)
+
+        With mmap=True every day file is kept as a read-only np.memmap instead of being read into memory, so the OS
+        page cache is shared between all processes (e.g. Ray rollout workers) reading the same files.
+
+        If 'tick_size' and 'lot_size' of the instrument are given, orders are matched against the snapshots in int
+        ticks and lots (see TickOrderBook) rather than in Decimal.
+
+        With persistent_book=True the feed keeps one OrderBook which is moved from snapshot to snapshot by applying
+        only the levels that changed (see OrderBook.update_levels), snapshots match against a copy-on-write snapshot
+        of it.
     """
 
     def __init__(self,
@@ -41,10 +84,15 @@ class HistoricalDataFeed(DataFeed):
                  start_day=None,
                  end_day=None,
                  time=None,
-                 lob_depth=20):
+                 lob_depth=20,
+                 mmap=False,
+                 tick_size=None,
+                 lot_size=None,
+                 persistent_book=False):
 
         self.data_dir = data_dir
         self.instrument = instrument
+        self.mmap = mmap
 
         self.start_day = start_day
         self.end_day = end_day
@@ -52,7 +100,7 @@ class HistoricalDataFeed(DataFeed):
         if start_day is None and end_day is None:
 
             # load all files available
-            self.binary_files = listdir("{}".format(data_dir))
+            self.binary_files = self._day_files(data_dir)
             self.dates_list = self.get_all_dates_from_files(self.data_dir)
         elif None not in (start_day, end_day):
 
@@ -69,12 +117,23 @@ class HistoricalDataFeed(DataFeed):
             raise ValueError("'start_day' and 'end_day' have to be defined jointly!")
 
         self.data = None
+        self._day_row_offsets = None
+        self._day_first_ts = None
+        self._day_ts_index = {}
+        self._loaded_files = None
+        self._volume_profiles = {}
+        self._file_hashes = {}
 
         self.binary_file_idx = 0
         self.data_row_idx = None
         self._remaining_rows_in_file = None
 
         self.lob_depth = lob_depth
+        self.tick_size = tick_size
+        self.lot_size = lot_size
+        self.persistent_book = persistent_book
+        self._book = None
+        self._book_row_idx = None
         self._load_data()
         self.reset(time)
 
@@ -91,20 +150,23 @@ class HistoricalDataFeed(DataFeed):
             warnings.warn("Datafeed reached end of file, reset to initial time. Make sure this was intended! ")
             self.reset(self.time)
 
-        lob = copy.deepcopy(self.data[self.data_row_idx])
+        row_idx = self.data_row_idx
 
         self.data_row_idx += 1
         self._remaining_rows_in_file -= 1
 
-        timestamp_dt = datetime.utcfromtimestamp(lob[0] / 1000)
-        lob = lob[1:]
+        return self.snapshot_at(row_idx, lob_format)
+
+    def snapshot_at(self, row_idx, lob_format=True):
+        """ return the snapshot of the limit order book at row 'row_idx', independent of the current row """
+
+        row = self.data[row_idx]
+        timestamp_dt = datetime.utcfromtimestamp(row[0] / 1000)
+        levels = self._read_only_levels(row)
         if lob_format:
-            lob_out = raw_to_order_book(current_book=lob.reshape(-1, self.lob_depth),
-                                        time=timestamp_dt.strftime('%Y-%m-%d %H:%M:%S.%f'),
-                                        depth=self.lob_depth)
-            return timestamp_dt, lob_out
+            return timestamp_dt, self._snapshot(levels, timestamp_dt, row_idx)
         else:
-            return timestamp_dt, lob.reshape(-1, self.lob_depth)
+            return timestamp_dt, levels
 
     def past_lob_snapshots(self, no_of_past_lobs, lob_format=True):
         """ return past snapshots of the limit order book """
@@ -115,17 +177,58 @@ class HistoricalDataFeed(DataFeed):
             timestamp_dts.append(datetime.utcfromtimestamp(lob[0] / 1000))
 
         output = []
-        if lob_format:
-            for lob in past_lobs:
-                lob_out = raw_to_order_book(current_book=lob[1:].reshape(-1, self.lob_depth),
-                                            time=datetime.utcfromtimestamp(lob[0] / 1000).strftime('%Y-%m-%d %H:%M:%S.%f'),
-                                            depth=self.lob_depth)
-                output.append(lob_out)
-            return timestamp_dts, output
-        else:
-            for lob in past_lobs:
-                output.append(lob.reshape(-1, self.lob_depth))
-            return timestamp_dts, output
+        first_row_idx = self.data_row_idx - len(past_lobs)
+        for row_idx, (timestamp_dt, lob) in enumerate(zip(timestamp_dts, past_lobs), start=first_row_idx):
+            levels = self._read_only_levels(lob)
+            if lob_format:
+                output.append(self._snapshot(levels, timestamp_dt, row_idx))
+            else:
+                output.append(levels)
+        return timestamp_dts, output
+
+    def lob_window(self, start_row_idx, end_row_idx):
+        """ Returns the datetime64[ms] timestamps and a read-only (n, 4, lob_depth) view on the LOB levels of the
+            rows [start_row_idx, end_row_idx). The view is zero-copy unless the window crosses a day boundary of
+            memory-mapped data. """
+
+        rows = self.data[max(start_row_idx, 0):end_row_idx]
+        timestamps = rows[:, 0].astype(np.int64).astype('datetime64[ms]')
+        levels = rows[:, 1:].reshape(-1, 4, self.lob_depth).view()
+        levels.flags.writeable = False
+        return timestamps, levels
+
+    def past_lob_window(self, no_of_past_lobs):
+        """ Window of the last 'no_of_past_lobs' snapshots before the current row, see lob_window() """
+
+        return self.lob_window(self.data_row_idx - no_of_past_lobs, self.data_row_idx)
+
+    def _snapshot(self, levels, timestamp_dt, row_idx):
+        book_source = partial(self.book_at, row_idx) if self.persistent_book else None
+        return LobSnapshot(levels, timestamp_dt, depth=self.lob_depth, tick_size=self.tick_size,
+                           lot_size=self.lot_size, book_source=book_source)
+
+    def book_at(self, row_idx):
+        """ Returns a copy-on-write snapshot of the persistent OrderBook after moving it to the row 'row_idx' """
+
+        levels = self._read_only_levels(self.data[row_idx])
+        if self._book is None:
+            self._book = raw_to_order_book(current_book=levels,
+                                           time=datetime.utcfromtimestamp(self.data[row_idx, 0] / 1000).strftime(
+                                               '%Y-%m-%d %H:%M:%S.%f'),
+                                           depth=self.lob_depth,
+                                           tick_size=self.tick_size,
+                                           lot_size=self.lot_size)
+        elif row_idx != self._book_row_idx:
+            self._book.update_levels(self._read_only_levels(self.data[self._book_row_idx]), levels)
+        self._book_row_idx = row_idx
+        return self._book.snapshot()
+
+    def _read_only_levels(self, row):
+        """ (4, lob_depth) read-only view on the LOB levels of a raw data row """
+
+        levels = row[1:].reshape(-1, self.lob_depth).view()
+        levels.flags.writeable = False
+        return levels
 
     def reset(self, time=None):
         """ Reset the datafeed and set from when to start sampling """
@@ -133,31 +236,146 @@ class HistoricalDataFeed(DataFeed):
         self.time = time
         self._select_row_idx()
 
+    def row_after(self, time):
+        """ Returns the global row index of the first snapshot after 'time' (epoch ms, datetime or string) """
+
+        # the snapshot after 'time' is returned rather than the one before, to account for computing time/latency
+        # when placing trades. Timestamps are whole milliseconds, so comparing against the floored ms is exact
+        ms = to_epoch_ms(time)
+        # find the day via the first timestamp of each day, then search only within that day
+        day_idx = max(int(np.searchsorted(self._day_first_ts, ms, side='right')) - 1, 0)
+        day_row_idx = np.searchsorted(self._day_timestamps(day_idx), ms, side='right')
+        return int(self._day_row_offsets[day_idx] + day_row_idx)
+
+    def rows_after(self, times):
+        """ Vectorised row_after() for an array of epoch ms 'times' """
+
+        ms = np.asarray(times, dtype=np.int64)
+        day_idxs = np.maximum(np.searchsorted(self._day_first_ts, ms, side='right') - 1, 0)
+        rows = np.empty(len(ms), dtype=np.int64)
+        for day_idx in np.unique(day_idxs):
+            in_day = day_idxs == day_idx
+            rows[in_day] = self._day_row_offsets[day_idx] + np.searchsorted(self._day_timestamps(day_idx),
+                                                                            ms[in_day], side='right')
+        return rows
+
+    def data_version(self, start_time, end_time):
+        """ Fingerprint of the content of every day file spanned by 'start_time' to 'end_time' """
+
+        first_day, last_day = np.maximum(np.searchsorted(self._day_first_ts,
+                                                         [to_epoch_ms(start_time), to_epoch_ms(end_time)],
+                                                         side='right') - 1, 0)
+        day_hashes = [self._file_hash(f) for f in self._loaded_files[first_day:last_day + 1]]
+        return hashlib.sha1(repr(day_hashes).encode()).hexdigest()
+
+    def _file_hash(self, filename):
+        """ sha1 of the content of a day file, computed once per loaded file """
+
+        if filename not in self._file_hashes:
+            self._file_hashes[filename] = hashlib.sha1(self._read_day_file(filename)).hexdigest()
+        return self._file_hashes[filename]
+
+    def volume_profile(self, bin_secs=60):
+        """ Intraday volume profile of the loaded days: the share of the activity in each 'bin_secs' time-of-day bin,
+            as a float64 array of 86400 / bin_secs bins which sums to 1.
+
+            The activity of a snapshot is the absolute change of the quantities on all levels since the previous
+            snapshot, a proxy for the traded volume which can be read from the LOB data alone. The profile is
+            computed once per loaded period and saved to '<data_dir>/<instrument>__profile_<bin_secs>s__<key>.npy',
+            the key changes whenever the content of one of the day files changes.
+        """
+
+        if SECS_PER_DAY % bin_secs:
+            raise ValueError("'bin_secs' has to divide a day, got {}".format(bin_secs))
+        if bin_secs in self._volume_profiles:
+            return self._volume_profiles[bin_secs]
+
+        key = hashlib.sha1(repr((self.lob_depth, [self._file_hash(f) for f in self._loaded_files]))
+                           .encode()).hexdigest()[:16]
+        profile_file = "{}/{}__profile_{}s__{}.npy".format(self.data_dir, self.instrument, bin_secs, key)
+        if path.isfile(profile_file):
+            profile = np.load(profile_file)
+        else:
+            profile = self._compute_volume_profile(bin_secs)
+            try:
+                np.save(profile_file, profile)
+            except OSError:
+                warnings.warn("Could not cache the volume profile in {}".format(self.data_dir))
+        self._volume_profiles[bin_secs] = profile
+        return profile
+
+    def _compute_volume_profile(self, bin_secs):
+        n_bins = SECS_PER_DAY // bin_secs
+        activity_per_bin = np.zeros(n_bins)
+        for filename in self._loaded_files:
+            day = self._read_day_file(filename)
+            if day.shape[0] < 2:
+                continue
+            quantities = day[:, 1:].reshape(-1, 4, self.lob_depth)[:, 1::2]
+            activity = np.abs(np.diff(quantities, axis=0)).sum(axis=(1, 2))
+            bins = (day[1:, 0].astype(np.int64) % (SECS_PER_DAY * 1000)) // (bin_secs * 1000)
+            activity_per_bin += np.bincount(bins, weights=activity, minlength=n_bins)
+
+        total = activity_per_bin.sum()
+        if total <= 0:
+            # no activity at all, e.g. a constant book
+            return np.full(n_bins, 1 / n_bins)
+        return activity_per_bin / total
+
+    def _day_timestamps(self, day_idx):
+        """ Lazily built int64 ms timestamp index of a single day """
+
+        if day_idx not in self._day_ts_index:
+            lo, hi = self._day_row_offsets[day_idx], self._day_row_offsets[day_idx + 1]
+            self._day_ts_index[day_idx] = self.data[lo:hi, 0].astype(np.int64)
+        return self._day_ts_index[day_idx]
+
+    def _build_time_index(self, day_rows):
+        """ Sets up the per-day row offsets and first timestamps used by row_after() """
+
+        self._day_row_offsets = np.cumsum([0] + list(day_rows))
+        self._day_first_ts = np.array([self.data[offset, 0] for offset in self._day_row_offsets[:-1]],
+                                      dtype=np.int64)
+        self._day_ts_index = {}
+
     def _load_data(self):
         """ Load data from all binary files """
-        data = np.fromfile("{}/{}".format(self.data_dir, self.binary_files[0]), dtype=np.float64)
 
-        for file in self.binary_files[1:]:
-            file_data = np.fromfile("{}/{}".format(self.data_dir, file), dtype=np.float64)
-            data = np.concatenate((data,file_data),axis = 0)
+        days = [self._read_day_file(file) for file in self.binary_files]
+        self._loaded_files = list(self.binary_files)
+        if self.mmap:
+            self.data = days[0] if len(days) == 1 else MemmapDays(days)
+        else:
+            self.data = np.concatenate(days, axis=0)
+        self._build_time_index([day.shape[0] for day in days])
 
-        self.data = data.reshape(-1, 4 * self.lob_depth + 1)
+    def _read_day_file(self, filename):
+        """ Reads a single binary file, either memory-mapped or fully into memory """
 
+        file_path = "{}/{}".format(self.data_dir, filename)
+        if self.mmap:
+            file_data = np.memmap(file_path, dtype=np.float64, mode='r')
+        else:
+            file_data = np.fromfile(file_path, dtype=np.float64)
+        return file_data.reshape(-1, 4 * self.lob_depth + 1)
 
     def load_specific_day_data(self, instrument, date):
 
         filename = "{}__{}.{}".format(instrument, date, "dat")
 
-        file_data = np.fromfile("{}/{}".format(self.data_dir, filename), dtype=np.float64)
-
-        self.data = file_data.reshape(-1, 4 * self.lob_depth + 1)
+        self.data = self._read_day_file(filename)
+        self._loaded_files = [filename]
+        self._volume_profiles = {}
+        self._file_hashes = {}
+        self._build_time_index([self.data.shape[0]])
+        self._book = None # the persistent book refers to rows of the previous data
 
     def _select_row_idx(self):
         """ method specifically selecting 'data_row_idx' and '_remaining_rows_in_file' """
 
         if self.time is not None:
             # always start sampling from 'time'
-            idx = get_time_idx_from_raw_data(self.data[:, 0], self.time)
+            idx = self.row_after(self.time)
         else:
             # otherwise just start from the beginning
             idx = 0
@@ -198,6 +416,11 @@ class HistoricalDataFeed(DataFeed):
         else:
             raise TypeError('Comparing object is not of the same type.')
 
+    @staticmethod
+    def _day_files(data_dir):
+        """ The binary day files in 'data_dir', which also holds the cached volume profiles """
+        return [f for f in listdir(data_dir) if f.endswith('.dat')]
+
     def get_dates_from_files(self,binary_files):
         dates_list = []
         for filename in binary_files:
@@ -207,7 +430,7 @@ class HistoricalDataFeed(DataFeed):
 
     def get_all_dates_from_files(self, data_dir: str,):
         dates_list = []
-        for filename in listdir(data_dir):
+        for filename in self._day_files(data_dir):
             date = re.findall("\d+\w\d+\w\d+", filename)
             dates_list.append(date[0].replace('_','-'))
         return dates_list
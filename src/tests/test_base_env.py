@@ -5,10 +5,12 @@ import gym
 import datetime
 
 from decimal import Decimal
+from fractions import Fraction
 import numpy as np
 
 from src.core.environment.limit_orders_setup.base_env import BaseEnv, ExampleEnvRewardAtStep, TWAPAlgo
 from src.core.environment.limit_orders_setup.broker import Broker
+from src.core.environment.limit_orders_setup.execution_algo import scale_lots
 from src.data.historical_data_feed import HistoricalDataFeed
 
 
@@ -25,13 +27,12 @@ class DerivedEnv(ExampleEnvRewardAtStep):
         return action_out
 
     def infer_volume_from_action(self, action):
-        vol_to_trade = Decimal(str(0.8 + 0.2*action)) *\
-                       (self.broker.benchmark_algo.volumes_per_trade_default[self.broker.rl_algo.bucket_idx][self.broker.rl_algo.order_idx]) # We trade {0,0.1,0.2,...2}*TWAP's volume
-        factor = 10 ** (- self.broker.benchmark_algo.tick_size.as_tuple().exponent)
-        vol_to_trade = Decimal(str(math.floor(vol_to_trade * factor) / factor))
-        if vol_to_trade > self.broker.rl_algo.bucket_vol_remaining[self.broker.rl_algo.bucket_idx]:
-            vol_to_trade = self.broker.rl_algo.bucket_vol_remaining[self.broker.rl_algo.bucket_idx]
-        return vol_to_trade
+        rl_algo = self.broker.rl_algo
+        vol_to_trade = scale_lots(self.broker.benchmark_algo.volumes_per_trade_default_lots[rl_algo.bucket_idx,
+                                                                                           rl_algo.order_idx],
+                                  Fraction(80 + 20 * int(action), 100)) # We trade {0.8,1,1.2,...}*TWAP's volume
+        vol_to_trade = vol_to_trade // rl_algo.tick_lots * rl_algo.tick_lots
+        return min(vol_to_trade, int(rl_algo.bucket_vol_remaining_lots[rl_algo.bucket_idx]))
 
 
 class TestBaseEnvLogic(unittest.TestCase):
@@ -41,7 +42,7 @@ class TestBaseEnvLogic(unittest.TestCase):
                                   instrument='btcusdt', start_day=start_day, end_day=end_day)
 
     # define the broker class
-    broker = Broker(lob_feed)
+    broker = Broker(lob_feed, record_policy='full')
 
     # define the config
     env_config = {'obs_config': {"lob_depth": 5,
@@ -154,7 +155,7 @@ class TestRewardCalcsInEnv(unittest.TestCase):
                                   instrument='btcusdt', start_day=start_day, end_day=end_day)
 
     # define the broker class
-    broker = Broker(lob_feed)
+    broker = Broker(lob_feed, record_policy='full')
 
     # define the config
     env_config = {'obs_config': {"lob_depth": 5,
@@ -225,7 +226,7 @@ class TestRewardCalcsInEnv(unittest.TestCase):
         end_day = datetime.datetime(year=2021,month=6, day=2)
         lob_feed = HistoricalDataFeed(data_dir=os.path.join(ROOT_DIR, 'data/market/btcusdt/'),
                                       instrument='btcusdt', start_day=start_day, end_day=end_day)
-        broker = Broker(lob_feed)
+        broker = Broker(lob_feed, record_policy='full')
         env = RewardAtEpisodeEnv(broker=broker,
                                  config=self.env_config,
                                  action_space=self.action_space)
@@ -261,7 +262,7 @@ class TestSimilarityEnvVsSim(unittest.TestCase):
                                   instrument='btcusdt', start_day=start_day, end_day=end_day)
 
     # define the broker class
-    broker = Broker(lob_feed)
+    broker = Broker(lob_feed, record_policy='full')
 
     # define the config
     env_config = {'obs_config': {"lob_depth": 5,
@@ -305,7 +306,7 @@ class TestSimilarityEnvVsSim(unittest.TestCase):
     def test_similarity(self):
 
         # define the broker class
-        broker = Broker(self.lob_feed)
+        broker = Broker(self.lob_feed, record_policy='full')
         broker.delete_vol = self.env_config["exec_config"]["delete_vol"]
         broker.benchmark_algo = self.algo
         broker.simulate_algo(self.algo)
@@ -359,7 +360,7 @@ class TestTwoSlices(unittest.TestCase):
                                   instrument='btcusdt')
 
     # define the broker class
-    broker = Broker(lob_feed)
+    broker = Broker(lob_feed, record_policy='full')
 
     # define the config
     env_config = {'obs_config': {"lob_depth": 5,
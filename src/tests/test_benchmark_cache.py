@@ -0,0 +1,132 @@
+import unittest
+import os
+import random
+import tempfile
+from datetime import datetime
+import gym
+
+from src.core.environment.limit_orders_setup.benchmark_cache import BenchmarkCache
+from src.core.environment.limit_orders_setup.broker import Broker
+from src.core.environment.limit_orders_setup.execution_algo import TWAPAlgo
+from src.core.environment.limit_orders_setup.base_env import RewardAtStepEnv
+from src.data.historical_data_feed import HistoricalDataFeed
+from src.tests.test_historical_data_feed import write_fake_day_file, LOB_DEPTH
+
+
+class TestBenchmarkCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        write_fake_day_file(cls.tmp_dir.name, 1)
+        cls.lob_feed = HistoricalDataFeed(data_dir=cls.tmp_dir.name,
+                                          instrument='btcusdt',
+                                          start_day=datetime(2021, 6, 1),
+                                          end_day=datetime(2021, 6, 1),
+                                          lob_depth=LOB_DEPTH)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def _config(self, **exec_config):
+        return {'obs_config': {'lob_depth': LOB_DEPTH, 'nr_of_lobs': 2, 'norm': True},
+                'trade_config': {'trade_direction': 1,
+                                 'vol_low': 4,
+                                 'vol_high': 4,
+                                 'no_slices_low': 2,
+                                 'no_slices_high': 2,
+                                 'bucket_func': lambda no_of_slices: [0.3, 0.6],
+                                 'rand_bucket_low': 0,
+                                 'rand_bucket_high': 0},
+                'start_config': {'hour_low': 9, 'hour_high': 9, 'minute_low': 0, 'minute_high': 0,
+                                 'second_low': 10, 'second_high': 10},
+                'exec_config': {'exec_times': [1], 'delete_vol': False, **exec_config},
+                'reset_config': {'reset_num_episodes': 1},
+                'seed_config': {'seed': 0}}
+
+    def _run_episode(self, env):
+        random.seed(0) # same sampled execution times in every episode
+        env.reset()
+        rewards, done = [], False
+        while not done:
+            _, reward, done, _ = env.step(action=[1])
+            rewards.append(reward)
+        return rewards, env.broker.benchmark_algo.bmk_vwap, env.broker.rl_algo.rl_vwap
+
+    def test_lru(self):
+        cache = BenchmarkCache(maxsize=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, {'key': key})
+        self.assertEqual(len(cache), 2, 'Cache should be bounded')
+        self.assertIsNone(cache.get('a'), 'Least recently used entry should be evicted')
+        self.assertEqual(cache.get('b'), {'key': 'b'}, 'Entry differs')
+        cache.put('d', {'key': 'd'})
+        self.assertIn('b', cache, 'Recently used entry should be kept')
+        self.assertNotIn('c', cache, 'Least recently used entry should be evicted')
+
+    def test_disk_store(self):
+        cache_dir = os.path.join(self.tmp_dir.name, 'benchmark_cache')
+        BenchmarkCache(cache_dir=cache_dir).put('a', {'key': 'a'})
+        cache = BenchmarkCache(cache_dir=cache_dir)
+        self.assertEqual(cache.get('a'), {'key': 'a'}, 'Entry should be loaded from disk')
+        self.assertEqual(cache.hits, 1, 'Loading from disk should count as a hit')
+
+    def test_key(self):
+        algos = [TWAPAlgo(trade_direction=1,
+                          volume=volume,
+                          start_time='2021-06-01 09:00:10',
+                          end_time='2021-06-01 09:01:10',
+                          no_of_slices=2,
+                          bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                          broker_data_feed=self.lob_feed) for volume in (4, 4, 5)]
+        algos[1].algo_events = algos[0].algo_events
+        keys = [BenchmarkCache.key(self.lob_feed, algo) for algo in algos]
+        self.assertEqual(keys[0], keys[1], 'Same execution should have the same key')
+        self.assertNotEqual(keys[0], keys[2], 'Key should depend on the volume')
+        self.assertNotEqual(keys[0], BenchmarkCache.key(self.lob_feed, algos[0], delete_vol=True),
+                            'Key should depend on the broker settings')
+
+    def test_key_data_version(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            rows = [write_fake_day_file(data_dir, day) for day in (1, 2)]
+            feed_kwargs = dict(data_dir=data_dir, instrument='btcusdt', start_day=datetime(2021, 6, 1),
+                               end_day=datetime(2021, 6, 2), lob_depth=LOB_DEPTH)
+            lob_feed = HistoricalDataFeed(**feed_kwargs)
+            algos = [TWAPAlgo(trade_direction=1,
+                              volume=4,
+                              start_time='2021-06-01 09:00:10',
+                              end_time=end_time,
+                              no_of_slices=2,
+                              bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                              broker_data_feed=lob_feed) for end_time in ('2021-06-01 09:01:10',
+                                                                          '2021-06-02 09:01:10')]
+            keys = [BenchmarkCache.key(lob_feed, algo) for algo in algos]
+
+            # rewrite the second day with other quantities but the same size and modification time
+            day_file = os.path.join(data_dir, "btcusdt__2021_06_02.dat")
+            file_stat = os.stat(day_file)
+            rows[1][:, 1 + LOB_DEPTH] += 1
+            rows[1].tofile(day_file)
+            os.utime(day_file, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+
+            lob_feed = HistoricalDataFeed(**feed_kwargs)
+            self.assertEqual(BenchmarkCache.key(lob_feed, algos[0]), keys[0],
+                             'Key should not depend on days outside of the execution')
+            self.assertNotEqual(BenchmarkCache.key(lob_feed, algos[1]), keys[1],
+                                'Key should depend on the content of every day of the execution')
+
+    def test_env_with_cache(self):
+        env = RewardAtStepEnv(broker=Broker(self.lob_feed), config=self._config(), action_space=gym.spaces.Discrete(3))
+        expected = self._run_episode(env)
+
+        env = RewardAtStepEnv(broker=Broker(self.lob_feed), config=self._config(benchmark_cache_size=4),
+                              action_space=gym.spaces.Discrete(3))
+        self.assertEqual(self._run_episode(env), expected, 'Precomputed benchmark changes the episode')
+        self.assertEqual(self._run_episode(env), expected, 'Cached benchmark changes the episode')
+        self.assertEqual((env.benchmark_cache.misses, env.benchmark_cache.hits), (1, 1),
+                         'Second episode should use the cached benchmark')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,419 @@
+import unittest
+import os
+import random
+import tempfile
+from datetime import datetime
+import numpy as np
+
+from decimal import Decimal
+from src.core.environment.limit_orders_setup.broker import Broker, TradeLog
+from src.core.environment.limit_orders_setup.execution_algo import TWAPAlgo, VWAPAlgo, POVAlgo, EVENT_TYPES, \
+    ORDER_PLACEMENT, split_across_buckets, scale_lots, to_lots, from_lots
+from src.data.historical_data_feed import HistoricalDataFeed
+from src.tests.test_historical_data_feed import write_fake_day_file, LOB_DEPTH
+
+
+class TestBrokerRecordPolicy(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        write_fake_day_file(cls.tmp_dir.name, 1)
+        cls.lob_feed = HistoricalDataFeed(data_dir=cls.tmp_dir.name,
+                                          instrument='btcusdt',
+                                          start_day=datetime(2021, 6, 1),
+                                          end_day=datetime(2021, 6, 1),
+                                          lob_depth=LOB_DEPTH)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def _simulate(self, **broker_kwargs):
+        algo = TWAPAlgo(trade_direction=1,
+                        volume=4,
+                        start_time='2021-06-01 09:00:10',
+                        end_time='2021-06-01 09:01:10',
+                        no_of_slices=2,
+                        bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                        broker_data_feed=self.lob_feed)
+        broker = Broker(self.lob_feed, **broker_kwargs)
+        broker.simulate_algo(algo)
+        return broker
+
+    def test_bounded_history(self):
+        full = self._simulate(record_policy='full')
+        n_recorded = len(full.hist_dict['benchmark']['lob'])
+        self.assertGreater(n_recorded, 2, 'Simulation should record several snapshots')
+
+        last = self._simulate()
+        self.assertEqual(len(last.hist_dict['benchmark']['lob']), 1, 'Only the last snapshot should be kept')
+        self.assertEqual(last.hist_dict['benchmark']['timestamp'][-1], full.hist_dict['benchmark']['timestamp'][-1],
+                         'Last recorded snapshot differs')
+        self.assertEqual(last.trade_logs, full.trade_logs, 'Record policy should not change the trades')
+
+        ring = self._simulate(record_policy='ring', record_len=2)
+        self.assertEqual(list(ring.hist_dict['benchmark']['timestamp']),
+                         list(full.hist_dict['benchmark']['timestamp'])[-2:], 'Ring buffer keeps wrong snapshots')
+
+    def test_disk_history(self):
+        full = self._simulate(record_policy='full')
+        disk = self._simulate(record_policy='disk', record_path=os.path.join(self.tmp_dir.name, 'records'))
+        rows = np.fromfile(os.path.join(self.tmp_dir.name, 'records', 'benchmark.dat')).reshape(-1, 4 * LOB_DEPTH + 1)
+        self.assertEqual(len(rows), len(full.hist_dict['benchmark']['lob']), 'Not every snapshot was written')
+        self.assertEqual([datetime.utcfromtimestamp(ts / 1000) for ts in rows[:, 0]],
+                         list(full.hist_dict['benchmark']['timestamp']), 'Written timestamps differ')
+        np.testing.assert_array_equal(rows[-1, 1:].reshape(-1, LOB_DEPTH), disk.hist_dict['benchmark']['lob'][-1].levels)
+
+    def test_disk_history_swept(self):
+        broker = Broker(self.lob_feed, record_policy='disk', record_path=os.path.join(self.tmp_dir.name, 'swept'))
+        broker._reset_history('benchmark')
+        row = self.lob_feed.row_after(datetime(2021, 6, 1, 9, 0, 10))
+        dt, lob = self.lob_feed.snapshot_at(row)
+        # levels have 1, 2 and 3 units, so 2.5 units empty the first ask level and take half of the second
+        lob.sweep('bid', Decimal('2.5'))
+        broker._record_lob(dt, lob, 'benchmark')
+        broker.close()
+
+        rows = np.fromfile(os.path.join(self.tmp_dir.name, 'swept', 'benchmark.dat')).reshape(-1, 4 * LOB_DEPTH + 1)
+        levels = rows[0, 1:].reshape(-1, LOB_DEPTH)
+        self.assertEqual(levels[1, :3].tolist(), [0, 0.5, 3], 'Swept ask volumes were not written')
+        _, raw_levels = self.lob_feed.snapshot_at(row, lob_format=False)
+        np.testing.assert_array_equal(levels[[0, 2, 3]], np.asarray(raw_levels)[[0, 2, 3]],
+                                      'Prices and the bid side should be written unchanged')
+        self.assertEqual(raw_levels[1, 0], 1, 'Sweeping should not change the data')
+        self.assertEqual(str(lob), str(lob.book), 'Printed snapshot should show the swept book')
+
+    def test_cursor_does_not_move_feed(self):
+        self.lob_feed.seek(datetime(2021, 6, 1, 9, 1, 30))
+        broker = self._simulate()
+        self.assertGreater(broker.cursors['benchmark_algo'], self.lob_feed.row_after(datetime(2021, 6, 1, 9, 0, 10)),
+                           'Cursor of the algo should have moved')
+        dt, _ = self.lob_feed.next_lob_snapshot()
+        self.assertEqual(dt, datetime(2021, 6, 1, 9, 1, 31), 'Simulating an algo should not move the feed')
+
+    def test_vectorised_fill_search(self):
+        class RowByRowBroker(Broker):
+            def _skip_unmarketable_rows(self, run, row, end_row):
+                return row
+
+        for trade_direction in (1, -1):
+            brokers = []
+            for broker_cls in (Broker, RowByRowBroker):
+                random.seed(0) # same sampled execution times for both brokers
+                algo = TWAPAlgo(trade_direction=trade_direction,
+                                volume=4,
+                                start_time='2021-06-01 09:00:05',
+                                end_time='2021-06-01 09:01:55',
+                                no_of_slices=1,
+                                bucket_placement_func=lambda no_of_slices: [0.5],
+                                broker_data_feed=self.lob_feed)
+                broker = broker_cls(self.lob_feed, record_policy='full')
+                broker.simulate_algo(algo)
+                brokers.append(broker)
+            fast, slow = brokers
+            self.assertEqual(fast.trade_logs, slow.trade_logs, 'Vectorised search changes the trades')
+            if trade_direction == -1:
+                # the rising prices fill the resting ask orders
+                self.assertIn(('trade', 'limit'), [(log['message'], log['type']) for log in fast.trade_logs['benchmark_algo']])
+            self.assertEqual(list(fast.hist_dict['benchmark']['timestamp']),
+                             list(slow.hist_dict['benchmark']['timestamp']), 'Vectorised search records other LOBs')
+
+    def test_simulate_algo_matches_stepping(self):
+        brokers = []
+        for stepwise in (False, True):
+            random.seed(0) # same sampled execution times for both brokers
+            algo = TWAPAlgo(trade_direction=-1,
+                            volume=4,
+                            start_time='2021-06-01 09:00:05',
+                            end_time='2021-06-01 09:01:55',
+                            no_of_slices=2,
+                            bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                            broker_data_feed=self.lob_feed)
+            broker = Broker(self.lob_feed, record_policy='full')
+            if stepwise:
+                # as the env steps the algos
+                broker.reset(algo)
+                event, done, lob = broker.simulate_to_next_event(algo)
+                while True:
+                    broker.place_next_order(algo, event, done, lob)
+                    if done:
+                        break
+                    event, done, lob = broker.simulate_to_next_event(algo)
+            else:
+                broker.simulate_algo(algo)
+            brokers.append(broker)
+        simulated, stepped = brokers
+        self.assertEqual(simulated.trade_logs, stepped.trade_logs, 'Stepping the algo changes the trades')
+        self.assertEqual(list(simulated.hist_dict['benchmark']['timestamp']),
+                         list(stepped.hist_dict['benchmark']['timestamp']), 'Stepping the algo records other LOBs')
+        # every order placement is placed at the snapshot of its event, also the second one of a bucket
+        algo = simulated.benchmark_algo
+        order_rows = algo.event_plan['row'][[EVENT_TYPES[t] == 'order_placement' for t in algo.event_plan['type']]]
+        order_times = {datetime.strftime(self.lob_feed.snapshot_at(row)[0], '%Y-%m-%d %H:%M:%S.%f')
+                       for row in order_rows}
+        limit_times = {log['timestamp'] for log in simulated.trade_logs['benchmark_algo'] if log['type'] == 'limit'}
+        self.assertEqual(len(order_rows), 2 * algo.buckets.n_buckets, 'Two orders per bucket expected')
+        self.assertTrue(order_times <= limit_times, 'Not every order placement was placed')
+
+    def test_event_plan(self):
+        algo = self._simulate().benchmark_algo
+        for idx, event_time in enumerate(algo.algo_events):
+            plan = algo.event_plan[idx]
+            is_order = any(event_time in bucket_times for bucket_times in algo.execution_times)
+            self.assertEqual(EVENT_TYPES[plan['type']], 'order_placement' if is_order else 'bucket_bound',
+                             'Event type differs')
+            self.assertEqual(plan['row'], self.lob_feed.row_after(event_time), 'Data row of the event differs')
+            if is_order:
+                self.assertIn(event_time, algo.execution_times[plan['bucket_idx']], 'Bucket of the order differs')
+            else:
+                self.assertEqual(event_time, algo.buckets.bucket_bounds[plan['bucket_idx'] + 1],
+                                 'Bucket bound differs')
+        self.assertEqual(list(algo.event_plan['order_idx'][algo.event_plan['type'] == ORDER_PLACEMENT]),
+                         list(range(algo.no_of_slices)) * algo.buckets.n_buckets, 'Order indices differ')
+
+    def test_colliding_placements(self):
+        # identical placements are nudged apart to the next free ms, edge placements into the bucket
+        def twap(placements):
+            return TWAPAlgo(trade_direction=1,
+                            volume=4,
+                            start_time='2021-06-01 09:00:10',
+                            end_time='2021-06-01 09:01:10',
+                            no_of_slices=3,
+                            bucket_placement_func=lambda no_of_slices: placements,
+                            broker_data_feed=self.lob_feed)
+        algo = twap([0.5, 0.5, 0.5])
+        widths = np.diff(algo.buckets.bucket_bounds_ms)
+        offsets = algo.execution_times_ms - algo.buckets.bucket_bounds_ms[:-1, None]
+        np.testing.assert_array_equal(offsets, np.rint(widths[:, None] * 0.5) + [0, 1, 2])
+        np.testing.assert_array_equal(twap([0.5, 0.5, 0.5]).execution_times_ms, algo.execution_times_ms,
+                                      'Nudging should be deterministic')
+        for bucket_idx, bucket_times in enumerate(algo.execution_times):
+            self.assertEqual(len(set(bucket_times)), algo.no_of_slices, 'Order times should be distinct')
+            self.assertTrue(all(algo.buckets.bucket_bounds[bucket_idx] < t < algo.buckets.bucket_bounds[bucket_idx + 1]
+                                for t in bucket_times), 'Order times should be within their bucket')
+        self.assertEqual(len(algo.algo_events), algo.buckets.n_buckets * (algo.no_of_slices + 1),
+                         'Every order and bucket bound should be an event')
+
+        algo = twap([1.0, 0.0, 1.0])
+        offsets = algo.execution_times_ms - algo.buckets.bucket_bounds_ms[:-1, None]
+        np.testing.assert_array_equal(offsets, np.stack((widths - 2, np.ones_like(widths), widths - 1), axis=1))
+
+    def test_volumes_in_lots(self):
+        np.testing.assert_array_equal(split_across_buckets(np.array([1866667, 13333]), 3, 1),
+                                      [[622223, 622222, 622222], [4445, 4444, 4444]])
+        self.assertEqual([scale_lots(10, m) for m in (1.2, 0.8, Decimal('0.33'), 1)], [12, 8, 3, 10],
+                         'Scaling should be exact')
+        algo = self._simulate().benchmark_algo
+        tick_lots = to_lots(algo.tick_size)
+        self.assertEqual(algo.volumes_per_trade_default_lots.sum(), to_lots(algo.volume),
+                         'Order volumes should add up to the volume')
+        self.assertTrue(np.all(algo.bucket_volumes_lots % tick_lots == 0), 'Bucket volumes should be whole ticks')
+        self.assertEqual(algo.vol_remaining, from_lots(algo.vol_remaining_lots), 'Decimal view differs')
+        self.assertEqual(sum(algo.bucket_volumes), algo.volume, 'Decimal view differs')
+
+    def test_simulate_algos(self):
+        def twap(trade_direction, start_time, end_time):
+            return TWAPAlgo(trade_direction=trade_direction,
+                            volume=4,
+                            start_time=start_time,
+                            end_time=end_time,
+                            no_of_slices=1,
+                            bucket_placement_func=lambda no_of_slices: [0.5],
+                            broker_data_feed=self.lob_feed)
+        params = [(1, '2021-06-01 09:00:05', '2021-06-01 09:01:55'),
+                  (-1, '2021-06-01 09:00:05', '2021-06-01 09:01:55'),
+                  (-1, '2021-06-01 09:00:30', '2021-06-01 09:01:00')]
+
+        broker = Broker(self.lob_feed, record_policy='full')
+        names = [broker.register_algo(twap(*p)) for p in params]
+        vwaps = broker.simulate_algos()
+        for name, p in zip(names, params):
+            single = Broker(self.lob_feed, record_policy='full')
+            single.simulate_algo(twap(*p))
+            self.assertEqual(broker.trade_logs[name], single.trade_logs['benchmark_algo'],
+                             'Simulating the algos together changes the trades')
+            self.assertEqual(list(broker.hist_dict[name]['timestamp']),
+                             list(single.hist_dict['benchmark']['timestamp']), 'Recorded LOBs differ')
+            self.assertEqual(vwaps[name], single.trade_logs['benchmark_algo'].vwap(), 'VWAP differs')
+            self.assertEqual(broker.algos[name].vol_remaining_lots, 0, 'Whole volume should be executed')
+        with self.assertRaises(ValueError):
+            broker.register_algo(twap(*params[0]), name=names[0])
+
+    def test_vwap_algo(self):
+        profile = np.zeros(24 * 60)
+        profile[9 * 60:9 * 60 + 2] = [1, 3] # 3 times more volume from 09:01 onwards
+        algo = VWAPAlgo(trade_direction=1,
+                        volume=4,
+                        start_time='2021-06-01 09:00:10',
+                        end_time='2021-06-01 09:01:10',
+                        no_of_slices=2,
+                        bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                        broker_data_feed=self.lob_feed,
+                        volume_profile=profile)
+        bounds_s = (algo.buckets.bucket_bounds_ms - algo.buckets.bucket_bounds_ms[0]) / 1000 + 10
+        weights = np.diff(np.minimum(bounds_s, 60) + 3 * np.maximum(bounds_s - 60, 0))
+        expected_lots = to_lots(algo.volume) * weights / weights.sum()
+        tick_lots = to_lots(algo.tick_size)
+        self.assertEqual(algo.bucket_volumes_lots.sum(), to_lots(algo.volume), 'Bucket volumes should add up')
+        self.assertTrue(np.all(np.abs(algo.bucket_volumes_lots - expected_lots) < tick_lots),
+                        'Bucket volumes should follow the volume profile')
+
+        broker = Broker(self.lob_feed)
+        broker.simulate_algo(algo)
+        self.assertLess(algo.vol_remaining_lots, to_lots(algo.volume),
+                        'VWAPAlgo should be simulated like the TWAPAlgo')
+
+        # the fake data has no activity, so the profile of the feed is flat and the split follows the bucket widths
+        algo = VWAPAlgo(trade_direction=1,
+                        volume=4,
+                        start_time='2021-06-01 09:00:10',
+                        end_time='2021-06-01 09:01:10',
+                        no_of_slices=2,
+                        bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                        broker_data_feed=self.lob_feed)
+        widths = np.diff(algo.buckets.bucket_bounds_ms)
+        self.assertTrue(np.all(np.abs(algo.bucket_volumes_lots - to_lots(algo.volume) * widths / widths.sum())
+                               < tick_lots), 'Flat profile should split by bucket widths')
+
+    def test_pov_algo(self):
+        def pov(volume, participation_rate):
+            return POVAlgo(trade_direction=1,
+                           volume=volume,
+                           start_time='2021-06-01 09:00:10',
+                           end_time='2021-06-01 09:01:10',
+                           no_of_slices=2,
+                           bucket_placement_func=lambda no_of_slices: [0.3, 0.6],
+                           broker_data_feed=self.lob_feed,
+                           participation_rate=participation_rate)
+
+        # the fake book is depleted by 2 lots per snapshot, so the orders trade a quarter of them
+        algo = pov(volume=100, participation_rate=0.25)
+        order_events = algo.event_plan[algo.event_plan['type'] == ORDER_PLACEMENT]
+        activity = 2 * np.diff(order_events['row'], prepend=self.lob_feed.row_after(algo.start_time))
+        np.testing.assert_array_equal(algo.market_activity(), activity * to_lots(Decimal(1)))
+        order_volumes = algo.volumes_per_trade_default_lots[order_events['bucket_idx'], order_events['order_idx']]
+        expected_volumes = [to_lots(Decimal(str(a * 0.25)).quantize(algo.tick_size, 'ROUND_DOWN')) for a in activity]
+        np.testing.assert_array_equal(order_volumes[:-1], expected_volumes[:-1])
+        self.assertEqual(order_volumes.sum(), to_lots(algo.volume),
+                         'The last order should trade the volume the participation did not allow for')
+        np.testing.assert_array_equal(algo.bucket_volumes_lots, algo.volumes_per_trade_default_lots.sum(axis=1))
+
+        # with a small volume the participation reaches it before the end
+        algo = pov(volume=1, participation_rate=0.25)
+        self.assertEqual(algo.volumes_per_trade_default_lots.sum(), to_lots(algo.volume), 'Volume differs')
+        self.assertEqual(algo.bucket_volumes_lots[-1], 0, 'No volume should be left for the last bucket')
+        broker = Broker(self.lob_feed)
+        broker.simulate_algo(algo)
+        self.assertLess(algo.vol_remaining_lots, to_lots(algo.volume),
+                        'POVAlgo should be simulated like the TWAPAlgo')
+
+        with self.assertRaises(ValueError):
+            pov(volume=1, participation_rate=0)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            Broker(self.lob_feed, record_policy='ring')
+
+
+class TestTradeLog(unittest.TestCase):
+
+    messages = [{'timestamp': '2021-06-01 09:00:01.000000', 'message': 'no_trade', 'type': 'limit', 'side': 'bid',
+                 'price': Decimal('30.1'), 'quantity': Decimal('0'), 'target_quantity': Decimal('2')},
+                {'timestamp': '2021-06-01 09:00:02.000000', 'message': 'trade', 'type': 'limit', 'side': 'bid',
+                 'price': Decimal('30.2'), 'quantity': Decimal('2'), 'target_quantity': Decimal('2')},
+                {'timestamp': '2021-06-01 09:00:03.500000', 'message': 'trade', 'type': 'market', 'side': 'bid',
+                 'price': Decimal('30.5'), 'quantity': Decimal('1'), 'target_quantity': Decimal('1')},
+                {'timestamp': '2021-06-01 09:00:05.000000', 'message': 'trade', 'type': 'market', 'side': 'bid',
+                 'price': Decimal('31'), 'quantity': Decimal('1.5'), 'target_quantity': Decimal('1.5')}]
+
+    def setUp(self):
+        self.logs = TradeLog(capacity=2)
+        for message in self.messages:
+            self.logs.append(message)
+
+    def test_legacy_messages(self):
+        self.assertEqual(len(self.logs), 4, 'Log should grow beyond its initial capacity')
+        self.assertEqual(self.logs[1], self.messages[1], 'Message differs')
+        self.assertEqual(self.logs[-1]['timestamp'], self.messages[-1]['timestamp'], 'Last timestamp differs')
+        self.assertEqual(self.logs, self.messages, 'Iterated messages differ')
+        self.assertEqual(self.logs.data['price'].tolist(), [3010000000, 3020000000, 3050000000, 3100000000],
+                         'Prices should be held in int price units')
+        self.assertEqual(self.logs.data['quantity'].tolist(), [0, 200000000, 100000000, 150000000],
+                         'Quantities should be held in lots')
+
+        # the epoch ms of the caller are taken instead of parsing the timestamp
+        logs = TradeLog()
+        logs.append(dict(self.messages[1], timestamp=None), ts_ms=int(self.logs.data['ts_ms'][1]))
+        self.assertEqual(logs[0], self.messages[1], 'Message differs')
+
+    def test_time_filter_and_vwap(self):
+        self.assertEqual(self.logs.index_after(datetime(2021, 6, 1, 9, 0, 2)), 2, 'Start index incorrect')
+        self.assertEqual(self.logs.index_at_or_after(datetime(2021, 6, 1, 9, 0, 3, 499999)), 2, 'End index incorrect')
+        self.assertEqual(self.logs.index_at_or_after(datetime(2021, 6, 1, 9, 0, 3, 500001)), 3, 'End index incorrect')
+        self.assertAlmostEqual(self.logs.vwap(), (30.2 * 2 + 30.5 + 31 * 1.5) / 4.5, 12, 'VWAP incorrect')
+        self.assertAlmostEqual(self.logs.vwap(2, 3), 30.5, 12, 'VWAP of a window incorrect')
+        self.assertEqual(self.logs.vwap(0, 1), 0, 'VWAP without trades should be 0')
+
+    def test_broker_vwap_window(self):
+        broker = Broker(None)
+        broker.trade_logs['benchmark_algo'] = self.logs
+        self.assertEqual(broker.calc_vwap_from_logs()[1], 0, 'VWAP without logs should be 0')
+        broker.trade_logs['rl_algo'].append(self.messages[-1])
+        vwap_bmk, vwap_rl = broker.calc_vwap_from_logs(start_date=datetime(2021, 6, 1, 9, 0, 1),
+                                                       end_date=datetime(2021, 6, 1, 9, 0, 3))
+        self.assertAlmostEqual(vwap_bmk, (30.2 * 2 + 30.5) / 3, 12, 'VWAP between dates incorrect')
+        self.assertEqual(vwap_rl, 31, 'VWAP of the RL algo incorrect')
+        with self.assertRaises(ValueError):
+            broker.calc_vwap_from_logs(start_date=datetime(2021, 6, 1, 9, 0, 5))
+
+    def test_vwap_checkpoints(self):
+        broker = Broker(None)
+        for message in self.messages[:2]:
+            broker.trade_logs['benchmark_algo'].append(message)
+            broker.trade_logs['rl_algo'].append(message)
+        broker.set_vwap_checkpoint('step')
+        with self.assertRaises(ValueError):
+            broker.calc_vwap_since_checkpoint('step')
+        for message in self.messages[2:]:
+            broker.trade_logs['benchmark_algo'].append(message)
+        broker.trade_logs['rl_algo'].append(self.messages[2])
+        vwap_bmk, vwap_rl = broker.calc_vwap_since_checkpoint('step')
+        self.assertEqual(vwap_bmk, float((Decimal('30.5') + Decimal('31') * Decimal('1.5')) / Decimal('2.5')),
+                         'VWAP since checkpoint incorrect')
+        self.assertEqual(vwap_rl, 30.5, 'VWAP since checkpoint incorrect')
+
+    def test_head_view(self):
+        head = self.logs.head(2)
+        self.assertEqual(len(head), 2, 'Length of the view incorrect')
+        self.assertEqual(head[-1], self.messages[1], 'Last message of the view differs')
+        self.assertEqual(head.vwap(), 30.2, 'VWAP of the view incorrect')
+        self.assertEqual(head.index_after(datetime(2021, 6, 1, 9, 0, 4)), 2, 'View should not see later logs')
+
+    def test_running_sums_match_reference(self):
+        rng = np.random.RandomState(0)
+        logs = TradeLog(capacity=4)
+        messages = []
+        for idx in range(3000):
+            traded = rng.rand() < 0.7
+            message = {'timestamp': '2021-06-01 09:00:00.000000', 'message': 'trade' if traded else 'no_trade',
+                       'type': 'limit', 'side': 'bid', 'price': Decimal(int(rng.randint(3000000, 4000000))) / 100,
+                       'quantity': Decimal(int(rng.randint(1, 10 ** 6))) / 1000 if traded else Decimal('0'),
+                       'target_quantity': Decimal('1000')}
+            if idx % 500 == 250:
+                # a run of resting orders logged in one go
+                logs.extend_no_trades(np.zeros(40, dtype=np.int64), np.full(40, 35000.5), message)
+                messages += [dict(message, message='no_trade', price=Decimal('35000.5'), quantity=Decimal('0'))] * 40
+            logs.append(message, ts_ms=0)
+            messages.append(message)
+
+        for start_idx, end_idx in ((0, None), (0, 1), (17, 2500), (250, 291), (1200, 1201), (2999, None)):
+            window = [m for m in messages[start_idx:end_idx] if m['message'] == 'trade']
+            volume = sum(m['quantity'] for m in window)
+            expected = float(sum(m['price'] * m['quantity'] for m in window) / volume) if volume else 0
+            self.assertEqual(logs.vwap(start_idx, end_idx), expected,
+                             'VWAP of [{}, {}) differs from the reference'.format(start_idx, end_idx))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -74,7 +74,7 @@ class TestExecutionAlgo(unittest.TestCase):
                     broker_data_feed=fake_lob)
 
     # define the broker class
-    broker = Broker(fake_lob)
+    broker = Broker(fake_lob, record_policy='full')
     broker.benchmark_algo = algo
     broker.simulate_algo(algo)
 
@@ -202,7 +202,7 @@ class TestExecutionLogic(unittest.TestCase):
                         broker_data_feed=fake_lob)
 
         # define the broker class
-        broker = Broker(fake_lob)
+        broker = Broker(fake_lob, record_policy='full')
         broker.benchmark_algo = algo
         broker.simulate_algo(algo)
 
@@ -225,7 +225,7 @@ class TestExecutionLogic(unittest.TestCase):
                         broker_data_feed=fake_lob)
 
         # define the broker class
-        broker = Broker(fake_lob)
+        broker = Broker(fake_lob, record_policy='full')
         broker.benchmark_algo = algo
         broker.simulate_algo(algo)
 
@@ -248,7 +248,7 @@ class TestExecutionLogic(unittest.TestCase):
                         broker_data_feed=fake_lob)
 
         # define the broker class
-        broker = Broker(fake_lob)
+        broker = Broker(fake_lob, record_policy='full')
         broker.benchmark_algo = algo
         broker.simulate_algo(algo)
 
@@ -270,7 +270,7 @@ class TestExecutionLogic(unittest.TestCase):
                         broker_data_feed=fake_lob)
 
         # define the broker class
-        broker = Broker(fake_lob)
+        broker = Broker(fake_lob, record_policy='full')
         broker.benchmark_algo = algo
         broker.simulate_algo(algo)
 
@@ -0,0 +1,446 @@
+import unittest
+import os
+import tempfile
+import calendar
+from datetime import datetime
+
+import numpy as np
+
+from src.data.historical_data_feed import HistoricalDataFeed, MemmapDays
+from decimal import Decimal
+from src.core.environment.env_utils import raw_to_order_book, infer_tick_size, split_book_to_orders, level_depletion
+from src.core.environment.orderbook import OrderBook, TickOrderBook
+from src.core.environment.limit_orders_setup.base_env import LobWindowBuffer, lob_window_to_numpy, \
+    min_max_rescaling
+
+
+LOB_DEPTH = 3
+
+
+def write_fake_day_file(data_dir, day, n_rows=120):
+    """ Writes a day file in the flat binary format with one snapshot per second from 09:00:00 onwards """
+
+    start = calendar.timegm(datetime(2021, 6, day, 9, 0, 0).utctimetuple()) * 1e3
+    rows = np.zeros((n_rows, 4 * LOB_DEPTH + 1))
+    rows[:, 0] = start + np.arange(n_rows) * 1e3
+    mid = 30 + np.arange(n_rows) * 0.1
+    for level in range(LOB_DEPTH):
+        rows[:, 1 + level] = np.round(mid + 0.1 * (level + 1), 2)                    # ask prices
+        rows[:, 1 + LOB_DEPTH + level] = 1 + level                                    # ask quantities
+        rows[:, 1 + 2 * LOB_DEPTH + level] = np.round(mid - 0.1 * (level + 1), 2)    # bid prices
+        rows[:, 1 + 3 * LOB_DEPTH + level] = 1 + level                                # bid quantities
+    rows.tofile(os.path.join(data_dir, "btcusdt__2021_06_{:02d}.dat".format(day)))
+    return rows
+
+
+class TestMemmapDataFeed(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.rows = np.concatenate([write_fake_day_file(cls.tmp_dir.name, day) for day in (1, 2)], axis=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def _feed(self, mmap):
+        return HistoricalDataFeed(data_dir=self.tmp_dir.name,
+                                  instrument='btcusdt',
+                                  start_day=datetime(2021, 6, 1),
+                                  end_day=datetime(2021, 6, 2),
+                                  lob_depth=LOB_DEPTH,
+                                  mmap=mmap)
+
+    def test_memmap_matches_in_memory(self):
+        feed_mem = self._feed(mmap=False)
+        feed_mmap = self._feed(mmap=True)
+
+        self.assertIsInstance(feed_mmap.data, MemmapDays, 'Multiple days should stay separate memmaps')
+        self.assertEqual(feed_mmap.data.shape, feed_mem.data.shape, 'Shapes of loaded data differ')
+        np.testing.assert_array_equal(feed_mmap.data[:, 0], feed_mem.data[:, 0])
+        # slices within a day and across the day boundary
+        np.testing.assert_array_equal(feed_mmap.data[10:20], self.rows[10:20])
+        np.testing.assert_array_equal(feed_mmap.data[115:125], self.rows[115:125])
+        np.testing.assert_array_equal(feed_mmap.data[-1], self.rows[-1])
+
+    def test_memmap_snapshots(self):
+        feed_mem = self._feed(mmap=False)
+        feed_mmap = self._feed(mmap=True)
+        for feed in (feed_mem, feed_mmap):
+            feed.reset(time='2021-06-01 09:01:58')
+        for _ in range(4):
+            dt_mem, lob_mem = feed_mem.next_lob_snapshot(lob_format=False)
+            dt_mmap, lob_mmap = feed_mmap.next_lob_snapshot(lob_format=False)
+            self.assertEqual(dt_mem, dt_mmap, 'Timestamps of snapshots differ')
+            np.testing.assert_array_equal(lob_mem, lob_mmap)
+
+
+class TestTimestampSeek(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        for day in (1, 2):
+            write_fake_day_file(cls.tmp_dir.name, day)
+        cls.feed = HistoricalDataFeed(data_dir=cls.tmp_dir.name,
+                                      instrument='btcusdt',
+                                      start_day=datetime(2021, 6, 1),
+                                      end_day=datetime(2021, 6, 2),
+                                      lob_depth=LOB_DEPTH)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_row_after(self):
+        # snapshots are at full seconds, so the row after an exact timestamp is the next one
+        self.assertEqual(self.feed.row_after('2021-06-01 09:00:00'), 1, 'Row after a snapshot time is incorrect')
+        self.assertEqual(self.feed.row_after('2021-06-01 09:00:00.500000'), 1, 'Row after a sub-second time is incorrect')
+        self.assertEqual(self.feed.row_after(datetime(2021, 6, 2, 9, 0, 30)), 120 + 31, 'Row on second day is incorrect')
+        self.assertEqual(self.feed.row_after(datetime(2021, 6, 1, 12, 0, 0)), 120, 'Row after end of first day is incorrect')
+        ms = int(self.feed.data[10, 0])
+        self.assertEqual(self.feed.row_after(ms), 11, 'Seeking epoch milliseconds is incorrect')
+
+    def test_snapshot_at(self):
+        self.feed.seek(datetime(2021, 6, 1, 9, 0, 0))
+        row_idx = self.feed.row_after(datetime(2021, 6, 2, 9, 0, 30))
+        dt, _ = self.feed.snapshot_at(row_idx)
+        self.assertEqual(dt, datetime(2021, 6, 2, 9, 0, 31), 'Snapshot at cursor is incorrect')
+        dt, _ = self.feed.next_lob_snapshot()
+        self.assertEqual(dt, datetime(2021, 6, 1, 9, 0, 1), 'Reading at a cursor should not move the feed')
+
+    def test_seek(self):
+        self.feed.seek(datetime(2021, 6, 1, 9, 1, 0))
+        dt, _ = self.feed.next_lob_snapshot(lob_format=False)
+        self.assertEqual(dt, datetime(2021, 6, 1, 9, 1, 1), 'First snapshot after seek is incorrect')
+
+
+class TestLobSnapshot(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        write_fake_day_file(cls.tmp_dir.name, 1)
+        cls.feed = HistoricalDataFeed(data_dir=cls.tmp_dir.name,
+                                      instrument='btcusdt',
+                                      start_day=datetime(2021, 6, 1),
+                                      end_day=datetime(2021, 6, 1),
+                                      lob_depth=LOB_DEPTH,
+                                      time='2021-06-01 09:00:10')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_queries_match_order_book(self):
+        dt, snapshot = self.feed.next_lob_snapshot()
+        book = raw_to_order_book(current_book=np.array(snapshot.levels),
+                                 time=dt.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                                 depth=LOB_DEPTH)
+        self.assertFalse(snapshot.is_materialised, 'Snapshot should not build an OrderBook for queries')
+        self.assertEqual(snapshot.get_best_bid(), book.get_best_bid(), 'Best bid differs')
+        self.assertEqual(snapshot.get_best_ask(), book.get_best_ask(), 'Best ask differs')
+        self.assertEqual(list(snapshot.bids.prices), list(book.bids.prices), 'Bid prices differ')
+        self.assertEqual(list(snapshot.asks.prices), list(book.asks.prices), 'Ask prices differ')
+        for p in book.bids.prices:
+            self.assertEqual(snapshot.bids.get_price_list(p).volume, book.bids.get_price_list(p).volume,
+                             'Bid volume at price differs')
+        p = book.asks.prices[-1]
+        self.assertEqual(snapshot.get_volume_at_price('ask', p), book.get_volume_at_price('ask', p),
+                         'Ask volume at price differs')
+
+    def test_sweep_matches_market_order(self):
+        _, snapshot = self.feed.next_lob_snapshot()
+        # levels have 1, 2 and 3 units, so 2.5 units take the first level and part of the second
+        for side, quantity in (('bid', Decimal('2.5')), ('ask', Decimal('1')), ('bid', Decimal('10'))):
+            swept, booked = snapshot.snapshot(), snapshot.snapshot()
+            filled, vwap, n_levels = swept.sweep(side, quantity)
+            trades, _ = booked.process_order({'type': 'market', 'timestamp': 0, 'side': side,
+                                              'quantity': quantity, 'trade_id': 1}, True, False)
+            self.assertFalse(swept.is_materialised, 'Sweeping should not build an OrderBook')
+            self.assertEqual(filled, sum(t['quantity'] for t in trades), 'Filled quantity differs')
+            self.assertEqual(vwap, sum(t['price'] * t['quantity'] for t in trades) / filled, 'VWAP differs')
+            self.assertEqual(n_levels, len(trades), 'Number of traded levels differs')
+            self.assertEqual(list(swept.asks.prices), list(booked.asks.prices), 'Remaining asks differ')
+            self.assertEqual([swept.bids.get_price_list(p).volume for p in swept.bids.prices],
+                             [booked.bids.get_price_list(p).volume for p in booked.bids.prices],
+                             'Remaining bid volumes differ')
+            self.assertEqual(swept.book.get_best_ask(), booked.get_best_ask(), 'Book built after a sweep differs')
+        self.assertFalse(snapshot.is_materialised, 'Sweeping a copy should not change the snapshot')
+
+    def test_lazy_matching(self):
+        _, snapshot = self.feed.next_lob_snapshot()
+        best_ask = snapshot.get_best_ask()
+        trades, _ = snapshot.process_order({'type': 'market', 'timestamp': 0, 'side': 'bid',
+                                            'quantity': snapshot.asks.get_price_list(best_ask).volume,
+                                            'trade_id': 1}, True, False)
+        self.assertTrue(snapshot.is_materialised, 'Matching an order should build the OrderBook')
+        self.assertEqual(trades[0]['price'], best_ask, 'Market order should trade at the best ask')
+        self.assertGreater(snapshot.get_best_ask(), best_ask, 'Best ask level should have been consumed')
+        self.assertEqual(len(snapshot.tape), 1, 'Trade should be recorded on the tape')
+
+    def test_snapshot_copy_on_write(self):
+        _, snapshot = self.feed.next_lob_snapshot()
+        book = snapshot.book
+        frozen = snapshot.snapshot()
+        self.assertIs(frozen.book.asks, book.asks, 'Snapshot should share the trees until a change')
+        best_ask = book.get_best_ask()
+        frozen.process_order({'type': 'market', 'timestamp': 0, 'side': 'bid',
+                              'quantity': frozen.asks.get_price_list(best_ask).volume, 'trade_id': 1}, True, False)
+        self.assertIsNot(frozen.book.asks, book.asks, 'Trees should be copied when matching against the snapshot')
+        self.assertEqual(book.get_best_ask(), best_ask, 'Matching against a snapshot changed the original book')
+        self.assertEqual(len(book.tape), 0, 'Matching against a snapshot changed the original tape')
+        self.assertGreater(frozen.get_best_ask(), best_ask, 'Best ask level should have been consumed')
+
+
+class TestLobWindow(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.rows = write_fake_day_file(cls.tmp_dir.name, 1)
+        cls.feed = HistoricalDataFeed(data_dir=cls.tmp_dir.name,
+                                      instrument='btcusdt',
+                                      start_day=datetime(2021, 6, 1),
+                                      end_day=datetime(2021, 6, 1),
+                                      lob_depth=LOB_DEPTH,
+                                      time='2021-06-01 09:00:10')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_window_matches_snapshots(self):
+        past_dts, past_lobs = self.feed.past_lob_snapshots(no_of_past_lobs=5, lob_format=False)
+        timestamps, levels = self.feed.past_lob_window(no_of_past_lobs=5)
+        self.assertEqual(levels.shape, (5, 4, LOB_DEPTH), 'Window has the wrong shape')
+        self.assertEqual(timestamps.dtype, np.dtype('datetime64[ms]'), 'Timestamps should be datetime64[ms]')
+        self.assertEqual(list(timestamps.astype(datetime)), past_dts, 'Window timestamps differ')
+        np.testing.assert_array_equal(levels, np.stack(past_lobs))
+        self.assertTrue(np.shares_memory(levels, self.feed.data), 'Window should be a view on the data')
+        self.assertFalse(levels.flags.writeable, 'Window should be read-only')
+
+    def test_rolling_window_buffer(self):
+        buffer = LobWindowBuffer(size=5, depth=2)
+        # forward by less than the window, by more than the window, backwards and at the start of the data
+        for end_row in (20, 22, 23, 40, 30, 3):
+            _, levels = self.feed.lob_window(end_row - 5, end_row)
+            prices, volumes = lob_window_to_numpy(levels, depth=2)
+            buffered_prices, buffered_volumes, mids = buffer.window(self.feed, end_row)
+            np.testing.assert_array_equal(buffered_prices, prices)
+            np.testing.assert_array_equal(buffered_volumes, volumes)
+            np.testing.assert_array_equal(mids, (levels[:, 0, 0] + levels[:, 2, 0]) / 2)
+
+    def test_rescaled_float32_window(self):
+        buffer = LobWindowBuffer(size=5, depth=2)
+        prices_out, volumes_out = np.empty((5, 4), dtype=np.float32), np.empty((5, 4), dtype=np.float32)
+        for end_row in (20, 23, 3):
+            n_rows = min(end_row, 5)
+            _, levels = self.feed.lob_window(end_row - 5, end_row)
+            prices, volumes = lob_window_to_numpy(levels, depth=2)
+            buffer.window(self.feed, end_row, prices_out[:n_rows], volumes_out[:n_rows], rescale=True)
+            # the differences are taken in float64, so only the float32 rounding of the results is lost
+            np.testing.assert_allclose(prices_out[:n_rows], min_max_rescaling(prices), rtol=2e-7, atol=1e-7)
+            np.testing.assert_allclose(volumes_out[:n_rows], min_max_rescaling(volumes), rtol=2e-7, atol=1e-7)
+
+    def test_level_depletion(self):
+        # the fake book moves up by one level per snapshot, which takes the best ask and one lot of the next one
+        _, levels = self.feed.lob_window(10, 20)
+        np.testing.assert_array_equal(level_depletion(levels), np.full(9, 2.))
+
+        # bids taken down to the 3rd level, which lost 1 of its 3 lots, and 1 of 2 lots taken from the best ask
+        previous = np.array(levels[0])
+        current = previous.copy()
+        current[2] = np.append(previous[2, 2:], [previous[2, 2] - 0.1, previous[2, 2] - 0.2])
+        current[3] = [2, 1, 1]
+        current[1, 0] -= 1
+        self.assertEqual(level_depletion(np.stack((previous, current))).tolist(), [1 + 2 + 1 + 1])
+
+
+class TestTickOrderBook(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.levels = write_fake_day_file(self.tmp_dir.name, 1, n_rows=1)[0, 1:].reshape(-1, LOB_DEPTH)
+        self.tick_size = infer_tick_size(self.levels[[0, 2]])
+        self.lot_size = infer_tick_size(self.levels[[1, 3]])
+        self.books = [raw_to_order_book(self.levels, '2021-06-01 09:00:00.000000', LOB_DEPTH),
+                      raw_to_order_book(self.levels, '2021-06-01 09:00:00.000000', LOB_DEPTH,
+                                        tick_size=self.tick_size, lot_size=self.lot_size)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_infer_tick_size(self):
+        self.assertEqual(self.tick_size, Decimal('0.1'), 'Tick size inferred incorrectly')
+        self.assertEqual(self.lot_size, Decimal('1'), 'Lot size inferred incorrectly')
+        self.assertEqual(infer_tick_size([30.25, 0.5, 12]), Decimal('0.01'), 'Tick size inferred incorrectly')
+
+    def test_matches_decimal_book(self):
+        decimal_book, tick_book = self.books
+        self.assertIsInstance(tick_book, TickOrderBook)
+        quotes = [{'type': 'market', 'timestamp': 0, 'side': 'bid', 'quantity': Decimal('4'), 'trade_id': 1},
+                  {'type': 'limit', 'timestamp': 0, 'side': 'ask', 'quantity': Decimal('1'), 'price': Decimal('29.85'),
+                   'trade_id': 2},
+                  {'type': 'limit', 'timestamp': 0, 'side': 'bid', 'quantity': Decimal('3'), 'price': Decimal('30.3'),
+                   'trade_id': 3}]
+        for quote in quotes:
+            decimal_trades, _ = decimal_book.process_order(dict(quote), False, False)
+            tick_trades, _ = tick_book.process_order(dict(quote), False, False)
+            self.assertEqual([(t['price'], t['quantity']) for t in tick_trades],
+                             [(t['price'], t['quantity']) for t in decimal_trades], 'Trades differ')
+            self.assertEqual(tick_book.get_best_bid(), decimal_book.get_best_bid(), 'Best bid differs')
+            self.assertEqual(tick_book.get_best_ask(), decimal_book.get_best_ask(), 'Best ask differs')
+        self.assertIsInstance(tick_book.tape[-1]['price'], Decimal, 'Tape should hold Decimal prices')
+        for side in ('bid', 'ask'):
+            levels = tick_book.price_levels(side)
+            self.assertEqual(levels.prices, list(decimal_book.price_levels(side).prices), 'Price levels differ')
+            for p in levels.prices:
+                self.assertEqual(tick_book.get_volume_at_price(side, p), decimal_book.get_volume_at_price(side, p),
+                                 'Volume at price differs')
+
+
+    def test_sub_lot_quantity(self):
+        tick_book = self.books[1]
+        best_ask = tick_book.get_best_ask()
+        for order_type in ('market', 'limit'):
+            with self.assertRaises(ValueError):
+                tick_book.process_order({'type': order_type, 'timestamp': 0, 'side': 'bid', 'quantity': Decimal('0.4'),
+                                         'price': best_ask, 'trade_id': 1}, False, False)
+        self.assertEqual(tick_book.get_best_ask(), best_ask, 'Rejected order should not change the book')
+        trades, _ = tick_book.process_order({'type': 'market', 'timestamp': 0, 'side': 'bid',
+                                             'quantity': Decimal('0.6'), 'trade_id': 1}, False, False)
+        self.assertEqual(trades[0]['quantity'], Decimal('1'), 'Quantity should be rounded to the nearest lot')
+
+class TestOrderBookFromArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.levels = write_fake_day_file(self.tmp_dir.name, 1, n_rows=1)[0, 1:].reshape(-1, LOB_DEPTH)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _order_state(self, book):
+        return [(o.order_id, o.trade_id, o.timestamp, o.price, o.quantity)
+                for tree in (book.bids, book.asks) for o in tree.order_map.values()]
+
+    def test_same_as_processing_orders(self):
+        reference = OrderBook()
+        for quote in split_book_to_orders(self.levels, '2021-06-01 09:00:00.000000', LOB_DEPTH)[2]:
+            reference.process_order(quote, False, False)
+        book = OrderBook.from_arrays(*self.levels, timestamp='2021-06-01 09:00:00.000000')
+
+        self.assertEqual(sorted(self._order_state(book)), sorted(self._order_state(reference)), 'Orders differ')
+        self.assertEqual((book.time, book.next_order_id), (reference.time, reference.next_order_id),
+                         'Time and order id counters differ')
+        self.assertEqual(list(book.bids.prices), list(reference.bids.prices), 'Bid prices differ')
+        self.assertEqual((book.asks.volume, book.asks.depth, book.asks.num_orders),
+                         (reference.asks.volume, reference.asks.depth, reference.asks.num_orders), 'Ask tree differs')
+
+        quote = {'type': 'limit', 'timestamp': 0, 'side': 'bid', 'quantity': Decimal('4'),
+                 'price': Decimal('30.25'), 'trade_id': 7}
+        trades, in_book = book.process_order(dict(quote), False, False)
+        reference_trades, reference_in_book = reference.process_order(dict(quote), False, False)
+        self.assertEqual(trades, reference_trades, 'Trades differ')
+        self.assertEqual(in_book, reference_in_book, 'Order placed in the book differs')
+        self.assertEqual(sorted(self._order_state(book)), sorted(self._order_state(reference)),
+                         'Orders differ after matching')
+
+    def test_update_copies_only_changed_levels(self):
+        book = OrderBook.from_arrays(*self.levels)
+        levels = self.levels.copy()
+        levels[1, 0] += 1 # best ask quantity
+        frozen = book.snapshot()
+        book.update_levels(self.levels, levels)
+        changed_price, unchanged_price = book._level_prices(levels[0, :2])
+        self.assertIsNot(book.asks.get_price_list(changed_price), frozen.asks.get_price_list(changed_price),
+                         'Changed level should be copied')
+        self.assertIs(book.asks.get_price_list(unchanged_price), frozen.asks.get_price_list(unchanged_price),
+                      'Unchanged level should stay shared')
+        self.assertEqual(frozen.get_volume_at_price('ask', changed_price), self.levels[1, 0],
+                         'Updating the book changed its snapshot')
+        self.assertEqual(book.get_volume_at_price('ask', changed_price), levels[1, 0], 'Level was not updated')
+
+
+class TestPersistentBook(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        write_fake_day_file(cls.tmp_dir.name, 1)
+        cls.feed = HistoricalDataFeed(data_dir=cls.tmp_dir.name,
+                                      instrument='btcusdt',
+                                      start_day=datetime(2021, 6, 1),
+                                      end_day=datetime(2021, 6, 1),
+                                      lob_depth=LOB_DEPTH,
+                                      persistent_book=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def _levels(self, book):
+        return [[(p, book.get_volume_at_price(side, p)) for p in tree.prices]
+                for side, tree in (('bid', book.bids), ('ask', book.asks))]
+
+    def test_book_follows_snapshots(self):
+        for row_idx in (5, 6, 8, 30, 7):
+            book = self.feed.book_at(row_idx)
+            fresh = raw_to_order_book(current_book=np.array(self.feed.data[row_idx, 1:]).reshape(-1, LOB_DEPTH),
+                                      time='', depth=LOB_DEPTH)
+            self.assertEqual(self._levels(book), self._levels(fresh), 'Levels differ at row {}'.format(row_idx))
+
+    def test_matching_does_not_change_persistent_book(self):
+        self.feed.reset(time='2021-06-01 09:00:10')
+        _, snapshot = self.feed.next_lob_snapshot()
+        snapshot.process_order({'type': 'market', 'timestamp': 0, 'side': 'bid', 'quantity': Decimal('2'),
+                                'trade_id': 1}, True, False)
+        self.assertNotEqual(self._levels(snapshot.book), self._levels(self.feed.book_at(11)),
+                            'Matching should only change the copy of the snapshot')
+
+
+class TestVolumeProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _feed(self, **kwargs):
+        return HistoricalDataFeed(data_dir=self.tmp_dir.name, instrument='btcusdt', lob_depth=LOB_DEPTH, **kwargs)
+
+    def _write_day(self, active_from_row):
+        """ Fake day where the best ask quantity only changes from 'active_from_row' onwards """
+        rows = write_fake_day_file(self.tmp_dir.name, 1)
+        rows[active_from_row:, 1 + LOB_DEPTH] += np.arange(len(rows) - active_from_row) % 2
+        rows.tofile(os.path.join(self.tmp_dir.name, "btcusdt__2021_06_01.dat"))
+
+    def test_profile(self):
+        self._write_day(active_from_row=60)
+        profile = self._feed(start_day=datetime(2021, 6, 1), end_day=datetime(2021, 6, 1)).volume_profile(60)
+        self.assertEqual(profile.shape, (24 * 60,), 'Profile should have a bin per minute')
+        self.assertEqual(profile[9 * 60 + 1], 1, 'All activity is between 09:01 and 09:02')
+        self.assertEqual(profile.sum(), 1, 'Profile should be normalised')
+        with self.assertRaises(ValueError):
+            self._feed().volume_profile(7)
+
+    def test_cached_next_to_data(self):
+        self._write_day(active_from_row=60)
+        feed = self._feed()
+        feed.volume_profile(60)
+        self.assertEqual(len([f for f in os.listdir(self.tmp_dir.name) if f.endswith('.npy')]), 1,
+                         'Profile should be cached next to the day files')
+        self.assertEqual(self._feed().binary_files, ['btcusdt__2021_06_01.dat'], 'Cached profile is no day file')
+
+        # rewriting the day file invalidates the cached profile
+        self._write_day(active_from_row=0)
+        os.utime(os.path.join(self.tmp_dir.name, "btcusdt__2021_06_01.dat"), ns=(0, 0))
+        profile = self._feed().volume_profile(60)
+        self.assertLess(profile[9 * 60 + 1], 1, 'Profile should be computed from the new data')
+
+
+if __name__ == '__main__':
+    unittest.main()
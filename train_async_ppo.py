@@ -115,7 +115,8 @@ def lob_env_creator(env_config):
     lob_feed = HistoricalDataFeed(data_dir=os.path.join(DATA_DIR, "market", env_config['train_config']["symbol"]),
                                   instrument=env_config['train_config']["symbol"],
                                   start_day=data_start_day,
-                                  end_day=data_end_day)
+                                  end_day=data_end_day,
+                                  mmap=True)
 
     exclude_keys = {'train_config'}
     env_config_clean = {k: env_config[k] for k in set(list(env_config.keys())) - set(exclude_keys)}
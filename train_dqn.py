@@ -18,6 +18,7 @@ from ray.tune.logger import pretty_print
 from src.data.historical_data_feed import HistoricalDataFeed
 from src.core.environment.limit_orders_setup.broker import Broker
 from src.core.environment.limit_orders_setup.base_env import BaseEnv
+from src.core.environment.limit_orders_setup.execution_algo import scale_lots
 
 
 class NarrowTradeLimitEnvDQN(BaseEnv):
@@ -39,13 +40,12 @@ class NarrowTradeLimitEnvDQN(BaseEnv):
         return action_out
 
     def infer_volume_from_action(self, action):
-        vol_to_trade = Decimal(str(action)) * \
-                       self.broker.benchmark_algo.volumes_per_trade[self.broker.rl_algo.bucket_idx][self.broker.benchmark_algo.order_idx]
-        factor = 10 ** (- self.broker.benchmark_algo.tick_size.as_tuple().exponent)
-        vol_to_trade = Decimal(str(math.floor(vol_to_trade * factor) / factor))
-        if vol_to_trade > self.broker.rl_algo.bucket_vol_remaining[self.broker.rl_algo.bucket_idx]:
-            vol_to_trade = self.broker.rl_algo.bucket_vol_remaining[self.broker.rl_algo.bucket_idx]
-        return vol_to_trade
+        rl_algo = self.broker.rl_algo
+        vol_to_trade = scale_lots(self.broker.benchmark_algo.volumes_per_trade_lots[rl_algo.bucket_idx,
+                                                                                   self.broker.benchmark_algo.order_idx],
+                                  action)
+        vol_to_trade = vol_to_trade // rl_algo.tick_lots * rl_algo.tick_lots
+        return min(vol_to_trade, int(rl_algo.bucket_vol_remaining_lots[rl_algo.bucket_idx]))
 
     def reward_func(self):
         """ Env with reward at end of each bucket as $ improvement of VWAP """
@@ -53,8 +53,7 @@ class NarrowTradeLimitEnvDQN(BaseEnv):
         reward = 0
         try:
             if self.bucket_time != self.bucket_time_prev:
-                vwap_bmk, vwap_rl = self.broker.calc_vwap_from_logs(start_date=self.bucket_time_prev,
-                                                                    end_date=self.bucket_time)
+                vwap_bmk, vwap_rl = self.broker.calc_vwap_since_checkpoint('bucket')
                 if self.trade_dir == 1:
                     reward = np.sign(vwap_bmk - vwap_rl)
                 else:
@@ -133,7 +132,8 @@ def lob_env_creator(env_config):
     lob_feed = HistoricalDataFeed(data_dir=os.path.join(DATA_DIR, "market", env_config['train_config']["symbol"]),
                                   instrument=env_config['train_config']["symbol"],
                                   start_day=data_start_day,
-                                  end_day=data_end_day)
+                                  end_day=data_end_day,
+                                  mmap=True)
 
     exclude_keys = {'train_config'}
     env_config_clean = {k: env_config[k] for k in set(list(env_config.keys())) - set(exclude_keys)}
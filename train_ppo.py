@@ -179,7 +179,8 @@ def lob_env_creator(env_config):
     lob_feed = HistoricalDataFeed(data_dir=os.path.join(DATA_DIR, "market", env_config["train_config"]["symbol"]),
                                   instrument=env_config["train_config"]["symbol"],
                                   start_day=data_start_day,
-                                  end_day=data_end_day)
+                                  end_day=data_end_day,
+                                  mmap=True)
 
 
     # action_space = gym.spaces.Box(low=-1.0,